@@ -20,7 +20,10 @@ if PROJECT_ROOT not in sys.path:
     sys.path.insert(0, PROJECT_ROOT)
 # Import core modules
 from src.utils import ConfigManager, validate_api_keys, fuzzy_match_text
-from src.embedder import create_or_load_index
+from src.embedder import create_or_load_index, open_snapshot, get_query_dispatcher_stats, get_query_cache_stats
+from src.snapshots import SnapshotWatcher
+from src.index_status import start_background_build
+from src.model_registry import memory_report, process_memory
 from src.rag_pipeline import rag_answer
 from src.voice_modules import play_tts, load_domain_keywords, LiveMicRecorder, DOMAIN_KEYWORDS
 from src.translator import detect_language, translate_text, ALLOWED_LANGUAGES
@@ -706,25 +709,35 @@ if "chat_history_loaded" not in st.session_state:
 # ------------------------
 # Initialize FAISS index
 # ------------------------
-@st.cache_resource
-def init_index():
-    """Initialize FAISS index with document chunks."""
-    all_chunks = load_documents_from_folder(DATA_FOLDER)
+def _build_index(status):
+    """Load documents and build/load the index (runs on the index-build thread)."""
+    all_chunks = load_documents_from_folder(DATA_FOLDER, progress=status)
     if not all_chunks:
         print("⚠️ No valid documents found in data folder")
-        return None, None, []
-    index, metas = create_or_load_index(all_chunks, rebuild=False)
-    file_chunk_count = {}
-    for chunk in metas:
-        metadata = chunk.get("metadata", {})
-        src = metadata.get("source_file", "Unknown")
-        file_chunk_count[src] = file_chunk_count.get(src, 0) + 1
+        return None
+    index, metas = create_or_load_index(all_chunks, rebuild=False, progress=status)
+    # Counts come from the chunk store's in-memory columns (no text reads)
+    file_chunk_count = metas.source_file_counts()
     print("✅ Files loaded with chunk counts:")
     for f, count in file_chunk_count.items():
         print(f" {f}: {count} chunks")
     print(f"✅ Index created with {len(metas)} total chunks")
-    return index, metas, all_chunks
-index, metas, all_chunks = init_index()
+    # Newly published snapshots (e.g. from `python -m src.bulk_embed`) are
+    # swapped in by a background thread; models stay loaded
+    return SnapshotWatcher(VECTOR_DB_PATH, open_snapshot, (index, metas)).start()
+@st.cache_resource
+def init_index():
+    """
+    Start loading, OCR and embedding on a background thread (once per
+    process). The page renders immediately; the returned status reports
+    progress and holds the SnapshotWatcher once ready.
+    """
+    return start_background_build(_build_index)
+index_build = init_index()
+index_watcher = index_build.result if index_build.ready else None
+# The chunk store pages text from disk, so it doubles as the chunk list
+index, metas = index_watcher.current() if index_watcher else (None, None)
+all_chunks = metas if metas is not None else []
 st.session_state.index = index
 st.session_state.metas = metas
 st.session_state.all_chunks = all_chunks
@@ -740,6 +753,11 @@ def _get_core_vars():
     api_key = API_KEY
     model_name = MODEL_NAME
     return idx, metas_local, api_key, model_name, DOMAIN_KEYWORDS
+def _answer_or_wait(query, idx, metas_local, api_key, model_name):
+    """rag_answer, or a "still indexing" reply while the background build runs."""
+    if idx is None and not index_build.ready:
+        return index_build.waiting_message()
+    return rag_answer(query, idx, metas_local, api_key, model_name)
 def format_response_with_proper_lists(text: str) -> str:
     """Format response for perfect rendering."""
     if not text or not text.strip():
@@ -883,7 +901,11 @@ with st.sidebar:
         st.rerun()
     if st.session_state.collapse_system:
         try:
-            if not metas or index.ntotal == 0:
+            if not index_build.ready:
+                st.markdown(index_build.describe())
+                if st.button("🔄 Refresh status", key="refresh_index_status"):
+                    st.rerun()
+            elif not metas or index.ntotal == 0:
                 st.markdown("❌ RAG pipeline Not loaded")
             else:
                 st.markdown("✅ RAG pipeline Working")
@@ -1146,6 +1168,19 @@ def render_chatbot_tab():
         """,
         unsafe_allow_html=True
     )
+    # Index still building in the background: show progress, chat stays usable
+    if not index_build.ready:
+        progress = index_build.snapshot()
+        if index_build.failed:
+            st.error(index_build.describe())
+        else:
+            st.info(index_build.describe())
+            if progress["state"] == "embedding" and progress["chunks_total"]:
+                st.progress(progress["chunks_embedded"] / progress["chunks_total"])
+            elif progress["state"] == "loading" and progress["files_total"]:
+                st.progress(progress["files_done"] / progress["files_total"])
+            if st.button("🔄 Refresh", key="refresh_index_progress"):
+                st.rerun()
     # Chat display wrapper
     st.markdown('<div class="chat-wrapper">', unsafe_allow_html=True)
    
@@ -1477,7 +1512,7 @@ def render_chatbot_tab():
                     question_en = fuzzy_match_text(question_en, domain_keywords)
                    
                     try:
-                        rag_output = rag_answer(question_en, idx, metas_local, api_key, model_name)
+                        rag_output = _answer_or_wait(question_en, idx, metas_local, api_key, model_name)
                         if input_lang != "en":
                             rag_output = translate_text(rag_output, target_lang=input_lang)
                         response_parts.append(rag_output)
@@ -1494,7 +1529,7 @@ def render_chatbot_tab():
                     query_en = fuzzy_match_text(query_en, domain_keywords)
                    
                     try:
-                        rag_output = rag_answer(query_en, idx, metas_local, api_key, model_name)
+                        rag_output = _answer_or_wait(query_en, idx, metas_local, api_key, model_name)
                         if input_lang != "en":
                             rag_output = translate_text(rag_output, target_lang=input_lang)
                         response_parts.append(rag_output)
@@ -1830,6 +1865,44 @@ def render_system_status_tab():
     with st.expander("🌐 LANGUAGE CONFIGURATION"):
         st.success(f"✅ Supported Languages: {', '.join(ALLOWED_LANGUAGES)}")
         st.info("🌐 Language restriction: ONLY English and Swahili")
+
+    with st.expander("🧠 LOADED MODELS"):
+        for name, info in memory_report().items():
+            if not info["loaded"]:
+                st.info(f"⏸️ `{name}`: not loaded yet")
+                continue
+            sizes = []
+            if info["param_bytes"] is not None:
+                sizes.append(f"weights {info['param_bytes'] / 1e6:.0f} MB")
+            if info["rss_delta_bytes"] is not None:
+                sizes.append(f"RSS +{info['rss_delta_bytes'] / 1e6:.0f} MB at load")
+            st.success(f"✅ `{name}`: {', '.join(sizes) or 'size unknown'} (loaded in {info['load_seconds']:.1f}s)")
+        process = process_memory()
+        if process:
+            # Memory-mapped index pages shared with other app processes count as shared
+            st.markdown(
+                f"**This process:** RSS {process['rss_bytes'] / 1e6:.0f} MB = "
+                f"unique {process['unique_bytes'] / 1e6:.0f} MB + shared {process['shared_bytes'] / 1e6:.0f} MB "
+                f"(proportional share {process['pss_bytes'] / 1e6:.0f} MB)"
+            )
+
+    with st.expander("📈 EMBEDDING METRICS"):
+        dispatcher_stats = get_query_dispatcher_stats()
+        if dispatcher_stats:
+            st.markdown(
+                f"**Query batching:** {dispatcher_stats['batches']} batches, "
+                f"avg size {dispatcher_stats['avg_batch_size']:.1f} (max {dispatcher_stats['max_batch_size']}), "
+                f"queue depth {dispatcher_stats['queue_depth']} (max {dispatcher_stats['max_queue_depth']}), "
+                f"avg wait {dispatcher_stats['avg_queue_wait_ms']:.1f} ms"
+            )
+        else:
+            st.info("No query embeddings dispatched yet")
+        query_cache = get_query_cache_stats()
+        st.markdown(
+            f"**Query cache:** {query_cache['size']}/{query_cache['max_size']} entries, "
+            f"{query_cache['hits']} hits / {query_cache['misses']} misses "
+            f"({query_cache['hit_rate'] * 100:.0f}% hit rate)"
+        )
    
     st.markdown('</div>', unsafe_allow_html=True)
 def render_knowledge_base_tab():
@@ -1853,11 +1926,7 @@ def render_knowledge_base_tab():
         st.markdown("### 📊 Statistics")
        
         # Calculate file statistics
-        file_chunk_count = {}
-        for chunk in metas:
-            metadata = chunk.get("metadata", {})
-            src = metadata.get("source_file", "Unknown")
-            file_chunk_count[src] = file_chunk_count.get(src, 0) + 1
+        file_chunk_count = metas.source_file_counts()
        
         st.markdown(f"**Total Files:** {len(file_chunk_count)}")
         st.markdown(f"**Average Chunks per File:** {len(metas) // max(len(file_chunk_count), 1)}")
@@ -1911,9 +1980,10 @@ def render_chunk_preview_tab():
    
     start_idx = st.session_state.chunk_page * chunks_per_page
     end_idx = min(start_idx + chunks_per_page, len(all_chunks))
+    # Slice once so the chunk store fetches the whole page in one query
+    page_chunks = all_chunks[start_idx:end_idx]
    
-    for i in range(start_idx, end_idx):
-        chunk = all_chunks[i]
+    for i, chunk in zip(range(start_idx, end_idx), page_chunks):
         metadata = chunk.get("metadata", {})
         src_file = metadata.get("source_file", "Unknown")
         start_word = metadata.get("start_word", "N/A")
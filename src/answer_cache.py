@@ -0,0 +1,208 @@
+# src/answer_cache.py
+"""
+Semantic answer cache.
+
+The exact answer cache only matches a question asked with the same words:
+"how do I register on egp" and "how to register in e-GP" both pay for a
+full retrieval + Gemini call. This cache keeps the embedding of every
+answered query in a small inner-product index per namespace (language +
+metadata filter) and reuses the answer of the nearest previous query when
+
+    cosine similarity ≥ ANSWER_CACHE_SIMILARITY, and
+    both queries mention the same numbers ("rule 149" ≠ "rule 150")
+
+Semantic hits are audited. Every hit is logged with the matched query and
+its similarity, and a sample (ANSWER_CACHE_AUDIT_RATE) is answered again
+anyway: when the fresh answer disagrees with the cached one
+(ANSWER_CACHE_AUDIT_AGREEMENT) the hit is counted as false, the entry
+that served it is evicted, and the fresh answer is stored under the new
+query. The false-hit rate is the number to watch when lowering the
+threshold.
+"""
+import json
+import logging
+import random
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+import faiss
+import numpy as np
+from src.utils import ConfigManager
+logger = logging.getLogger(__name__)
+SEMANTIC_ANSWER_CACHE = ConfigManager.get("SEMANTIC_ANSWER_CACHE", "false", config_type=bool)
+# Cosine similarity between queries for a cached answer to be reused
+ANSWER_CACHE_SIMILARITY = ConfigManager.get("ANSWER_CACHE_SIMILARITY", 0.92, config_type=float)
+# Share of semantic hits answered again to check the cached answer
+ANSWER_CACHE_AUDIT_RATE = ConfigManager.get("ANSWER_CACHE_AUDIT_RATE", 0.05, config_type=float)
+# Answer similarity below which an audited hit counts as false
+ANSWER_CACHE_AUDIT_AGREEMENT = ConfigManager.get("ANSWER_CACHE_AUDIT_AGREEMENT", 0.85, config_type=float)
+# Optional JSON-lines file receiving every semantic hit and audit verdict
+ANSWER_CACHE_AUDIT_FILE = ConfigManager.get("ANSWER_CACHE_AUDIT_FILE", "")
+# Nearest previous queries checked per lookup
+CANDIDATES = 4
+AUDIT_LOG_SIZE = 500
+_NUMBER = re.compile(r"\d+(?:[./-]\d+)*")
+def namespace(lang: str, filters=None) -> str:
+    """Cache partition of a query: answers never cross languages or filters."""
+    key = lang or ""
+    if filters:
+        key += ":" + json.dumps(filters, sort_keys=True, default=str)
+    return key
+def _numbers(text: str):
+    return frozenset(_NUMBER.findall(text))
+class SemanticAnswerCache:
+    """Thread-safe LRU of answered queries, looked up by embedding similarity."""
+    def __init__(self, embed_fn, max_size: int = 1000, threshold: float = None,
+                 audit_rate: float = None, audit_file: str = None):
+        """
+        Args:
+            embed_fn: Callable(text) -> L2-normalized 1-D query vector
+            max_size: Answers kept
+            threshold: Minimum query cosine similarity (defaults to ANSWER_CACHE_SIMILARITY)
+            audit_rate: Share of hits to verify (defaults to ANSWER_CACHE_AUDIT_RATE)
+            audit_file: JSON-lines audit log (defaults to ANSWER_CACHE_AUDIT_FILE)
+        """
+        self.embed_fn = embed_fn
+        self.max_size = max_size
+        self.threshold = ANSWER_CACHE_SIMILARITY if threshold is None else threshold
+        self.audit_rate = ANSWER_CACHE_AUDIT_RATE if audit_rate is None else audit_rate
+        self.audit_file = ANSWER_CACHE_AUDIT_FILE if audit_file is None else audit_file
+        self._entries = OrderedDict()
+        self._indexes = {}
+        self._next_id = 0
+        self._audit_log = deque(maxlen=AUDIT_LOG_SIZE)
+        self._lock = threading.Lock()
+        self.reset_stats()
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.audits = 0
+        self.false_hits = 0
+    def _vector(self, query: str):
+        return np.ascontiguousarray(np.asarray(self.embed_fn(query), dtype="float32").reshape(1, -1))
+    def _index(self, ns: str, dim: int):
+        # Keyed by dimension too: a reduced index (EMBED_REDUCTION) changes query vectors
+        index = self._indexes.get((ns, dim))
+        if index is None:
+            index = self._indexes[(ns, dim)] = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+        return index
+    # ---------- lookup / store ----------
+    def lookup(self, query: str, lang: str, filters=None):
+        """
+        Answer of the closest previous query, if close enough.
+        Returns:
+            None on a miss, else dict with answer, matched_query, similarity,
+            entry_id, namespace and audit (True when the caller should answer
+            anyway and pass the result to audit())
+        """
+        v = self._vector(query)
+        ns = namespace(lang, filters)
+        numbers = _numbers(query)
+        with self._lock:
+            index = self._indexes.get((ns, v.shape[1]))
+            hit = None
+            if index is not None and index.ntotal:
+                sims, ids = index.search(v, min(CANDIDATES, index.ntotal))
+                for sim, entry_id in zip(sims[0], ids[0]):
+                    entry = self._entries.get(int(entry_id))
+                    if entry_id < 0 or sim < self.threshold or entry is None:
+                        break
+                    if entry["numbers"] == numbers:
+                        hit = (int(entry_id), float(sim), entry)
+                        break
+            if hit is None:
+                self.misses += 1
+                return None
+            entry_id, sim, entry = hit
+            self._entries.move_to_end(entry_id)
+            self.hits += 1
+        audit = random.random() < self.audit_rate
+        self._log({"query": query, "matched_query": entry["query"], "namespace": ns,
+                   "similarity": round(sim, 4), "audit": audit})
+        print(f"✓ Semantic cache hit ({sim:.3f}): '{query}' ≈ '{entry['query']}'")
+        return {"answer": entry["answer"], "matched_query": entry["query"],
+                "similarity": sim, "entry_id": entry_id, "namespace": ns, "audit": audit}
+    def put(self, query: str, lang: str, filters, answer: str):
+        """Store the answer of a query (replacing an entry for the same text)."""
+        self._put(query, namespace(lang, filters), answer)
+    def _put(self, query: str, ns: str, answer: str):
+        v = self._vector(query)
+        with self._lock:
+            index = self._index(ns, v.shape[1])
+            for entry_id, entry in list(self._entries.items()):
+                if entry["namespace"] == ns and entry["query"] == query:
+                    self._evict(entry_id)
+            entry_id = self._next_id
+            self._next_id += 1
+            index.add_with_ids(v, np.array([entry_id], dtype="int64"))
+            self._entries[entry_id] = {"query": query, "answer": answer, "namespace": ns,
+                                       "dim": v.shape[1], "numbers": _numbers(query)}
+            while len(self._entries) > self.max_size:
+                self._evict(next(iter(self._entries)))
+    def _evict(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        index = self._indexes[(entry["namespace"], entry["dim"])]
+        index.remove_ids(np.array([entry_id], dtype="int64"))
+        if not index.ntotal:
+            del self._indexes[(entry["namespace"], entry["dim"])]
+    # ---------- audits ----------
+    def audit(self, hit, query: str, fresh_answer: str, agreement: float):
+        """
+        Record the verdict on an audited hit. On a false hit the entry that
+        served it is evicted (so no paraphrase near it gets the wrong answer
+        again) and fresh_answer is stored under query instead.
+        Args:
+            hit: Result of lookup() with audit=True
+            query: The query that hit
+            fresh_answer: Answer generated without the cache
+            agreement: Similarity of fresh_answer to the cached answer (0..1)
+        Returns:
+            True if the hit was false (the answers disagree); query is then
+            already cached with fresh_answer
+        """
+        false_hit = agreement < ANSWER_CACHE_AUDIT_AGREEMENT
+        with self._lock:
+            self.audits += 1
+            self.false_hits += int(false_hit)
+            if false_hit and hit["entry_id"] in self._entries:
+                self._evict(hit["entry_id"])
+        if false_hit:
+            self._put(query, hit["namespace"], fresh_answer)
+        self._log({"query": query, "matched_query": hit["matched_query"],
+                   "similarity": round(hit["similarity"], 4), "agreement": round(float(agreement), 4),
+                   "verdict": "false_hit" if false_hit else "ok"})
+        if false_hit:
+            logger.warning(f"False semantic cache hit ({hit['similarity']:.3f}, answer agreement "
+                           f"{agreement:.2f}): '{query}' ≈ '{hit['matched_query']}'")
+        return false_hit
+    def _log(self, record):
+        record["time"] = time.time()
+        self._audit_log.append(record)
+        if self.audit_file:
+            try:
+                with self._lock, open(self.audit_file, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            except OSError as e:
+                logger.warning(f"Could not write answer cache audit log: {e}")
+    def audit_log(self):
+        """Recent semantic hits and audit verdicts, oldest first."""
+        return list(self._audit_log)
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._indexes.clear()
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+            "audits": self.audits,
+            "false_hits": self.false_hits,
+            "false_hit_rate": (self.false_hits / self.audits) if self.audits else 0.0,
+        }
+__all__ = ['SemanticAnswerCache', 'namespace', 'SEMANTIC_ANSWER_CACHE']
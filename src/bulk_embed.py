@@ -0,0 +1,133 @@
+# src/bulk_embed.py
+"""
+Multi-process bulk embedding for offline index builds.
+
+Texts are split into contiguous slices and encoded by a pool of worker
+processes, each holding its own model copy with torch intra-op threads
+capped so the workers don't oversubscribe the cores. Slices are consumed
+in submission order, so the sink (the embedding cache) receives vectors in
+corpus order as soon as each slice is ready, and per-worker throughput is
+reported at the end.
+
+Offline build:
+    python -m src.bulk_embed --workers 16 [--rebuild]
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from src.utils import ConfigManager
+logger = logging.getLogger(__name__)
+# 0 disables bulk mode (single-process encoding)
+BULK_EMBED_WORKERS = ConfigManager.get("BULK_EMBED_WORKERS", 0, config_type=int)
+# Torch threads per worker (0 = cores / workers)
+BULK_EMBED_TORCH_THREADS = ConfigManager.get("BULK_EMBED_TORCH_THREADS", 0, config_type=int)
+# Smaller jobs are not worth the worker start-up (one model load each)
+BULK_EMBED_MIN_CHUNKS = ConfigManager.get("BULK_EMBED_MIN_CHUNKS", 2000, config_type=int)
+BULK_EMBED_SLICE = ConfigManager.get("BULK_EMBED_SLICE", 1024, config_type=int)
+_worker_model = None
+def threads_per_worker(workers: int) -> int:
+    if BULK_EMBED_TORCH_THREADS > 0:
+        return BULK_EMBED_TORCH_THREADS
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+def _init_worker(loader, threads: int):
+    """Pool initializer: cap threads, then load this worker's model copy."""
+    global _worker_model
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    _worker_model = loader()
+def _encode_slice(texts, batch_size: int, normalize: bool):
+    """Encode one slice in a worker. Returns (pid, vectors, seconds)."""
+    from src.embedder import encode_length_bucketed
+    start = time.time()
+    vectors = encode_length_bucketed(_worker_model, texts, batch_size, report=False)
+    if normalize:
+        vectors /= np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+    return os.getpid(), vectors, time.time() - start
+def use_bulk(n_texts: int, workers: int = None) -> bool:
+    """Whether a job of n_texts should go through the worker pool."""
+    workers = BULK_EMBED_WORKERS if workers is None else workers
+    return workers > 1 and n_texts >= BULK_EMBED_MIN_CHUNKS
+def bulk_encode(texts, loader, workers: int = None, batch_size: int = 32, normalize: bool = True,
+                sink=None, slice_size: int = None):
+    """
+    Encode texts on a pool of worker processes.
+    Args:
+        texts: List of strings
+        loader: Picklable zero-argument callable returning a model with .encode
+        workers: Number of processes (defaults to BULK_EMBED_WORKERS)
+        batch_size: Encoder batch size inside each worker
+        normalize: L2-normalize the vectors
+        sink: Optional callable(texts, vectors) receiving each slice in order
+        slice_size: Texts per task (defaults to BULK_EMBED_SLICE)
+    Returns:
+        float32 array (len(texts), dim) in input order
+    """
+    workers = workers or BULK_EMBED_WORKERS
+    slice_size = slice_size or BULK_EMBED_SLICE
+    threads = threads_per_worker(workers)
+    slices = [texts[i:i + slice_size] for i in range(0, len(texts), slice_size)]
+    print(f"⚙️ Bulk embedding {len(texts)} chunks on {workers} workers "
+          f"({threads} torch threads each, {len(slices)} slices)")
+    per_worker = {}
+    outputs = []
+    started = time.time()
+    # spawn: forking a process that already initialized torch threads can hang
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(loader, threads),
+    ) as pool:
+        pending = deque()
+        next_slice = 0
+        # Keep a bounded number of slices in flight so finished-but-unconsumed
+        # results don't pile up in memory behind a slow slice
+        while next_slice < len(slices) or pending:
+            while next_slice < len(slices) and len(pending) < 2 * workers:
+                pending.append((slices[next_slice], pool.submit(_encode_slice, slices[next_slice], batch_size, normalize)))
+                next_slice += 1
+            batch, future = pending.popleft()
+            pid, vectors, seconds = future.result()
+            stats = per_worker.setdefault(pid, {"chunks": 0, "seconds": 0.0})
+            stats["chunks"] += len(batch)
+            stats["seconds"] += seconds
+            if sink is not None:
+                sink(batch, vectors)
+            outputs.append(vectors)
+    elapsed = time.time() - started
+    print_throughput(per_worker, len(texts), elapsed)
+    return np.concatenate(outputs) if outputs else np.zeros((0, 0), dtype="float32")
+def print_throughput(per_worker, total: int, elapsed: float):
+    """Per-worker and overall chunks/s."""
+    for i, (pid, stats) in enumerate(sorted(per_worker.items())):
+        rate = stats["chunks"] / stats["seconds"] if stats["seconds"] else 0.0
+        print(f"   worker {i} (pid {pid}): {stats['chunks']} chunks, {rate:.1f} chunks/s")
+    print(f"✅ Bulk embedding: {total} chunks in {elapsed:.1f}s ({total / max(elapsed, 1e-9):.1f} chunks/s overall)")
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline index build with multi-process embedding")
+    parser.add_argument("--workers", type=int, default=max(2, os.cpu_count() or 2))
+    parser.add_argument("--data-folder", default=str(ConfigManager.get_path("DATA_FOLDER", "./data/")))
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild the index (cached vectors are reused)")
+    args = parser.parse_args(argv)
+    # Under `python -m` this file runs as __main__; the embedder consults the
+    # importable module, so set the worker count there
+    from src import bulk_embed
+    bulk_embed.BULK_EMBED_WORKERS = args.workers
+    from src.data_loader import load_documents_from_folder
+    from src.embedder import create_or_load_index
+    chunks = load_documents_from_folder(args.data_folder)
+    index, metas = create_or_load_index(chunks, rebuild=args.rebuild)
+    print(f"✅ Index ready: {index.ntotal} vectors, {len(metas)} chunks")
+__all__ = ['bulk_encode', 'use_bulk', 'threads_per_worker']
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+# src/chunk_store.py
+"""
+SQLite-backed chunk store.
+
+Replaces the monolithic metas.json: chunk text and metadata live on disk
+and are fetched by chunk ID when search results are materialized. Only
+compact columns (chunk IDs, source file codes, slide numbers) stay in
+memory, so startup time and RSS stay flat as the corpus grows.
+
+The store behaves like the old metas list where the app relies on it:
+len(), iteration (streamed from disk), integer/slice indexing and by_id().
+"""
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+import numpy as np
+from src.utils import ConfigManager
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    chunk_id INTEGER PRIMARY KEY,
+    position INTEGER NOT NULL,
+    source_file TEXT,
+    slide_number INTEGER,
+    metadata TEXT NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_chunks_position ON chunks(position);
+CREATE INDEX IF NOT EXISTS idx_chunks_source ON chunks(source_file);
+"""
+ITER_BATCH = 1000
+# Stay below SQLite's host-parameter limit in IN (...) queries
+MAX_PARAMS = 500
+# Snapshot file with IDs deleted from the store but still in the index
+TOMBSTONES_FILE = "tombstones.npy"
+def _row(chunk, position):
+    meta = chunk.get("metadata", {})
+    slide = meta.get("slide_number")
+    return (
+        int(chunk["chunk_id"]),
+        position,
+        meta.get("source_file"),
+        int(slide) if slide is not None else None,
+        json.dumps(meta, ensure_ascii=False),
+        chunk.get("text", ""),
+    )
+def _chunk(chunk_id, metadata, text):
+    return {"text": text, "metadata": json.loads(metadata), "chunk_id": chunk_id}
+# SQLite memory-maps up to this many bytes of a read-only store, so text
+# pages come from the shared OS page cache instead of private buffers
+CHUNK_STORE_MMAP_BYTES = ConfigManager.get("CHUNK_STORE_MMAP_MB", 1024, config_type=int) * 1024 * 1024
+class ChunkStore:
+    """Chunks on disk, compact ID/metadata columns in memory."""
+    def __init__(self, path, read_only: bool = False, deleted_ids=None):
+        """
+        Args:
+            path: SQLite file
+            read_only: Open an immutable (published) store without locking,
+                reading through a memory map
+            deleted_ids: Chunk IDs deleted from the snapshot whose rows are
+                still in the (hard-linked) file; hidden from every lookup
+        """
+        self.path = Path(path)
+        self.read_only = read_only
+        self._deleted = set(np.asarray(deleted_ids, dtype="int64").tolist()) if deleted_ids is not None else set()
+        self._lock = threading.Lock()
+        self._doc_router = None
+        self._tombstones = None
+        self._lexical_index = None
+        self._reducer = None
+        self._conn = self._connect()
+        if not read_only:
+            self._conn.executescript(SCHEMA)
+        self._load_columns()
+    def _connect(self):
+        if not self.read_only:
+            return sqlite3.connect(str(self.path), check_same_thread=False)
+        uri = f"{self.path.resolve().as_uri()}?mode=ro&immutable=1"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        conn.execute(f"PRAGMA mmap_size={CHUNK_STORE_MMAP_BYTES}")
+        return conn
+    @classmethod
+    def create(cls, path, chunks):
+        """Write a fresh store (via a temp file + rename) and open it."""
+        path = Path(path)
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        if tmp.exists():
+            tmp.unlink()
+        conn = sqlite3.connect(str(tmp))
+        conn.executescript(SCHEMA)
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?, ?)",
+                (_row(c, i) for i, c in enumerate(chunks)),
+            )
+        conn.close()
+        os.replace(tmp, path)
+        return cls(path)
+    def _load_columns(self):
+        """Load the in-memory columns in position order."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT chunk_id, source_file, slide_number FROM chunks ORDER BY position"
+            ).fetchall()
+        if self._deleted:
+            rows = [r for r in rows if r[0] not in self._deleted]
+        self.ids = np.array([r[0] for r in rows], dtype="int64")
+        self.source_names = sorted({r[1] for r in rows if r[1] is not None})
+        codes = {name: i for i, name in enumerate(self.source_names)}
+        self.source_codes = np.array([codes.get(r[1], -1) for r in rows], dtype="int32")
+        self.slide_numbers = np.array([r[2] if r[2] is not None else -1 for r in rows], dtype="int32")
+        self._order = np.argsort(self.ids, kind="stable")
+        self._sorted_ids = self.ids[self._order]
+        self._filter_index = None
+    # ---------- list-like access ----------
+    def __len__(self):
+        return len(self.ids)
+    def __bool__(self):
+        return len(self.ids) > 0
+    def __contains__(self, chunk_id):
+        return self._position(chunk_id) is not None
+    def _position(self, chunk_id):
+        """Position of a chunk ID via binary search over the sorted ID column."""
+        i = int(np.searchsorted(self._sorted_ids, int(chunk_id)))
+        if i < len(self._sorted_ids) and self._sorted_ids[i] == int(chunk_id):
+            return int(self._order[i])
+        return None
+    def __iter__(self):
+        """Stream full chunks from disk on a private connection."""
+        conn = self._connect()
+        try:
+            cursor = conn.execute("SELECT chunk_id, metadata, text FROM chunks ORDER BY position")
+            while True:
+                rows = cursor.fetchmany(ITER_BATCH)
+                if not rows:
+                    break
+                for row in rows:
+                    if row[0] not in self._deleted:
+                        yield _chunk(*row)
+        finally:
+            conn.close()
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return self.get_many(self.ids[item])
+        return self.by_id(self.ids[item])
+    # ---------- lookups ----------
+    def by_id(self, chunk_id):
+        """Return the chunk stored under a FAISS ID, or None."""
+        found = self.get_many([chunk_id])
+        return found[0] if found else None
+    def get_many(self, chunk_ids):
+        """Fetch chunks by ID in the given order (unknown IDs are skipped)."""
+        chunk_ids = [int(c) for c in chunk_ids if int(c) not in self._deleted]
+        if not chunk_ids:
+            return []
+        rows = []
+        with self._lock:
+            for start in range(0, len(chunk_ids), MAX_PARAMS):
+                batch = chunk_ids[start:start + MAX_PARAMS]
+                placeholders = ",".join("?" * len(batch))
+                rows.extend(self._conn.execute(
+                    f"SELECT chunk_id, metadata, text FROM chunks WHERE chunk_id IN ({placeholders})",
+                    batch,
+                ).fetchall())
+        by_id = {row[0]: _chunk(*row) for row in rows}
+        return [by_id[c] for c in chunk_ids if c in by_id]
+    def source_file_of(self, chunk_id):
+        """Source file of a chunk from the in-memory columns (no disk read)."""
+        pos = self._position(chunk_id)
+        if pos is None or self.source_codes[pos] < 0:
+            return None
+        return self.source_names[self.source_codes[pos]]
+    def source_file_counts(self):
+        """Chunks per source file, from the in-memory columns."""
+        counts = np.bincount(self.source_codes[self.source_codes >= 0], minlength=len(self.source_names))
+        return {name: int(n) for name, n in zip(self.source_names, counts)}
+    def filter_index(self):
+        """Metadata → ID bitmap index over the columns (built on first use)."""
+        if self._filter_index is None:
+            from src.metadata_filter import MetadataFilterIndex
+            self._filter_index = MetadataFilterIndex.from_store(self)
+        return self._filter_index
+    def doc_router(self):
+        """Document centroid router saved next to the store (None if the snapshot has none)."""
+        if self._doc_router is None:
+            from src.doc_router import DocRouter, DOC_CENTROIDS_FILE
+            self._doc_router = DocRouter.load(self.path.with_name(DOC_CENTROIDS_FILE)) or False
+        return self._doc_router or None
+    def lexical_index(self):
+        """BM25 index saved next to the store (None if the snapshot has none)."""
+        if self._lexical_index is None:
+            from src.lexical_index import BM25Index, BM25_FILE
+            self._lexical_index = BM25Index.load(self.path.with_name(BM25_FILE)) or False
+        return self._lexical_index or None
+    def reducer(self):
+        """
+        Dimensionality reduction the snapshot's index vectors were stored
+        with (None if they are not reduced); queries searched against this
+        store's index must be projected with it.
+        """
+        if self._reducer is None:
+            from src.dim_reduction import Reducer
+            manifest_file = self.path.with_name("manifest.json")
+            manifest = json.loads(manifest_file.read_text(encoding="utf-8")) if manifest_file.exists() else {}
+            self._reducer = Reducer.load(self.path.parent, manifest) or False
+        return self._reducer or None
+    def tombstones(self):
+        """
+        IDs deleted from this snapshot whose vectors are still in the index
+        (indexes that cannot remove in place, or a deletion published as a
+        delta); empty if none.
+        """
+        if self._tombstones is None:
+            path = self.path.with_name(TOMBSTONES_FILE)
+            self._tombstones = np.load(path) if path.exists() else np.zeros(0, dtype="int64")
+        return self._tombstones
+    # ---------- updates ----------
+    def apply_changes(self, added=(), removed_ids=()):
+        """Insert new chunks and delete removed IDs in one transaction."""
+        removed_ids = [int(c) for c in removed_ids]
+        with self._lock, self._conn:
+            start = self._conn.execute("SELECT COALESCE(MAX(position) + 1, 0) FROM chunks").fetchone()[0]
+            if removed_ids:
+                self._conn.executemany("DELETE FROM chunks WHERE chunk_id = ?", ((c,) for c in removed_ids))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?, ?)",
+                (_row(c, start + i) for i, c in enumerate(added)),
+            )
+        self._load_columns()
+    def close(self):
+        with self._lock:
+            self._conn.close()
+def migrate_json(meta_file, store_path):
+    """Convert a legacy metas.json (with chunk IDs) into a chunk store."""
+    chunks = json.loads(Path(meta_file).read_text(encoding="utf-8"))
+    return ChunkStore.create(store_path, chunks)
+__all__ = ['ChunkStore', 'migrate_json']
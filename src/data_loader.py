@@ -7,6 +7,7 @@ import PyPDF2
 from paddleocr import PaddleOCR
 import logging
 from src.utils import ConfigManager
+from src.model_registry import register_model, get_model
 import io
 import hashlib
 import json
@@ -25,9 +26,9 @@ PPT_CHUNK_OVERLAP = rag_config['ppt_overlap']
 # OCR configuration
 ocr_lang = ConfigManager.get('OCR_LANGUAGE', 'en')
 ocr_angle = ConfigManager.get('OCR_ANGLE_DETECTION', True, config_type=bool)
-# Initialize OCR reader once
-ocr_reader = PaddleOCR(use_angle_cls=ocr_angle, lang=ocr_lang)
-logger.info(f"OCR initialized: lang={ocr_lang}, angle_detection={ocr_angle}")
+# OCR reader is created once, on first use, by the model registry
+register_model("ocr", lambda: PaddleOCR(use_angle_cls=ocr_angle, lang=ocr_lang))
+logger.info(f"OCR registered: lang={ocr_lang}, angle_detection={ocr_angle}")
 # ================== CONFIG FROM OCR.PY ==================
 log_level = ConfigManager.get('LOG_LEVEL', 'INFO')
 logging.basicConfig(
@@ -125,7 +126,7 @@ def extract_images_from_slide(slide):
     return images
 def read_text_from_image(image):
     img_array = np.array(image)
-    result = ocr_reader.ocr(img_array, cls=True)
+    result = get_model("ocr").ocr(img_array, cls=True)
     extracted = [
         line[1][0]
         for page in result if page is not None
@@ -305,7 +306,13 @@ def table_to_markdown(table):
     separator = " | ".join(["---"] * len(rows[0]))
     body = "\n".join([" | ".join(r) for r in rows[1:]])
     return f"{header}\n{separator}\n{body}" if body else f"{header}\n{separator}"
-def load_documents_from_folder(folder_path):
+def load_documents_from_folder(folder_path, progress=None):
+    """
+    Load and chunk every supported document in a folder.
+    Args:
+        folder_path: Folder with .docx/.pptx/.pdf files
+        progress: Optional IndexBuildStatus (start_loading / file_done)
+    """
     folder = Path(folder_path)
     all_chunks = []
     file_stats = {}
@@ -328,6 +335,7 @@ def load_documents_from_folder(folder_path):
         '.pptx': load_pptx,
         '.pdf': load_pdf
     }
+    files = []
     for file in folder.iterdir():
         if not file.is_file():
             continue
@@ -335,15 +343,19 @@ def load_documents_from_folder(folder_path):
         if file.name.startswith("~$") or file.name.startswith("."):
             logger.debug(f"Skipping temp/hidden file: {file.name}")
             continue
-        ext = file.suffix.lower()
-       
-        if ext in supported_extensions:
-            loader_func = supported_extensions[ext]
-            chunks = loader_func(file)
-            all_chunks.extend(chunks)
-            file_stats[file.name] = len(chunks)
+        if file.suffix.lower() in supported_extensions:
+            files.append(file)
         else:
             logger.debug(f"Skipping unsupported file: {file.name}")
+    if progress is not None:
+        progress.start_loading(len(files))
+    for file in files:
+        loader_func = supported_extensions[file.suffix.lower()]
+        chunks = loader_func(file)
+        all_chunks.extend(chunks)
+        file_stats[file.name] = len(chunks)
+        if progress is not None:
+            progress.file_done(file.name, len(chunks))
     # Log statistics
     logger.info(f"✅ Loaded {len(all_chunks)} total chunks from {len(file_stats)} files")
     for filename, count in file_stats.items():
@@ -0,0 +1,103 @@
+# src/dim_reduction.py
+"""
+Optional embedding dimensionality reduction.
+
+    EMBED_REDUCTION=pca        learned PCA projection, fitted at build time
+                               and saved with the snapshot (reduction.pca)
+    EMBED_REDUCTION=truncate   keep the first EMBED_REDUCED_DIM components
+                               (for Matryoshka-trained encoders)
+
+The embedding cache keeps full-size model vectors; the reduction is applied
+on top of them when building the index and to every query vector, so
+changing it only needs a rebuild from cached embeddings. Reduced vectors
+are re-normalized so inner product stays cosine similarity.
+"""
+import logging
+import os
+from pathlib import Path
+import faiss
+import numpy as np
+from src.utils import ConfigManager
+logger = logging.getLogger(__name__)
+REDUCTION_METHODS = ("none", "pca", "truncate")
+EMBED_REDUCTION = ConfigManager.get("EMBED_REDUCTION", "none").lower()
+EMBED_REDUCED_DIM = ConfigManager.get("EMBED_REDUCED_DIM", 256, config_type=int)
+# Vectors used to fit the PCA projection
+PCA_TRAIN_SAMPLE = ConfigManager.get("PCA_TRAIN_SAMPLE", 50000, config_type=int)
+REDUCER_FILE = "reduction.pca"
+def reduction_settings(d_in: int, method: str = None, dim: int = None):
+    """
+    Manifest entry for the configured reduction, or None if vectors are used as is.
+    Args:
+        d_in: Model embedding dimension
+        method: One of REDUCTION_METHODS (defaults to EMBED_REDUCTION)
+        dim: Output dimension (defaults to EMBED_REDUCED_DIM)
+    """
+    method = (method or EMBED_REDUCTION).lower()
+    dim = EMBED_REDUCED_DIM if dim is None else dim
+    if method not in REDUCTION_METHODS:
+        raise ValueError(f"Unknown EMBED_REDUCTION '{method}' (expected one of {REDUCTION_METHODS})")
+    if method == "none" or dim >= d_in:
+        return None
+    return {"method": method, "dim": int(dim)}
+class Reducer:
+    """Projection from model vectors to index vectors."""
+    def __init__(self, method: str, d_in: int, d_out: int, pca=None):
+        self.method = method
+        self.d_in = d_in
+        self.d_out = d_out
+        self.pca = pca
+    def settings(self):
+        return {"method": self.method, "dim": self.d_out}
+    def apply(self, x, normalize: bool = True):
+        """Reduce float32 vectors (n, d_in) → (n, d_out)."""
+        x = np.ascontiguousarray(x, dtype="float32")
+        if self.method == "pca":
+            out = self.pca.apply(x)
+        else:
+            out = np.ascontiguousarray(x[:, :self.d_out])
+        if normalize:
+            faiss.normalize_L2(out)
+        return out
+    @classmethod
+    def fit(cls, settings, d_in: int, vectors=None, seed: int = 42):
+        """
+        Reducer for settings (from reduction_settings). PCA is trained on a
+        sample of vectors; truncation needs none.
+        """
+        if settings is None:
+            return None
+        if settings["method"] == "truncate":
+            return cls("truncate", d_in, settings["dim"])
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        if len(vectors) > PCA_TRAIN_SAMPLE:
+            rng = np.random.RandomState(seed)
+            vectors = vectors[rng.choice(len(vectors), PCA_TRAIN_SAMPLE, replace=False)]
+        if len(vectors) < settings["dim"]:
+            logger.warning(f"Fitting PCA-{settings['dim']} on only {len(vectors)} vectors")
+        pca = faiss.PCAMatrix(d_in, settings["dim"])
+        pca.train(vectors)
+        eigenvalues = faiss.vector_to_array(pca.eigenvalues)
+        kept = float(eigenvalues[:settings["dim"]].sum() / max(eigenvalues.sum(), 1e-12))
+        print(f"📉 Fitted PCA {d_in} → {settings['dim']} on {len(vectors)} vectors "
+              f"({kept:.1%} of variance kept)")
+        return cls("pca", d_in, settings["dim"], pca)
+    def save(self, snapshot_dir):
+        """Write the projection into a (staging) snapshot; truncation needs no file."""
+        if self.method == "pca":
+            # Replace, never rewrite: the file may be hard-linked from a published snapshot
+            path = Path(snapshot_dir) / REDUCER_FILE
+            tmp = path.with_name(path.name + ".tmp")
+            faiss.write_VectorTransform(self.pca, str(tmp))
+            os.replace(tmp, path)
+    @classmethod
+    def load(cls, snapshot_dir, manifest):
+        """Reducer a snapshot was built with (None if its vectors are not reduced)."""
+        settings = manifest.get("reduction")
+        if not settings:
+            return None
+        if settings["method"] == "truncate":
+            return cls("truncate", manifest["dim"], settings["dim"])
+        pca = faiss.read_VectorTransform(str(Path(snapshot_dir) / REDUCER_FILE))
+        return cls("pca", pca.d_in, pca.d_out, pca)
+__all__ = ['Reducer', 'reduction_settings', 'REDUCTION_METHODS', 'REDUCER_FILE']
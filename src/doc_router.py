@@ -0,0 +1,202 @@
+# src/doc_router.py
+"""
+Two-stage retrieval: document centroids first, then chunks.
+
+Every source file (PDF, DOCX, slide deck) is summarised by one or more
+unit-length centroid vectors of its chunks (k-means for long documents).
+A query is first matched against this small centroid index to pick the
+top-N documents; the chunk search then only visits chunks of those
+documents, through the same ID selectors as metadata filters (or only
+their shards with a sharded index). Scan cost follows the number of
+documents picked instead of the library size.
+
+Centroids are written per snapshot as doc_centroids.npz next to the
+chunk store; only documents whose chunk set changed are recomputed.
+"""
+import hashlib
+import logging
+import math
+import os
+from pathlib import Path
+import faiss
+import numpy as np
+from src.utils import ConfigManager
+from src.index_factory import search_filtered
+logger = logging.getLogger(__name__)
+DOC_ROUTING = ConfigManager.get("DOC_ROUTING", "false", config_type=bool)
+# Documents whose chunks are searched in the second stage
+DOC_ROUTER_TOP_DOCS = ConfigManager.get("DOC_ROUTER_TOP_DOCS", 20, config_type=int)
+# Libraries with at most this many documents are searched directly
+DOC_ROUTER_MIN_DOCS = ConfigManager.get("DOC_ROUTER_MIN_DOCS", 50, config_type=int)
+# One centroid per this many chunks of a document, up to DOC_CENTROIDS_MAX
+DOC_CENTROID_CHUNKS = ConfigManager.get("DOC_CENTROID_CHUNKS", 64, config_type=int)
+DOC_CENTROIDS_MAX = ConfigManager.get("DOC_CENTROIDS_MAX", 8, config_type=int)
+DOC_CENTROIDS_FILE = "doc_centroids.npz"
+KMEANS_SEED = 1234
+# ==================== CENTROIDS ====================
+def doc_centroids(vectors, n_centroids: int = None):
+    """
+    Unit-length summary vectors of one document's chunk vectors.
+    Args:
+        vectors: float32 array (n_chunks, d)
+        n_centroids: Defaults to n_chunks / DOC_CENTROID_CHUNKS, capped at DOC_CENTROIDS_MAX
+    Returns:
+        float32 array (n_centroids, d)
+    """
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    if n_centroids is None:
+        n_centroids = min(DOC_CENTROIDS_MAX, max(1, math.ceil(len(vectors) / DOC_CENTROID_CHUNKS)))
+    n_centroids = max(1, min(n_centroids, len(vectors)))
+    if n_centroids == 1:
+        centroids = vectors.mean(axis=0, keepdims=True)
+    else:
+        kmeans = faiss.Kmeans(vectors.shape[1], n_centroids, niter=20, seed=KMEANS_SEED,
+                              spherical=True, min_points_per_centroid=1)
+        kmeans.train(vectors)
+        centroids = kmeans.centroids.copy()
+    faiss.normalize_L2(centroids)
+    return centroids
+def _id_hash(ids) -> str:
+    return hashlib.sha256(np.sort(np.asarray(ids, dtype="int64")).tobytes()).hexdigest()[:16]
+# ==================== ROUTER ====================
+class DocRouter:
+    """Flat inner-product index over document centroids."""
+    def __init__(self, centroids, centroid_docs, doc_names, doc_hashes=None):
+        """
+        Args:
+            centroids: float32 array (n_centroids, d), unit length
+            centroid_docs: Document number of each centroid
+            doc_names: Source file of each document number
+            doc_hashes: Hash of each document's chunk IDs (for incremental rebuilds)
+        """
+        self.centroids = np.ascontiguousarray(centroids, dtype="float32")
+        self.centroid_docs = np.asarray(centroid_docs, dtype="int32")
+        self.doc_names = list(doc_names)
+        self.doc_hashes = list(doc_hashes) if doc_hashes is not None else [""] * len(self.doc_names)
+        self.index = faiss.IndexFlatIP(self.centroids.shape[1])
+        self.index.add(self.centroids)
+    def __len__(self):
+        return len(self.doc_names)
+    @classmethod
+    def from_vectors(cls, vectors, doc_of):
+        """Router over in-memory chunk vectors labelled with their document."""
+        doc_of = np.asarray(doc_of)
+        names = sorted(set(doc_of.tolist()))
+        centroids, centroid_docs = [], []
+        for d, name in enumerate(names):
+            c = doc_centroids(vectors[doc_of == name])
+            centroids.append(c)
+            centroid_docs.extend([d] * len(c))
+        return cls(np.concatenate(centroids), centroid_docs, names)
+    @classmethod
+    def build(cls, store, vectors_of, previous=None):
+        """
+        Router for a chunk store.
+        Args:
+            store: ChunkStore of the snapshot
+            vectors_of: Callable(source_file, chunk_ids) -> vectors stored in the index
+            previous: Router of the previous snapshot; unchanged documents keep their centroids
+        """
+        reuse = {}
+        if previous is not None:
+            for d, (name, h) in enumerate(zip(previous.doc_names, previous.doc_hashes)):
+                reuse[(name, h)] = previous.centroids[previous.centroid_docs == d]
+        centroids, centroid_docs, hashes, rebuilt = [], [], [], 0
+        for d, name in enumerate(store.source_names):
+            ids = store.ids[store.source_codes == d]
+            h = _id_hash(ids)
+            c = reuse.get((name, h))
+            if c is None:
+                c = doc_centroids(vectors_of(name, ids))
+                rebuilt += 1
+            centroids.append(c)
+            centroid_docs.extend([d] * len(c))
+            hashes.append(h)
+        if not centroids:
+            return None
+        router = cls(np.concatenate(centroids), centroid_docs, store.source_names, hashes)
+        print(f"🗂️ Document router: {len(router)} documents, {len(router.centroids)} centroids "
+              f"({rebuilt} recomputed)")
+        return router
+    def without(self, sources):
+        """
+        Router with the documents of the given source files dropped, or None
+        if no document is left. Used when a deletion is published as a delta.
+        """
+        sources = set(sources)
+        keep = [d for d, name in enumerate(self.doc_names) if name not in sources]
+        if not keep:
+            return None
+        renumber = np.full(len(self.doc_names), -1, dtype="int32")
+        renumber[keep] = np.arange(len(keep), dtype="int32")
+        mask = renumber[self.centroid_docs] >= 0
+        return DocRouter(self.centroids[mask], renumber[self.centroid_docs[mask]],
+                         [self.doc_names[d] for d in keep], [self.doc_hashes[d] for d in keep])
+    def route(self, x, top_docs: int = None):
+        """
+        Source files most similar to a query.
+        Args:
+            x: float32 query vector (1, d), normalized
+            top_docs: Documents to return (defaults to DOC_ROUTER_TOP_DOCS)
+        """
+        top_docs = DOC_ROUTER_TOP_DOCS if top_docs is None else top_docs
+        k = min(len(self.centroids), top_docs * DOC_CENTROIDS_MAX)
+        _, labels = self.index.search(np.ascontiguousarray(x[:1], dtype="float32"), k)
+        picked = []
+        for label in labels[0]:
+            if label < 0:
+                break
+            doc = int(self.centroid_docs[label])
+            if doc not in picked:
+                picked.append(doc)
+                if len(picked) == top_docs:
+                    break
+        return [self.doc_names[d] for d in picked]
+    # ---------- persistence ----------
+    def save(self, path):
+        path = Path(path)
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            np.savez(f, centroids=self.centroids, centroid_docs=self.centroid_docs,
+                     doc_names=np.array(self.doc_names, dtype=object),
+                     doc_hashes=np.array(self.doc_hashes, dtype=object))
+        os.replace(tmp, path)
+    @classmethod
+    def load(cls, path):
+        """Router saved next to a chunk store, or None if the snapshot has none."""
+        path = Path(path)
+        if not path.exists():
+            return None
+        with np.load(path, allow_pickle=True) as data:
+            return cls(data["centroids"], data["centroid_docs"],
+                       data["doc_names"].tolist(), data["doc_hashes"].tolist())
+# ==================== SEARCH ====================
+def use_routing(router) -> bool:
+    """Routing pays off only when the library is larger than the documents picked."""
+    return (DOC_ROUTING and router is not None
+            and len(router) > max(DOC_ROUTER_MIN_DOCS, DOC_ROUTER_TOP_DOCS))
+def routed_search(index, store, router, x, k, top_docs: int = None):
+    """
+    Search chunks of the top documents only.
+    Args:
+        index: FAISS index from build_index or a ShardedIndex
+        store: ChunkStore (its filter index maps documents to chunk IDs)
+        router: DocRouter of the same snapshot
+        x: float32 query matrix (1, d), normalized
+        k: Results
+        top_docs: Documents searched (defaults to DOC_ROUTER_TOP_DOCS)
+    Returns:
+        (scores, ids) like index.search
+    """
+    sources = router.route(x, top_docs)
+    if hasattr(index, "select"):
+        return index.search(x, k, sources=sources)
+    allowed = store.filter_index().ids_for({"source_file": sources})
+    return search_filtered(index, x, k, allowed)
+__all__ = [
+    'DocRouter',
+    'doc_centroids',
+    'use_routing',
+    'routed_search',
+    'DOC_CENTROIDS_FILE'
+]
@@ -0,0 +1,128 @@
+# src/embed_checkpoint.py
+"""
+Resumable, checkpointed embedding runs.
+
+A large encode job is split into fixed-size segments. Each finished
+segment is written to disk (segment-NNNNN.npy via tmp + os.replace) and
+recorded in a progress manifest before the next one starts:
+
+    VECTOR_DB_PATH/checkpoints/<run key>/
+        progress.json            texts, segment size, finished segments
+        segment-00000.npy        float32 (segment_size, dim)
+        ...
+
+The run key hashes the model settings and the ordered texts, so a restart
+with the same chunks finds the same directory and only encodes the
+segments that are missing. Segment boundaries never change within a run,
+so a resumed build ends with exactly the vectors (and index) an
+uninterrupted one would have produced.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+import numpy as np
+from src.utils import ConfigManager
+logger = logging.getLogger(__name__)
+# Texts per checkpoint segment (0 = no checkpointing)
+EMBED_CHECKPOINT_SEGMENT = ConfigManager.get("EMBED_CHECKPOINT_SEGMENT", 4096, config_type=int)
+# Unfinished runs older than this belong to a chunk set that no longer exists
+STALE_CHECKPOINT_SECONDS = 7 * 24 * 3600
+def run_key(texts, settings: dict) -> str:
+    """Identity of an encode job: model settings + ordered text digests."""
+    digest = hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8"))
+    for text in texts:
+        digest.update(hashlib.sha256(text.encode("utf-8")).digest())
+    return digest.hexdigest()[:24]
+class CheckpointedRun:
+    """Segment files and progress manifest of one encode job."""
+    def __init__(self, root, key: str, n_texts: int, segment_size: int):
+        self.dir = Path(root) / key
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.progress_file = self.dir / "progress.json"
+        self.n_texts = n_texts
+        self.segment_size = segment_size
+        self.n_segments = -(-n_texts // segment_size)
+        self.done = set()
+        if self.progress_file.exists():
+            progress = json.loads(self.progress_file.read_text(encoding="utf-8"))
+            if progress.get("n_texts") == n_texts and progress.get("segment_size") == segment_size:
+                self.done = {s for s in progress.get("segments", []) if self._segment_file(s).exists()}
+    def _segment_file(self, segment: int) -> Path:
+        return self.dir / f"segment-{segment:05d}.npy"
+    def bounds(self, segment: int):
+        start = segment * self.segment_size
+        return start, min(start + self.segment_size, self.n_texts)
+    def pending(self):
+        return [s for s in range(self.n_segments) if s not in self.done]
+    def load(self, segment: int):
+        return np.load(self._segment_file(segment))
+    def save(self, segment: int, vectors):
+        """Persist one segment, then record it in the manifest."""
+        tmp = self.dir / f"segment-{segment:05d}.tmp.npy"
+        np.save(tmp, np.asarray(vectors, dtype="float32"))
+        os.replace(tmp, self._segment_file(segment))
+        self.done.add(segment)
+        self._write_progress()
+    def _write_progress(self, complete: bool = False):
+        tmp = self.dir / "progress.json.tmp"
+        tmp.write_text(json.dumps({
+            "n_texts": self.n_texts,
+            "segment_size": self.segment_size,
+            "segments": sorted(self.done),
+            "complete": complete,
+            "updated": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }, indent=2), encoding="utf-8")
+        os.replace(tmp, self.progress_file)
+    def mark_complete(self):
+        self._write_progress(complete=True)
+def encode_checkpointed(texts, encode_fn, root, settings: dict, segment_size: int = None,
+                        progress=None):
+    """
+    Encode texts segment by segment, resuming from finished segments.
+    Args:
+        texts: List of strings
+        encode_fn: Callable(list of strings) -> float32 array
+        root: Directory holding checkpoint runs
+        settings: Model settings that invalidate vectors (part of the run key)
+        segment_size: Texts per segment (defaults to EMBED_CHECKPOINT_SEGMENT)
+        progress: Optional IndexBuildStatus; resumed segments count as embedded
+    Returns:
+        float32 array (len(texts), dim) in input order
+    """
+    segment_size = EMBED_CHECKPOINT_SEGMENT if segment_size is None else segment_size
+    if segment_size <= 0 or len(texts) <= segment_size:
+        return encode_fn(texts)
+    run = CheckpointedRun(root, run_key(texts, settings), len(texts), segment_size)
+    if run.done:
+        resumed = sum(run.bounds(s)[1] - run.bounds(s)[0] for s in run.done)
+        print(f"♻️ Resuming embedding run {run.dir.name}: {len(run.done)}/{run.n_segments} segments "
+              f"({resumed} chunks) already on disk")
+        if progress is not None:
+            progress.add_embedded(resumed)
+    for segment in run.pending():
+        start, end = run.bounds(segment)
+        run.save(segment, encode_fn(texts[start:end]))
+        logger.info(f"Checkpointed segment {segment + 1}/{run.n_segments} ({end} chunks)")
+    vectors = np.concatenate([run.load(s) for s in range(run.n_segments)]).astype("float32")
+    run.mark_complete()
+    return vectors
+def prune(root):
+    """Remove finished runs (after the index was published) and stale unfinished ones."""
+    root = Path(root)
+    if not root.exists():
+        return
+    now = time.time()
+    for run_dir in root.iterdir():
+        progress_file = run_dir / "progress.json"
+        if not progress_file.exists():
+            stale = now - run_dir.stat().st_mtime > STALE_CHECKPOINT_SECONDS
+        else:
+            complete = json.loads(progress_file.read_text(encoding="utf-8")).get("complete", False)
+            stale = complete or now - progress_file.stat().st_mtime > STALE_CHECKPOINT_SECONDS
+        if stale:
+            shutil.rmtree(run_dir, ignore_errors=True)
+__all__ = ['CheckpointedRun', 'encode_checkpointed', 'run_key', 'prune']
@@ -0,0 +1,105 @@
+# src/embed_dispatcher.py
+"""
+Cross-session micro-batching for query embeddings.
+
+Every Streamlit session used to run its own batch-of-1 forward pass. The
+dispatcher collects concurrent requests on a single worker thread for up to
+EMBED_BATCH_WAIT_MS (or EMBED_MAX_BATCH items), encodes them as one batch
+and hands each caller its own vector.
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+from src.utils import ConfigManager
+logger = logging.getLogger(__name__)
+DISPATCH_ENABLED = ConfigManager.get("EMBED_DISPATCH_ENABLED", "true", config_type=bool)
+BATCH_WAIT_MS = ConfigManager.get("EMBED_BATCH_WAIT_MS", 5.0, config_type=float)
+MAX_BATCH = ConfigManager.get("EMBED_MAX_BATCH", 32, config_type=int)
+class EmbeddingDispatcher:
+    """Background worker that batches concurrent encode requests."""
+    def __init__(self, encode_fn, max_batch: int = None, max_wait_ms: float = None):
+        """
+        Args:
+            encode_fn: Callable mapping a list of texts to a 2-D float32 array
+            max_batch: Largest batch handed to encode_fn
+            max_wait_ms: How long the first request waits for company
+        """
+        self.encode_fn = encode_fn
+        self.max_batch = max_batch or MAX_BATCH
+        self.max_wait = (BATCH_WAIT_MS if max_wait_ms is None else max_wait_ms) / 1000.0
+        self._queue = queue.Queue()
+        self._worker = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._max_batch_seen = 0
+        self._max_depth = 0
+        self._wait_total = 0.0
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._start_lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name="embed-dispatcher", daemon=True)
+                    self._worker.start()
+    def encode(self, texts):
+        """Queue texts and block until their vectors are ready."""
+        self._ensure_worker()
+        futures = []
+        now = time.monotonic()
+        for text in texts:
+            future = Future()
+            self._queue.put((text, future, now))
+            futures.append(future)
+        with self._stats_lock:
+            self._max_depth = max(self._max_depth, self._queue.qsize())
+        return np.stack([f.result() for f in futures])
+    def _collect(self):
+        """Block for one request, then gather more until the window closes."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+        return batch
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.monotonic()
+            # Identical texts (e.g. the same FAQ from two sessions) are encoded once
+            unique = list(dict.fromkeys(text for text, _, _ in batch))
+            try:
+                vectors = self.encode_fn(unique)
+            except Exception as e:
+                logger.error(f"Batched embedding failed: {e}")
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            by_text = dict(zip(unique, vectors))
+            for text, future, _ in batch:
+                future.set_result(by_text[text])
+            with self._stats_lock:
+                self._batches += 1
+                self._items += len(batch)
+                self._max_batch_seen = max(self._max_batch_seen, len(batch))
+                self._wait_total += sum(started - queued for _, _, queued in batch)
+    def stats(self):
+        """Queue depth and batch size metrics."""
+        with self._stats_lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "max_queue_depth": self._max_depth,
+                "batches": self._batches,
+                "items": self._items,
+                "avg_batch_size": (self._items / self._batches) if self._batches else 0.0,
+                "max_batch_size": self._max_batch_seen,
+                "avg_queue_wait_ms": (1000 * self._wait_total / self._items) if self._items else 0.0,
+            }
+__all__ = ['EmbeddingDispatcher', 'DISPATCH_ENABLED']
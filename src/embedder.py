@@ -1,30 +1,73 @@
 # ============================================================
 # 1. src/embedder.py - UPDATED FOR CONSISTENCY
 # ============================================================
+import os
 import json
+import time
+import hashlib
 import faiss
 from pathlib import Path
 from sentence_transformers import SentenceTransformer
-from src.utils import get_env_var
+from src.utils import get_env_var, ConfigManager
+from src.embedding_cache import get_embedding_cache, QueryVectorLRU, normalize_query
+from src.embed_dispatcher import EmbeddingDispatcher, DISPATCH_ENABLED
+from src.model_registry import register_model, get_model as registry_get_model
+from src.chunk_store import ChunkStore, migrate_json, TOMBSTONES_FILE
+from src.index_factory import build_index, index_label, configure_search, supports_remove, read_index, prefault, reconstruct_ids
+from src.doc_router import DocRouter, DOC_CENTROIDS_FILE, DOC_ROUTING
+from src.lexical_index import BM25Index, BM25_FILE
+from src.dim_reduction import Reducer, reduction_settings, REDUCER_FILE, PCA_TRAIN_SAMPLE
+from src import bulk_embed, embed_checkpoint, snapshots
 import numpy as np
 VECTOR_DB_PATH = get_env_var("VECTOR_DB_PATH", "./data/vectorstore")
 INDEX_DIR = Path(VECTOR_DB_PATH)
 INDEX_DIR.mkdir(parents=True, exist_ok=True)
+# Segments of interrupted index builds (see embed_checkpoint)
+CHECKPOINT_DIR = INDEX_DIR / "checkpoints"
 MODEL_NAME = get_env_var("EMBED_MODEL", "sentence-transformers/all-mpnet-base-v2")
+# Incremental updates: only embed new/changed chunks, drop deleted ones
+INCREMENTAL_INDEX = ConfigManager.get("INCREMENTAL_INDEX", "true", config_type=bool)
+# Serve snapshots memory-mapped/read-only (shared page cache across app
+# processes) and optionally pre-fault their pages at load time
+INDEX_MMAP = ConfigManager.get("INDEX_MMAP", "false", config_type=bool)
+INDEX_PREFAULT = ConfigManager.get("INDEX_PREFAULT", "false", config_type=bool)
+# Index layout: "none" (one index) or "source" (one shard per source file)
+INDEX_SHARDING = ConfigManager.get("INDEX_SHARDING", "none").lower()
 # Global variables
-_model, _index, _metas = None, None, None
+_index, _metas = None, None
 EMBED_DIM = None
 # FIX: Add seed for reproducibility
 RANDOM_SEED = int(get_env_var("RANDOM_SEED", "42"))
 np.random.seed(RANDOM_SEED)
+# Encoder backend: torch, onnx or onnx-int8 (ONNX Runtime on CPU)
+EMBED_BACKEND = ConfigManager.get("EMBED_BACKEND", "torch").lower()
+def _load_torch_embedder():
+    model = SentenceTransformer(MODEL_NAME)
+    # FIX: Set model to eval mode for consistency
+    model.eval()
+    return model
+def _load_embedder():
+    """Load the encoder for EMBED_BACKEND, falling back to PyTorch."""
+    if EMBED_BACKEND in ("onnx", "onnx-int8"):
+        try:
+            from src.onnx_backend import load_onnx_encoder
+            encoder = load_onnx_encoder(MODEL_NAME, EMBED_BACKEND == "onnx-int8", _load_torch_embedder)
+            if encoder is not None:
+                return encoder
+        except ImportError as e:
+            print(f"⚠️ ONNX backend unavailable ({e}), using PyTorch")
+    return _load_torch_embedder()
+def _model_key():
+    """
+    Identity of the vectors the encoder produces. ONNX/int8 vectors differ
+    slightly from PyTorch ones, so they get their own cache namespace and
+    index manifest entry.
+    """
+    return MODEL_NAME if EMBED_BACKEND == "torch" else f"{MODEL_NAME}@{EMBED_BACKEND}"
+register_model("embedder", _load_embedder)
 def get_model():
-    """Load and cache embedding model with consistent settings."""
-    global _model
-    if _model is None:
-        _model = SentenceTransformer(MODEL_NAME)
-        # FIX: Set model to eval mode for consistency
-        _model.eval()
-    return _model
+    """Shared embedding model (loaded once per process via the model registry)."""
+    return registry_get_model("embedder")
 def get_embed_dim():
     """Get embedding dimension dynamically from the model."""
     global EMBED_DIM
@@ -33,62 +76,746 @@ def get_embed_dim():
         sample_embedding = model.encode(["test"], convert_to_numpy=True)
         EMBED_DIM = sample_embedding.shape[1]
     return EMBED_DIM
-def create_or_load_index(chunks, rebuild: bool = False):
+# ==================== CHUNK IDS ====================
+def chunk_id(chunk) -> int:
+    """
+    Stable content-hash ID for a chunk.
+    Hashes text + metadata so an edited chunk gets a new ID. Truncated to
+    63 bits because FAISS IDs are signed int64.
+    """
+    payload = json.dumps(
+        {"text": chunk.get("text", ""), "metadata": chunk.get("metadata", {})},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    digest = hashlib.sha256(payload.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") & 0x7FFFFFFFFFFFFFFF
+def _with_ids(chunks):
+    """Attach chunk IDs and drop exact duplicates (same ID = same vector)."""
+    seen = {}
+    for c in chunks:
+        cid = chunk_id(c)
+        if cid not in seen:
+            seen[cid] = {**c, "chunk_id": cid}
+    return list(seen.values())
+# ==================== EMBEDDING ====================
+def _encode_texts(texts, progress=None):
+    """
+    Encode texts to float32 vectors, L2-normalized if configured.
+    Vectors already in the persistent embedding cache are reused.
+    Args:
+        texts: List of strings
+        progress: Optional IndexBuildStatus; add_embedded() is called as
+            batches finish (cache hits count as embedded)
+    """
+    normalize_embeddings = ConfigManager.get("NORMALIZE_EMBEDDINGS", "true", config_type=bool)
+    cache = get_embedding_cache(_model_key(), normalize_embeddings)
+    if cache is None:
+        return _encode_uncached(texts, progress)
+    encoded = []
+    def encode_missing(missing):
+        encoded.append(len(missing))
+        return _encode_uncached(missing, progress)
+    embeddings = cache.get_or_encode(list(texts), encode_missing)
+    if progress is not None:
+        progress.add_embedded(len(texts) - sum(encoded))
+    return embeddings
+def _encode_checkpointed(texts, progress=None):
+    """
+    _encode_texts for index builds: large jobs are written to disk segment
+    by segment so a killed build resumes where it stopped.
+    """
+    return embed_checkpoint.encode_checkpointed(
+        list(texts), lambda segment: _encode_texts(segment, progress), CHECKPOINT_DIR,
+        _index_manifest(get_embed_dim()), progress=progress,
+    )
+def _encode_uncached(texts, progress=None):
+    """
+    Run the encoder on texts (no cache lookup). Large jobs go to the
+    bulk worker pool when BULK_EMBED_WORKERS > 1.
+    """
+    # FIX: Use consistent parameters
+    batch_size = int(get_env_var("EMBEDDING_BATCH_SIZE", "32"))
+    if bulk_embed.use_bulk(len(texts)):
+        normalize_embeddings = ConfigManager.get("NORMALIZE_EMBEDDINGS", "true", config_type=bool)
+        cache = get_embedding_cache(_model_key(), normalize_embeddings)
+        # Each finished slice goes straight into the on-disk vector cache
+        def sink(batch, vectors):
+            if cache is not None:
+                cache.store(batch, vectors)
+            if progress is not None:
+                progress.add_embedded(len(batch))
+        return bulk_embed.bulk_encode(
+            list(texts), _load_embedder, batch_size=batch_size, normalize=normalize_embeddings,
+            sink=sink,
+        )
+    model = get_model()
+    embeddings = encode_length_bucketed(
+        model, list(texts), batch_size, on_batch=progress.add_embedded if progress is not None else None
+    )
+    # Normalize for cosine similarity
+    normalize_embeddings = ConfigManager.get("NORMALIZE_EMBEDDINGS", "true", config_type=bool)
+    if normalize_embeddings:
+        faiss.normalize_L2(embeddings)
+    return embeddings
+# ==================== LENGTH-BUCKETED BATCHING ====================
+# Padded tokens per encoder batch (0 = plain fixed-size batches in input order)
+EMBED_TOKEN_BUDGET = ConfigManager.get("EMBED_TOKEN_BUDGET", 8192, config_type=int)
+_padding_stats = {"real_tokens": 0, "padded_fixed": 0, "padded_bucketed": 0}
+def _token_lengths(model, texts):
+    """Token count per text (truncated at the model's max length)."""
+    tokenizer = getattr(model, "tokenizer", None)
+    max_len = int(getattr(model, "max_seq_length", None) or 512)
+    if tokenizer is None:
+        # Rough fallback for encoders without a tokenizer attribute
+        return np.array([min(max_len, len(t.split()) + 2) for t in texts], dtype="int64")
+    ids = tokenizer(texts, add_special_tokens=True, truncation=True, max_length=max_len)["input_ids"]
+    return np.array([len(x) for x in ids], dtype="int64")
+# Texts within a factor of this of each other share a length bucket
+LENGTH_BUCKET_RATIO = 1.25
+def _length_batches(lengths, token_budget, max_batch):
+    """
+    Bucket positions by token count (geometric buckets, longest first) and
+    split each bucket so a batch's padded size, len(batch) * longest, stays
+    within token_budget.
+    """
+    order = np.argsort(-lengths, kind="stable")
+    buckets = np.floor(np.log(np.maximum(lengths, 1)) / np.log(LENGTH_BUCKET_RATIO)).astype("int64")
+    batches, current = [], []
+    for pos in order:
+        longest = lengths[current[0]] if current else lengths[pos]
+        if current and (
+            buckets[pos] != buckets[current[0]]
+            or len(current) + 1 > max_batch
+            or (len(current) + 1) * longest > token_budget
+        ):
+            batches.append(current)
+            current = []
+        current.append(pos)
+    if current:
+        batches.append(current)
+    return batches
+def _padded_tokens(lengths, batches):
+    return int(sum(len(b) * lengths[b].max() for b in batches if len(b)))
+def encode_length_bucketed(model, texts, batch_size: int = 32, token_budget: int = None,
+                           report: bool = True, on_batch=None):
+    """
+    Encode texts in length-sorted batches sized to a token budget, so short
+    OCR fragments are not padded to the length of an 800-word PPT chunk.
+    Output rows are in the original order.
+    Args:
+        model: Encoder with .encode (SentenceTransformer or OnnxEncoder)
+        texts: List of strings
+        batch_size: Upper bound on texts per batch (EMBEDDING_BATCH_SIZE)
+        token_budget: Padded tokens per batch (defaults to EMBED_TOKEN_BUDGET)
+        report: Print the padding ratio saved
+        on_batch: Optional callable(n_texts) invoked after each encoder batch
+    Returns:
+        float32 array (len(texts), dim), not normalized
+    """
+    token_budget = EMBED_TOKEN_BUDGET if token_budget is None else token_budget
+    if token_budget <= 0 or len(texts) <= 1:
+        vectors = model.encode(
+            texts,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+            batch_size=batch_size,
+            normalize_embeddings=False
+        ).astype("float32")
+        if on_batch is not None:
+            on_batch(len(texts))
+        return vectors
+    lengths = _token_lengths(model, texts)
+    # Short texts may go beyond batch_size as long as the budget holds
+    max_batch = max(batch_size, token_budget // max(1, int(lengths.min())))
+    batches = [np.array(b) for b in _length_batches(lengths, token_budget, max_batch)]
+    fixed = [np.arange(i, min(i + batch_size, len(texts))) for i in range(0, len(texts), batch_size)]
+    out = None
+    for b in batches:
+        vectors = model.encode(
+            [texts[i] for i in b],
+            convert_to_numpy=True,
+            show_progress_bar=False,
+            batch_size=len(b),
+            normalize_embeddings=False
+        ).astype("float32")
+        if out is None:
+            out = np.empty((len(texts), vectors.shape[1]), dtype="float32")
+        out[b] = vectors
+        if on_batch is not None:
+            on_batch(len(b))
+    real = int(lengths.sum())
+    padded_fixed = _padded_tokens(lengths, fixed)
+    padded_bucketed = _padded_tokens(lengths, batches)
+    _padding_stats["real_tokens"] += real
+    _padding_stats["padded_fixed"] += padded_fixed
+    _padding_stats["padded_bucketed"] += padded_bucketed
+    if report:
+        print(f"🧮 Padding: {1 - real / padded_fixed:.1%} of tokens with fixed batches → "
+              f"{1 - real / padded_bucketed:.1%} length-bucketed ({len(batches)} batches)")
+    return out
+def get_padding_stats():
+    """Cumulative padding ratios of fixed vs length-bucketed batching."""
+    stats = dict(_padding_stats)
+    real = stats["real_tokens"]
+    stats["padding_ratio_fixed"] = (1 - real / stats["padded_fixed"]) if stats["padded_fixed"] else 0.0
+    stats["padding_ratio_bucketed"] = (1 - real / stats["padded_bucketed"]) if stats["padded_bucketed"] else 0.0
+    stats["padding_saved"] = stats["padding_ratio_fixed"] - stats["padding_ratio_bucketed"]
+    return stats
+# ==================== INDEX PERSISTENCE ====================
+def _index_manifest(embed_dim, index_type=None):
+    """
+    Settings the stored index was built with. Model/dim/normalize changes
+    invalidate the vectors; an index_type change only needs a rebuild from
+    the embedding cache.
+    """
+    manifest = {
+        "model": _model_key(),
+        "dim": int(embed_dim),
+        "normalize": ConfigManager.get("NORMALIZE_EMBEDDINGS", "true", config_type=bool),
+    }
+    reduction = reduction_settings(int(embed_dim))
+    if reduction is not None:
+        manifest["reduction"] = reduction
+    if index_type is not None:
+        manifest["index_type"] = index_type
+    return manifest
+def _index_dim(embed_dim):
+    """Dimension of the vectors stored in the index (after any reduction)."""
+    reduction = reduction_settings(int(embed_dim))
+    return reduction["dim"] if reduction is not None else int(embed_dim)
+def _reduce(vectors, reducer):
+    """Apply an index reducer to model vectors (no-op without one)."""
+    if reducer is None:
+        return vectors
+    return reducer.apply(vectors, ConfigManager.get("NORMALIZE_EMBEDDINGS", "true", config_type=bool))
+def _load_reducer(snapshot_dir):
+    """Reducer of a snapshot if it matches the configured reduction, else None."""
+    manifest_file = Path(snapshot_dir) / "manifest.json"
+    if not manifest_file.exists():
+        return None
+    manifest = json.loads(manifest_file.read_text(encoding="utf-8"))
+    if manifest.get("reduction") != reduction_settings(get_embed_dim()):
+        return None
+    return Reducer.load(snapshot_dir, manifest)
+def _fit_reducer(target_dir, embeddings=None, texts=None):
+    """
+    Fit the configured reduction and save it into a staging snapshot. PCA
+    is trained on embeddings, or on a sample of texts encoded through the
+    embedding cache (so the index build that follows reuses them).
+    """
+    embed_dim = get_embed_dim()
+    settings = reduction_settings(embed_dim)
+    if settings is None:
+        return None
+    if embeddings is None and settings["method"] == "pca":
+        if len(texts) > PCA_TRAIN_SAMPLE:
+            rng = np.random.RandomState(RANDOM_SEED)
+            texts = [texts[i] for i in sorted(rng.choice(len(texts), PCA_TRAIN_SAMPLE, replace=False))]
+        embeddings = _encode_texts(texts)
+    reducer = Reducer.fit(settings, embed_dim, embeddings, seed=RANDOM_SEED)
+    reducer.save(target_dir)
+    return reducer
+def _save_index(index, embed_dim, index_type, target_dir):
+    """Write index and manifest to a staging snapshot (chunks live in the chunk store)."""
+    faiss.write_index(index, str(Path(target_dir) / "faiss.index"))
+    (Path(target_dir) / "manifest.json").write_text(
+        json.dumps(_index_manifest(embed_dim, index_type), indent=2), encoding="utf-8"
+    )
+def _save_doc_router(index, store, target_dir, previous_dir=None):
+    """
+    Write document centroids for two-stage retrieval into a staging snapshot.
+    Vectors come back out of the index; documents unchanged since
+    previous_dir keep their centroids. Skipped unless DOC_ROUTING is on (a
+    snapshot without centroids gets them once routing is enabled, see
+    _ensure_side_indexes).
+    """
+    if not DOC_ROUTING:
+        return
+    if hasattr(index, "select"):
+        vectors_of = index.reconstruct
+    else:
+        vectors_of = lambda source, ids: reconstruct_ids(index, ids)
+    previous = DocRouter.load(Path(previous_dir) / DOC_CENTROIDS_FILE) if previous_dir is not None else None
+    if previous is not None and previous.centroids.shape[1] != index.d:
+        previous = None
+    router = DocRouter.build(store, vectors_of, previous)
+    if router is not None:
+        router.save(Path(target_dir) / DOC_CENTROIDS_FILE)
+def _save_lexical_index(store, target_dir, previous_dir=None):
+    """
+    Write the BM25 index for hybrid retrieval into a staging snapshot.
+    Only chunks missing from previous_dir's index are tokenized.
+    """
+    previous = BM25Index.load(Path(previous_dir) / BM25_FILE) if previous_dir is not None else None
+    BM25Index.build(store, previous).save(Path(target_dir) / BM25_FILE)
+def _build_index(chunks, index_type=None, progress=None, target_dir=None):
+    """
+    Embed every chunk and build a fresh ID-mapped index. A configured
+    reduction is fitted on these vectors and saved into target_dir.
+    """
+    chunks = _with_ids(chunks)
+    if progress is not None:
+        progress.start_embedding(len(chunks))
+    embeddings = _encode_checkpointed([c["text"] for c in chunks], progress)
+    if target_dir is not None:
+        embeddings = _reduce(embeddings, _fit_reducer(target_dir, embeddings))
+    ids = np.array([c["chunk_id"] for c in chunks], dtype="int64")
+    # Create FAISS index with consistent metric (inner product on normalized vectors)
+    index, built_type = build_index(embeddings, ids, index_type)
+    print(f"🧱 Built {index_label(len(chunks), built_type)} index")
+    return index, chunks
+def _update_index(index, store, chunks, progress=None, reducer=None, tombstones=None):
+    """
+    Bring a loaded index in line with the current chunks (already carrying IDs).
+    Only chunks whose content hash is new get embedded; chunks that no
+    longer exist are removed by ID (or tombstoned, see _delete_ids).
+    Returns:
+        (added, removed, tombstones)
+    """
+    current = {c["chunk_id"]: c for c in chunks}
+    stored_ids = set(store.ids.tolist())
+    removed = stored_ids - current.keys()
+    added = [c for cid, c in current.items() if cid not in stored_ids]
+    tombstones = _empty_ids() if tombstones is None else tombstones
+    if removed:
+        tombstones = _delete_ids(index, np.array(sorted(removed), dtype="int64"), tombstones)
+    # A tombstoned chunk that comes back still has its (identical) vector in the index
+    revived = np.isin(np.array([c["chunk_id"] for c in added], dtype="int64"), tombstones)
+    if revived.any():
+        tombstones = np.setdiff1d(tombstones, [c["chunk_id"] for c, r in zip(added, revived) if r])
+    to_embed = [c for c, r in zip(added, revived) if not r]
+    if progress is not None:
+        progress.start_embedding(len(to_embed))
+    if to_embed:
+        embeddings = _reduce(_encode_checkpointed([c["text"] for c in to_embed], progress), reducer)
+        ids = np.array([c["chunk_id"] for c in to_embed], dtype="int64")
+        index.add_with_ids(embeddings, ids)
+    if added or removed:
+        store.apply_changes(added, removed)
+    return len(added), len(removed), tombstones
+# ==================== DELETION / COMPACTION ====================
+# Rebuild an index (from its own vectors) once this share of it is tombstoned
+INDEX_COMPACT_RATIO = ConfigManager.get("INDEX_COMPACT_RATIO", 0.2, config_type=float)
+def _empty_ids():
+    return np.zeros(0, dtype="int64")
+def _read_tombstones(snapshot_dir):
+    path = Path(snapshot_dir) / TOMBSTONES_FILE
+    return np.load(path) if path.exists() else _empty_ids()
+def _write_tombstones(target_dir, tombstones):
+    """Write (or clear) the tombstone list of a staging snapshot."""
+    path = Path(target_dir) / TOMBSTONES_FILE
+    if len(tombstones) == 0:
+        if path.exists():
+            path.unlink()
+        return
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        np.save(f, np.sort(np.asarray(tombstones, dtype="int64")))
+    os.replace(tmp, path)
+def _delete_ids(index, ids, tombstones):
+    """
+    Drop vectors by chunk ID. Flat and IVF indexes remove them in place;
+    HNSW graphs and refine wrappers cannot, so their IDs are tombstoned
+    (skipped at search time) until the next compaction.
+    Returns:
+        Updated tombstone array
+    """
+    if supports_remove(index):
+        index.remove_ids(ids)
+        return tombstones
+    return np.union1d(tombstones, ids)
+def _materialize(index, store, tombstones):
+    """
+    Apply the pending deletions of a snapshot to private copies of its
+    index and chunk store before they are rewritten: tombstoned rows are
+    deleted from the store, and vectors are removed where the index can.
+    Returns:
+        Tombstones left (vectors of indexes that cannot remove in place)
+    """
+    if len(tombstones) == 0:
+        return tombstones
+    rows = tombstones[np.isin(tombstones, store.ids)]
+    if len(rows):
+        store.apply_changes((), rows.tolist())
+    if index is not None and supports_remove(index):
+        index.remove_ids(tombstones)
+        return _empty_ids()
+    return tombstones
+def _compact(index, store, tombstones, index_type_label, force=False):
+    """
+    Rebuild an index without its tombstoned vectors once they exceed
+    INDEX_COMPACT_RATIO. Vectors are read back from the index itself, so
+    nothing is re-embedded.
+    Returns:
+        (index, tombstones)
+    """
+    if len(tombstones) == 0 or (not force and len(tombstones) < INDEX_COMPACT_RATIO * index.ntotal):
+        return index, tombstones
+    start = time.time()
+    index_type, _, storage = index_type_label.partition("/")
+    precision, _, rescore = storage.partition("+")
+    vectors = reconstruct_ids(index, store.ids)
+    compacted, _ = build_index(vectors, store.ids, index_type, precision, rescore or "none")
+    print(f"🧹 Compacted index: dropped {len(tombstones)} tombstoned vectors "
+          f"({index.ntotal} → {compacted.ntotal}) in {time.time() - start:.1f}s")
+    return compacted, _empty_ids()
+def get_embedding_cache_stats():
+    """Stats of the chunk embedding cache (None when disabled)."""
+    normalize_embeddings = ConfigManager.get("NORMALIZE_EMBEDDINGS", "true", config_type=bool)
+    cache = get_embedding_cache(_model_key(), normalize_embeddings)
+    return cache.stats() if cache is not None else None
+# ==================== SNAPSHOTS ====================
+# Files written directly into VECTOR_DB_PATH before versioned snapshots
+LEGACY_INDEX_FILES = ("faiss.index", "chunks.sqlite", "manifest.json", "shards")
+def _live_snapshot():
+    """Directory of the published snapshot, adopting pre-snapshot files once."""
+    live = snapshots.current_dir(INDEX_DIR)
+    if live is None and any((INDEX_DIR / name).exists() for name in ("faiss.index", "shards")):
+        live = snapshots.adopt_legacy(INDEX_DIR, LEGACY_INDEX_FILES)
+        print(f"📦 Moved existing index files into snapshot {live.name}")
+    return live
+def open_snapshot(snapshot_dir, use_mmap: bool = None):
+    """
+    Open a published snapshot read-only (no models are loaded). Its
+    dimensionality reduction, if any, is loaded with it and available as
+    metas.reducer() for projecting queries against this index.
+    Args:
+        snapshot_dir: Published snapshot directory
+        use_mmap: Memory-map the index and chunk store so app processes on
+            one node share a single copy (defaults to INDEX_MMAP)
+    Returns:
+        (index, metas)
+    """
+    snapshot_dir = Path(snapshot_dir)
+    use_mmap = INDEX_MMAP if use_mmap is None else use_mmap
+    if INDEX_PREFAULT:
+        touched = sum(prefault(p) for p in snapshot_dir.rglob("*") if p.is_file())
+        print(f"🔥 Pre-faulted {touched / 1e6:.1f} MB of snapshot {snapshot_dir.name}")
+    if (snapshot_dir / "shards").is_dir():
+        from src.sharded_index import ShardedIndex
+        index = ShardedIndex(snapshot_dir / "shards", use_mmap=use_mmap)
+    else:
+        index = configure_search(read_index(snapshot_dir / "faiss.index", use_mmap))
+    # Chunks deleted by a delta snapshot are still in its linked store; hide them
+    store = ChunkStore(snapshot_dir / "chunks.sqlite", read_only=use_mmap,
+                       deleted_ids=_read_tombstones(snapshot_dir))
+    # Loaded now: the snapshot directory may be pruned while this pair is still served
+    store.reducer()
+    return index, store
+def _ensure_side_indexes(live):
+    """
+    Served index and store, first republishing the snapshot with what it
+    lacks added: its BM25 index (snapshots written before hybrid retrieval)
+    and, with DOC_ROUTING on, its document centroids (snapshots written
+    while routing was off). Other files are hard-linked.
+    """
+    missing_lexical = not (live / BM25_FILE).exists()
+    missing_router = DOC_ROUTING and not (live / DOC_CENTROIDS_FILE).exists()
+    if not (missing_lexical or missing_router):
+        return _index, _metas
+    names = [p.name for p in live.iterdir() if p.name != "manifest.json"]
+    staging = snapshots.stage(INDEX_DIR, base=live, link=names, copy=("manifest.json",))
+    if missing_lexical:
+        _save_lexical_index(_metas, staging)
+    if missing_router:
+        _save_doc_router(_index, _metas, staging)
+    return _publish(staging)
+def _publish(staging):
+    """Publish a staged snapshot and open it."""
+    global _index, _metas
+    live = snapshots.publish(INDEX_DIR, staging)
+    # The vectors are in the published index now
+    embed_checkpoint.prune(CHECKPOINT_DIR)
+    _index, _metas = open_snapshot(live)
+    return _index, _metas
+def create_or_load_index(chunks, rebuild: bool = False, incremental: bool = None,
+                         index_type: str = None, progress=None):
     """
     Create or load FAISS index with CONSISTENT embedding.
-   
+
     FIX: Ensures reproducible embeddings each time
+    Changes are written to a new snapshot directory and published
+    atomically; the live snapshot is never modified in place.
+    Args:
+        chunks: Current document chunks (from load_documents_from_folder)
+        rebuild: Force re-embedding every chunk
+        incremental: Diff chunks against the stored index and only embed
+            new/changed ones (defaults to INCREMENTAL_INDEX)
+        index_type: flat, ivf_flat, ivf_pq, hnsw or auto (defaults to FAISS_INDEX_TYPE);
+            storage precision comes from EMBEDDING_PRECISION
+        progress: Optional IndexBuildStatus receiving chunks-embedded updates
     """
     global _index, _metas
-    index_file = INDEX_DIR / "faiss.index"
-    meta_file = INDEX_DIR / "metas.json"
+    legacy_meta_file = INDEX_DIR / "metas.json"
+    # One-off migration of the old JSON metadata (only if it has chunk IDs)
+    if not rebuild and (INDEX_DIR / "faiss.index").exists() and not (INDEX_DIR / "chunks.sqlite").exists() \
+            and legacy_meta_file.exists():
+        legacy = json.loads(legacy_meta_file.read_text(encoding="utf-8"))
+        if legacy and all("chunk_id" in m for m in legacy):
+            migrate_json(legacy_meta_file, INDEX_DIR / "chunks.sqlite").close()
+            legacy_meta_file.unlink()
+            print(f"✅ Migrated metas.json to chunk store ({len(legacy)} chunks)")
+        del legacy
+    live = _live_snapshot()
+    if INDEX_SHARDING == "source":
+        return _create_or_load_sharded(chunks, live, rebuild, index_type, progress)
+    if incremental is None:
+        incremental = INCREMENTAL_INDEX
     embed_dim = get_embed_dim()
     # Load existing index if possible
-    if not rebuild and index_file.exists() and meta_file.exists():
-        _index = faiss.read_index(str(index_file))
-        _metas = json.loads(meta_file.read_text(encoding="utf-8"))
-        if _index.d != embed_dim:
-            print(f"⚠️ FAISS index dimension mismatch ({_index.d} != {embed_dim}), rebuilding...")
+    if not rebuild and live is not None and (live / "faiss.index").exists() and (live / "chunks.sqlite").exists():
+        _index, _metas = open_snapshot(live)
+        manifest = json.loads((live / "manifest.json").read_text(encoding="utf-8"))
+        stored_settings = {k: manifest.get(k) for k in _index_manifest(embed_dim)}
+        current = _with_ids(chunks) if chunks else []
+        if _index.d != _index_dim(embed_dim):
+            print(f"⚠️ FAISS index dimension mismatch ({_index.d} != {_index_dim(embed_dim)}), rebuilding...")
             rebuild = True
-        else:
+        elif not incremental or not chunks:
             print(f"✅ Loaded existing index with {_index.ntotal} vectors")
+            return _ensure_side_indexes(live)
+        elif stored_settings != _index_manifest(embed_dim):
+            print("⚠️ Index built with different model settings, rebuilding...")
+            rebuild = True
+        elif manifest.get("index_type") != index_label(len(current), index_type):
+            print("🔁 Index type or precision changed, rebuilding from cached embeddings...")
+            rebuild = True
+        elif {c["chunk_id"] for c in current} == set(_metas.ids.tolist()):
+            print(f"✅ Loaded existing index with {_index.ntotal} vectors (up to date)")
+            return _ensure_side_indexes(live)
+        else:
+            # Update a private copy (the served one may be memory-mapped read-only);
+            # the chunk store is copied into staging
+            _index = configure_search(read_index(live / "faiss.index"))
+            staging = snapshots.stage(INDEX_DIR, base=live, link=(REDUCER_FILE,), copy=("chunks.sqlite",))
+            store = ChunkStore(staging / "chunks.sqlite")
+            tombstones = _materialize(_index, store, _read_tombstones(live))
+            added, removed, tombstones = _update_index(
+                _index, store, current, progress, _load_reducer(live), tombstones
+            )
+            _index, tombstones = _compact(_index, store, tombstones, manifest["index_type"])
+            _write_tombstones(staging, tombstones)
+            _save_doc_router(_index, store, staging, previous_dir=live)
+            _save_lexical_index(store, staging, previous_dir=live)
+            store.close()
+            _save_index(_index, embed_dim, manifest["index_type"], staging)
+            _publish(staging)
+            print(f"✅ Updated index: +{added} / -{removed} chunks ({_index.ntotal} vectors, "
+                  f"{len(tombstones)} tombstoned)")
             return _index, _metas
     if not chunks:
         raise ValueError("No document chunks found to build index.")
-    # Create embeddings with CONSISTENT settings
-    model = get_model()
-    texts = [c["text"] for c in chunks]
-   
-    # FIX: Use consistent parameters
-    batch_size = int(get_env_var("EMBEDDING_BATCH_SIZE", "32"))
-    embeddings = model.encode(
-        texts,
-        convert_to_numpy=True,
-        show_progress_bar=True,
-        batch_size=batch_size,
-        normalize_embeddings=False
-    )
-    # Normalize for cosine similarity
-    normalize_embeddings = get_env_var("NORMALIZE_EMBEDDINGS", "true", config_type=bool)
-    if normalize_embeddings:
-        faiss.normalize_L2(embeddings)
-    # Create FAISS index with consistent metric
-    index = faiss.IndexFlatIP(embed_dim)
-    index.add(embeddings)
+    staging = snapshots.stage(INDEX_DIR)
+    index, chunks = _build_index(chunks, index_type, progress, target_dir=staging)
     # Save index and metadata
-    faiss.write_index(index, str(index_file))
-    meta_file.write_text(json.dumps(chunks, indent=2), encoding="utf-8")
-    _index, _metas = index, chunks
+    store = ChunkStore.create(staging / "chunks.sqlite", chunks)
+    _save_doc_router(index, store, staging)
+    _save_lexical_index(store, staging)
+    store.close()
+    _save_index(index, embed_dim, index_label(len(chunks), index_type), staging)
+    _publish(staging)
     print(f"✅ Created new index with {len(chunks)} chunks")
     return _index, _metas
-def embed_query(query: str):
-    """Embed a single query with consistent parameters."""
+def _create_or_load_sharded(chunks, live, rebuild=False, index_type=None, progress=None):
+    """
+    Per-source-file shards under <snapshot>/shards. Only shards whose chunks
+    changed are rebuilt (from the embedding cache); unchanged shards are
+    hard-linked into the new snapshot. The chunk store is shared.
+    """
+    global _index, _metas
+    from src.sharded_index import ShardedIndex
+    has_shards = live is not None and (live / "shards" / "shards.json").exists()
+    if not chunks:
+        if not has_shards or not (live / "chunks.sqlite").exists():
+            raise ValueError("No document chunks found to build index.")
+        _index, _metas = open_snapshot(live)
+        print(f"✅ Loaded {len(_index.shards)} index shards with {_index.ntotal} vectors")
+        return _ensure_side_indexes(live)
+    current = _with_ids(chunks)
+    base = live if has_shards and not rebuild else None
+    # All shards share one reduction; a new one means every shard is rebuilt
+    reducer = _load_reducer(base) if base is not None else None
+    link = ("shards", REDUCER_FILE) if reducer is not None else ("shards",)
+    staging = snapshots.stage(INDEX_DIR, base=base, link=link, copy=("chunks.sqlite",))
+    if reducer is None:
+        reducer = _fit_reducer(staging, texts=[c["text"] for c in current])
+    sharded = ShardedIndex(staging / "shards")
+    # Unchanged shards are not re-encoded; they are counted when sync finishes
+    if progress is not None:
+        progress.start_embedding(len(current))
+    rebuilt, dropped = sharded.sync(
+        current, lambda texts: _reduce(_encode_checkpointed(texts, progress), reducer), _index_manifest(get_embed_dim()),
+        index_type, force=rebuild
+    )
+    if progress is not None:
+        progress.complete_embedding()
+    store_file = staging / "chunks.sqlite"
+    changed = bool(rebuilt or dropped)
+    if store_file.exists():
+        store = ChunkStore(store_file)
+        ids = {c["chunk_id"] for c in current}
+        removed = set(store.ids.tolist()) - ids
+        added = [c for c in current if c["chunk_id"] not in store]
+        if added or removed:
+            store.apply_changes(added, removed)
+            changed = True
+    else:
+        store = ChunkStore.create(store_file, current)
+        changed = True
+    if changed:
+        _save_doc_router(sharded, store, staging, previous_dir=base)
+        _save_lexical_index(store, staging, previous_dir=base)
+    store.close()
+    sharded.close()
+    if not changed:
+        snapshots.discard(staging)
+        _index, _metas = open_snapshot(live)
+        _ensure_side_indexes(live)
+    else:
+        (staging / "manifest.json").write_text(
+            json.dumps(_index_manifest(get_embed_dim()), indent=2), encoding="utf-8"
+        )
+        _publish(staging)
+    print(f"✅ Index shards: {len(_index.shards)} ({rebuilt} rebuilt, {dropped} removed), "
+          f"{_index.ntotal} vectors")
+    return _index, _metas
+def remove_sources(source_files, compact: bool = False):
+    """
+    Delete every chunk of the given source files without re-embedding or
+    rewriting the rest of the index. The deletion is published as a delta:
+    the new snapshot hard-links the live snapshot's index, chunk store and
+    BM25 index; only its tombstone list and document centroids (minus the
+    removed files) are rewritten. The store hides tombstoned chunks and
+    searches skip their vectors (a sharded index drops the files' shards
+    instead). Once tombstones reach INDEX_COMPACT_RATIO of the index, or
+    with compact=True, the snapshot is rewritten without them (vectors are
+    read back from the index, nothing is re-embedded).
+    Args:
+        source_files: Source file names (as in chunk metadata)
+        compact: Rewrite the snapshot without tombstones regardless of INDEX_COMPACT_RATIO
+    Returns:
+        Number of chunks removed
+    """
+    start = time.time()
+    live = _live_snapshot()
+    if live is None:
+        raise ValueError("No index to remove documents from.")
+    sources = set(source_files)
+    previous = _read_tombstones(live)
+    store = ChunkStore(live / "chunks.sqlite", read_only=True, deleted_ids=previous)
+    codes = [i for i, name in enumerate(store.source_names) if name in sources]
+    ids = store.ids[np.isin(store.source_codes, codes)]
+    # Every live chunk has a vector; tombstoned vectors come on top
+    n_vectors = len(store) + len(previous)
+    store.close()
+    if len(ids) == 0 and not (compact and len(previous)):
+        print(f"ℹ️ Nothing to remove from {len(sources)} source file(s)")
+        return 0
+    tombstones = np.union1d(previous, ids)
+    if compact or len(tombstones) >= INDEX_COMPACT_RATIO * n_vectors:
+        tombstones = _rewrite_without(live, sources, tombstones)
+    else:
+        rewritten = ("manifest.json", TOMBSTONES_FILE, DOC_CENTROIDS_FILE)
+        names = [p.name for p in live.iterdir() if p.name not in rewritten]
+        staging = snapshots.stage(INDEX_DIR, base=live, link=names, copy=("manifest.json",))
+        # Deleted documents must not keep taking routing slots
+        router = DocRouter.load(live / DOC_CENTROIDS_FILE)
+        router = router.without(sources) if router is not None else None
+        if router is not None:
+            router.save(staging / DOC_CENTROIDS_FILE)
+        if (staging / "shards").is_dir():
+            from src.sharded_index import ShardedIndex
+            sharded = ShardedIndex(staging / "shards")
+            for name in sources:
+                sharded.drop_collection(name)
+            sharded.close()
+        _write_tombstones(staging, tombstones)
+        _publish(staging)
+    print(f"🗑️ Removed {len(ids)} chunks of {len(codes)} source file(s) in {time.time() - start:.2f}s "
+          f"({_index.ntotal} vectors, {len(tombstones)} tombstoned)")
+    return len(ids)
+def _rewrite_without(live, sources, tombstones):
+    """
+    Publish a full copy of the live snapshot with the tombstoned chunks
+    deleted from the store and the index (compaction).
+    Returns:
+        Tombstones left (none)
+    """
+    sharded = (live / "shards").is_dir()
+    link = ("shards", REDUCER_FILE) if sharded else (REDUCER_FILE,)
+    staging = snapshots.stage(INDEX_DIR, base=live, link=link, copy=("chunks.sqlite", "manifest.json"))
+    store = ChunkStore(staging / "chunks.sqlite")
+    if sharded:
+        from src.sharded_index import ShardedIndex
+        index = ShardedIndex(staging / "shards")
+        for name in sources:
+            index.drop_collection(name)
+        _materialize(None, store, tombstones)
+        tombstones = _empty_ids()
+    else:
+        # Work on a private copy; faiss.index is never linked into staging
+        index = configure_search(read_index(live / "faiss.index"))
+        tombstones = _materialize(index, store, tombstones)
+        manifest = json.loads((live / "manifest.json").read_text(encoding="utf-8"))
+        index, tombstones = _compact(index, store, tombstones, manifest["index_type"], force=True)
+    _write_tombstones(staging, tombstones)
+    _save_doc_router(index, store, staging, previous_dir=live)
+    _save_lexical_index(store, staging, previous_dir=live)
+    store.close()
+    if sharded:
+        index.close()
+    else:
+        faiss.write_index(index, str(staging / "faiss.index"))
+    _publish(staging)
+    return tombstones
+def compact_index():
+    """Rebuild the served index without its tombstoned vectors (no re-embedding)."""
+    return remove_sources((), compact=True)
+# In-memory LRU in front of the disk cache / encoder for repeated queries
+_query_lru = QueryVectorLRU(ConfigManager.get("QUERY_EMBED_CACHE_SIZE", 2048, config_type=int))
+def embed_query(query: str, reducer=None):
+    """
+    Embed a single query with consistent parameters.
+    The query is normalized (case, whitespace, trailing punctuation) and
+    served from the query LRU when possible; misses from concurrent sessions
+    are micro-batched by the dispatcher. Query vectors stay in this
+    process's LRU and never go to the shared on-disk document cache.
+    Args:
+        query: Query text
+        reducer: Reduction of the snapshot to be searched (metas.reducer());
+            the vector is projected like that index's vectors
+    """
+    key = normalize_query(query)
+    cached = _query_lru.get(key)
+    if cached is not None:
+        return _reduce_query(cached[None, :], reducer)
+    encode = _get_query_dispatcher().encode if DISPATCH_ENABLED else _encode_query
+    v = encode([key])
+    _query_lru.put(key, v[0])
+    return _reduce_query(v, reducer)
+def _reduce_query(v, reducer):
+    """Project full model query vectors like the vectors of a reduced index."""
+    return reducer.apply(v) if reducer is not None else v
+def get_query_cache_stats():
+    """Hit/miss counters of the query embedding LRU."""
+    return _query_lru.stats()
+_query_dispatcher = None
+def _get_query_dispatcher():
+    global _query_dispatcher
+    if _query_dispatcher is None:
+        _query_dispatcher = EmbeddingDispatcher(_encode_query)
+    return _query_dispatcher
+def get_query_dispatcher_stats():
+    """Queue depth / batch size metrics of the query dispatcher (None if unused)."""
+    return _query_dispatcher.stats() if _query_dispatcher is not None else None
+def _encode_query(queries):
     model = get_model()
     v = model.encode(
-        [query],
+        queries,
         convert_to_numpy=True,
         normalize_embeddings=False
-    )
+    ).astype("float32")
     faiss.normalize_L2(v)
     return v
-__all__ = ['create_or_load_index', 'embed_query', 'get_embed_dim']
+__all__ = ['create_or_load_index', 'remove_sources', 'compact_index', 'open_snapshot', 'embed_query', 'get_embed_dim', 'get_model', 'chunk_id', 'get_embedding_cache_stats', 'get_query_dispatcher_stats', 'get_query_cache_stats', 'encode_length_bucketed', 'get_padding_stats']
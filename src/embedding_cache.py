@@ -0,0 +1,249 @@
+# src/embedding_cache.py
+"""
+Persistent content-addressed embedding cache.
+
+Vectors are keyed by (model name, normalization flag, text hash) and stored
+as an append-only float32 file that is read through np.memmap, plus a table
+of 16-byte text digests whose position is the row of the vector. Rebuilds,
+index-type changes and new processes reuse vectors instead of re-encoding.
+
+Several processes may share a cache directory. Appends hold an exclusive
+lock on store.lock, pick up rows other processes added since, and write
+at the on-disk key count; the files are never truncated, so readers that
+have them mapped are never cut short.
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+import numpy as np
+from src.utils import ConfigManager
+logger = logging.getLogger(__name__)
+KEY_BYTES = 16
+@contextmanager
+def _file_lock(path):
+    """Exclusive inter-process lock held on a lock file (blocks until acquired)."""
+    with open(path, "a+b") as f:
+        if os.name == "nt":
+            import msvcrt
+            while True:
+                try:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.05)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+class EmbeddingCache:
+    """Disk-backed text → vector cache for one (model, normalize) namespace."""
+    def __init__(self, root, model_name: str, normalize: bool):
+        namespace = hashlib.sha256(f"{model_name}|{int(normalize)}".encode("utf-8")).hexdigest()[:16]
+        self.dir = Path(root) / namespace
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.vectors_file = self.dir / "vectors.f32"
+        self.keys_file = self.dir / "keys.bin"
+        self.lock_file = self.dir / "store.lock"
+        self.model_name = model_name
+        self.normalize = normalize
+        self.dim = None
+        self.hits = 0
+        self.misses = 0
+        self._rows = {}
+        # Rows of the files covered by _rows (duplicate keys map to their first row)
+        self._n_rows = 0
+        self._mmap = None
+        self._lock = threading.Lock()
+        self._load()
+    @staticmethod
+    def text_key(text: str) -> bytes:
+        """16-byte content digest of a text."""
+        return hashlib.sha256(text.encode("utf-8")).digest()[:KEY_BYTES]
+    def _load(self):
+        """Read the offset table and map the vector file."""
+        self._remap(self._refresh())
+    def _refresh(self):
+        """
+        Pick up rows appended (by any process) since the table was read.
+        Returns:
+            Row count on disk, where the next append goes
+        """
+        dim_file = self.dir / "dim"
+        if not dim_file.exists() or not self.keys_file.exists():
+            return self._n_rows
+        self.dim = int(dim_file.read_text())
+        n_keys = self.keys_file.stat().st_size // KEY_BYTES
+        n_vectors = self.vectors_file.stat().st_size // (4 * self.dim) if self.vectors_file.exists() else 0
+        # Vectors are written before keys, so a torn append leaves only
+        # unreferenced vector rows (or a partial key) behind
+        n = min(n_keys, n_vectors)
+        known = self._n_rows
+        if n > known:
+            with open(self.keys_file, "rb") as f:
+                f.seek(known * KEY_BYTES)
+                raw_keys = f.read((n - known) * KEY_BYTES)
+            for i in range(n - known):
+                self._rows.setdefault(raw_keys[i * KEY_BYTES:(i + 1) * KEY_BYTES], known + i)
+            self._n_rows = n
+        return max(n, known)
+    def _remap(self, n):
+        self._mmap = (
+            np.memmap(self.vectors_file, dtype="float32", mode="r", shape=(n, self.dim))
+            if n else None
+        )
+    def __len__(self):
+        return len(self._rows)
+    def lookup(self, texts):
+        """
+        Split texts into cached vectors and misses.
+        Returns:
+            (vectors, missing) where vectors[i] is None for every i in missing
+        """
+        vectors, missing = [None] * len(texts), []
+        with self._lock:
+            for i, text in enumerate(texts):
+                row = self._rows.get(self.text_key(text))
+                if row is None:
+                    missing.append(i)
+                else:
+                    vectors[i] = np.array(self._mmap[row])
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        return vectors, missing
+    def store(self, texts, vectors):
+        """Append vectors for texts that are not cached yet."""
+        vectors = np.asarray(vectors, dtype="float32")
+        with self._lock, _file_lock(self.lock_file):
+            start = self._refresh()
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                (self.dir / "dim").write_text(str(self.dim))
+            new_keys, new_rows, pending = [], [], set()
+            for text, vec in zip(texts, vectors):
+                key = self.text_key(text)
+                if key in self._rows or key in pending:
+                    continue
+                pending.add(key)
+                new_keys.append(key)
+                new_rows.append(vec)
+            if not new_keys:
+                self._remap(start)
+                return
+            # Write at the on-disk row count, over any orphaned rows of a
+            # torn append; never truncate (other processes map these files)
+            self._mmap = None
+            for path, offset, data in (
+                (self.vectors_file, start * 4 * self.dim, np.stack(new_rows).astype("float32").tobytes()),
+                (self.keys_file, start * KEY_BYTES, b"".join(new_keys)),
+            ):
+                with open(path, "r+b" if path.exists() else "wb") as f:
+                    f.seek(offset)
+                    f.write(data)
+            for offset, key in enumerate(new_keys):
+                self._rows[key] = start + offset
+            self._n_rows = start + len(new_keys)
+            self._remap(self._n_rows)
+    def get_or_encode(self, texts, encode_fn):
+        """
+        Return vectors for all texts, encoding only cache misses.
+        Args:
+            texts: List of strings
+            encode_fn: Callable mapping a list of strings to a 2-D array
+        """
+        vectors, missing = self.lookup(texts)
+        if missing:
+            encoded = np.asarray(encode_fn([texts[i] for i in missing]), dtype="float32")
+            for i, vec in zip(missing, encoded):
+                vectors[i] = vec
+            self.store([texts[i] for i in missing], encoded)
+        if missing and len(missing) < len(texts):
+            logger.info(f"Embedding cache: {len(texts) - len(missing)} hits, {len(missing)} encoded")
+        return np.stack(vectors).astype("float32") if vectors else np.zeros((0, self.dim or 0), dtype="float32")
+    def stats(self):
+        """Hit/miss counters and size."""
+        total = self.hits + self.misses
+        return {
+            "entries": len(self),
+            "dim": self.dim,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+        }
+# ==================== QUERY LRU ====================
+def normalize_query(text: str) -> str:
+    """
+    Canonical form of a query for caching and embedding: NFKC, lowercase,
+    collapsed whitespace, trailing ?/!/. removed.
+    """
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    text = re.sub(r"\s+", " ", text).strip()
+    return re.sub(r"[?!.]+$", "", text).strip()
+class QueryVectorLRU:
+    """Bounded in-memory LRU of normalized query text → unit vector."""
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    def get(self, key):
+        with self._lock:
+            vec = self._entries.get(key)
+            if vec is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return vec.copy()
+    def put(self, key, vec):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = np.array(vec, dtype="float32")
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+        }
+_caches = {}
+_caches_lock = threading.Lock()
+def get_embedding_cache(model_name: str, normalize: bool, root=None):
+    """Process-wide cache instance for a (model, normalize) namespace, or None if disabled."""
+    if not ConfigManager.get("EMBEDDING_CACHE_ENABLED", "true", config_type=bool):
+        return None
+    if root is None:
+        root = ConfigManager.get("EMBEDDING_CACHE_DIR") or (
+            Path(ConfigManager.get("VECTOR_DB_PATH", "./data/vectorstore")) / "embedding_cache"
+        )
+    key = (str(root), model_name, bool(normalize))
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = EmbeddingCache(root, model_name, normalize)
+        return _caches[key]
+__all__ = ['EmbeddingCache', 'get_embedding_cache', 'QueryVectorLRU', 'normalize_query']
@@ -0,0 +1,428 @@
+# src/index_factory.py
+"""
+FAISS index factory: exact Flat, IVF-Flat, IVF-PQ and HNSW.
+
+All indexes use inner product (vectors are L2-normalized, so this is cosine)
+and store the chunk content-hash IDs, so search_index keeps its contract no
+matter which type is active.
+
+Vector storage precision is independent of the index type:
+    float32  4 bytes/dim (exact)
+    float16  2 bytes/dim
+    sq8      1 byte/dim (per-dimension scalar quantization, trained)
+    pq       dim/8 bytes per vector (product quantization, trained)
+PQ can optionally keep a float32/float16 copy to re-score a shortlist.
+"""
+import logging
+import math
+import mmap
+import os
+import weakref
+import faiss
+import numpy as np
+from src.utils import ConfigManager
+logger = logging.getLogger(__name__)
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+PRECISIONS = ("float32", "float16", "sq8", "pq")
+RESCORE_MODES = ("none", "float32", "float16")
+# Index selection / build settings
+INDEX_TYPE = ConfigManager.get("FAISS_INDEX_TYPE", "auto").lower()
+AUTO_FLAT_MAX = ConfigManager.get("FAISS_AUTO_FLAT_MAX", 50000, config_type=int)
+AUTO_IVF_FLAT_MAX = ConfigManager.get("FAISS_AUTO_IVF_FLAT_MAX", 1000000, config_type=int)
+IVF_NLIST = ConfigManager.get("FAISS_IVF_NLIST", 0, config_type=int)
+PQ_M = ConfigManager.get("FAISS_PQ_M", 0, config_type=int)
+PQ_NBITS = ConfigManager.get("FAISS_PQ_NBITS", 8, config_type=int)
+HNSW_M = ConfigManager.get("FAISS_HNSW_M", 32, config_type=int)
+HNSW_EF_CONSTRUCTION = ConfigManager.get("FAISS_HNSW_EF_CONSTRUCTION", 200, config_type=int)
+# Storage precision and optional exact re-scoring of a PQ shortlist
+PRECISION = ConfigManager.get("EMBEDDING_PRECISION", "float32").lower()
+RESCORE = ConfigManager.get("EMBEDDING_RESCORE", "none").lower()
+RESCORE_K_FACTOR = ConfigManager.get("EMBEDDING_RESCORE_K_FACTOR", 4, config_type=int)
+# Runtime search knobs
+IVF_NPROBE = ConfigManager.get("FAISS_IVF_NPROBE", 16, config_type=int)
+HNSW_EF_SEARCH = ConfigManager.get("FAISS_HNSW_EF_SEARCH", 64, config_type=int)
+# k-means needs ~39 points per centroid to train without warnings
+MIN_POINTS_PER_CENTROID = 39
+def choose_index_type(ntotal: int, requested: str = None) -> str:
+    """
+    Resolve the index type for a corpus of ntotal vectors.
+    "auto" picks exact Flat for small corpora, IVF-Flat for medium and
+    IVF-PQ for large ones. HNSW is only used when asked for explicitly
+    because it cannot remove IDs, which incremental updates rely on.
+    """
+    requested = (requested or INDEX_TYPE).lower()
+    if requested != "auto":
+        if requested not in INDEX_TYPES:
+            raise ValueError(f"Unknown FAISS_INDEX_TYPE '{requested}' (expected auto or one of {INDEX_TYPES})")
+        return requested
+    if ntotal <= AUTO_FLAT_MAX:
+        return "flat"
+    if ntotal <= AUTO_IVF_FLAT_MAX:
+        return "ivf_flat"
+    return "ivf_pq"
+def resolve_precision(index_type: str, precision: str = None) -> str:
+    """Storage precision actually used for an index type."""
+    precision = (precision or PRECISION).lower()
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown EMBEDDING_PRECISION '{precision}' (expected one of {PRECISIONS})")
+    if index_type == "ivf_pq":
+        return "pq"
+    if index_type == "hnsw" and precision == "pq":
+        # HNSW + PQ has no inner-product variant in faiss 1.7
+        logger.warning("HNSW does not support PQ storage with inner product, using sq8")
+        return "sq8"
+    return precision
+def index_label(ntotal: int, requested: str = None, precision: str = None, rescore: str = None) -> str:
+    """
+    Identify an index configuration, e.g. "ivf_flat/sq8" or "flat/pq+float32".
+    Stored in the manifest so a configuration change triggers a rebuild.
+    """
+    index_type = choose_index_type(ntotal, requested)
+    precision = resolve_precision(index_type, precision)
+    rescore = (rescore or RESCORE).lower()
+    label = f"{index_type}/{precision}"
+    if precision == "pq" and rescore != "none":
+        label += f"+{rescore}"
+    return label
+_SQ_TYPES = {
+    "float16": faiss.ScalarQuantizer.QT_fp16,
+    "sq8": faiss.ScalarQuantizer.QT_8bit,
+}
+def _nlist_for(ntotal: int) -> int:
+    nlist = IVF_NLIST or int(4 * math.sqrt(ntotal))
+    return max(1, min(nlist, ntotal // MIN_POINTS_PER_CENTROID))
+def _pq_m_for(dim: int) -> int:
+    """Largest sub-quantizer count <= dim/8 that divides dim (8 dims per code)."""
+    if PQ_M:
+        return PQ_M
+    m = max(1, dim // 8)
+    while dim % m:
+        m -= 1
+    return m
+def _train_sample(embeddings, n_max):
+    if len(embeddings) <= n_max:
+        return embeddings
+    # int(): embedder reads RANDOM_SEED untyped first and ConfigManager caches by key
+    rng = np.random.RandomState(int(ConfigManager.get("RANDOM_SEED", 42)))
+    return embeddings[rng.choice(len(embeddings), n_max, replace=False)]
+def build_index(embeddings, ids, index_type: str = None, precision: str = None, rescore: str = None):
+    """
+    Build and fill an index of the requested (or auto-selected) type.
+    Args:
+        embeddings: float32 array (n, d), already normalized
+        ids: int64 chunk IDs aligned with embeddings
+        index_type: One of INDEX_TYPES or "auto" (defaults to FAISS_INDEX_TYPE)
+        precision: One of PRECISIONS (defaults to EMBEDDING_PRECISION)
+        rescore: One of RESCORE_MODES, only used with PQ storage
+    Returns:
+        (index, resolved_index_type)
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+    ids = np.asarray(ids, dtype="int64")
+    n, dim = embeddings.shape
+    index_type = choose_index_type(n, index_type)
+    precision = resolve_precision(index_type, precision)
+    rescore = (rescore or RESCORE).lower()
+    if rescore not in RESCORE_MODES:
+        raise ValueError(f"Unknown EMBEDDING_RESCORE '{rescore}' (expected one of {RESCORE_MODES})")
+    # Fall back when there is too little data to train the quantizers
+    if precision == "pq" and n < MIN_POINTS_PER_CENTROID * (1 << PQ_NBITS):
+        logger.warning(f"Too few vectors ({n}) to train PQ, using sq8")
+        precision = "sq8"
+        if index_type == "ivf_pq":
+            index_type = "ivf_flat"
+    if index_type in ("ivf_flat", "ivf_pq") and n < 2 * MIN_POINTS_PER_CENTROID:
+        logger.warning(f"Too few vectors ({n}) to train IVF, using Flat")
+        index_type = "flat"
+    if index_type == "flat":
+        if precision == "float32":
+            base = faiss.IndexFlatIP(dim)
+        elif precision == "pq":
+            base = faiss.IndexPQ(dim, _pq_m_for(dim), PQ_NBITS, faiss.METRIC_INNER_PRODUCT)
+        else:
+            base = faiss.IndexScalarQuantizer(dim, _SQ_TYPES[precision], faiss.METRIC_INNER_PRODUCT)
+    elif index_type == "hnsw":
+        if precision == "float32":
+            base = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        else:
+            base = faiss.IndexHNSWSQ(dim, _SQ_TYPES[precision], HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        base.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    else:
+        nlist = _nlist_for(n)
+        quantizer = faiss.IndexFlatIP(dim)
+        if precision == "float32":
+            base = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        elif precision == "pq":
+            base = faiss.IndexIVFPQ(quantizer, dim, nlist, _pq_m_for(dim), PQ_NBITS, faiss.METRIC_INNER_PRODUCT)
+        else:
+            base = faiss.IndexIVFScalarQuantizer(
+                quantizer, dim, nlist, _SQ_TYPES[precision], faiss.METRIC_INNER_PRODUCT
+            )
+    if not base.is_trained:
+        sample = _train_sample(embeddings, max(getattr(base, "nlist", 1), 1 << PQ_NBITS) * 256)
+        print(f"🏋️ Training {index_type}/{precision} index on {len(sample)} vectors...")
+        base.train(sample)
+    if precision == "pq" and rescore != "none":
+        # Shortlist from PQ codes, then re-score with uncompressed vectors
+        if rescore == "float32":
+            base = faiss.IndexRefineFlat(base)
+        else:
+            base = faiss.IndexRefine(base, faiss.IndexScalarQuantizer(dim, _SQ_TYPES["float16"], faiss.METRIC_INNER_PRODUCT))
+        base.k_factor = RESCORE_K_FACTOR
+    # IVF indexes store IDs themselves; everything else goes through an ID map
+    index = base if isinstance(base, faiss.IndexIVF) else faiss.IndexIDMap2(base)
+    if n:
+        index.add_with_ids(embeddings, ids)
+    configure_search(index)
+    return index, index_type
+def configure_search(index, nprobe: int = None, ef_search: int = None):
+    """
+    Apply runtime search knobs (IVF nprobe, HNSW efSearch) to an index.
+    Safe to call on any index type; irrelevant knobs are ignored.
+    """
+    nprobe = nprobe or IVF_NPROBE
+    ef_search = ef_search or HNSW_EF_SEARCH
+    try:
+        ivf = faiss.extract_index_ivf(index)
+        ivf.nprobe = min(nprobe, ivf.nlist)
+    except RuntimeError:
+        pass
+    inner = _unwrap(index)
+    if isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efSearch = ef_search
+    refine = _find(index, faiss.IndexRefine)
+    if refine is not None:
+        refine.k_factor = RESCORE_K_FACTOR
+    return index
+def _layers(index):
+    """Yield an index and every index it wraps (ID map, refine)."""
+    index = faiss.downcast_index(index)
+    while True:
+        yield index
+        if isinstance(index, faiss.IndexIDMap):
+            index = faiss.downcast_index(index.index)
+        elif isinstance(index, faiss.IndexRefine):
+            index = faiss.downcast_index(index.base_index)
+        else:
+            return
+def _find(index, cls):
+    return next((layer for layer in _layers(index) if isinstance(layer, cls)), None)
+def _unwrap(index):
+    """Innermost index holding the vectors."""
+    *_, inner = _layers(index)
+    return inner
+def describe_index(index) -> str:
+    """Short label of the underlying index type, e.g. 'ivf_flat'."""
+    inner = _unwrap(index)
+    if isinstance(inner, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(inner, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(inner, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+def supports_remove(index) -> bool:
+    """HNSW graphs and refine wrappers cannot drop vectors; everything else here can."""
+    return describe_index(index) != "hnsw" and _find(index, faiss.IndexRefine) is None
+def index_memory_bytes(index) -> int:
+    """Size of the serialized index, which tracks its resident memory."""
+    return int(faiss.serialize_index(index).nbytes)
+# ==================== LOADING ====================
+# Map flat/SQ/HNSW codes and IVF lists from the file (MMAP_IFC) instead of
+# copying them, so processes serving the same snapshot share the page cache.
+# Adding IO_FLAG_MMAP on top makes IVF loading fail ("mmap only supported
+# for File objects")
+MMAP_FLAGS = faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY
+PAGE_SIZE = mmap.PAGESIZE
+def read_index(path, use_mmap: bool = False):
+    """Read an index from disk, memory-mapped and read-only if requested."""
+    if use_mmap:
+        return faiss.read_index(str(path), MMAP_FLAGS)
+    return faiss.read_index(str(path))
+def prefault(path) -> int:
+    """
+    Pull a file into the OS page cache by touching one byte per page, so
+    the first queries after a cold start don't stall on disk reads.
+    Returns:
+        Bytes touched
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if hasattr(mapped, "madvise") and hasattr(mmap, "MADV_WILLNEED"):
+                mapped.madvise(mmap.MADV_WILLNEED)
+            pages = np.frombuffer(mapped, dtype=np.uint8)[::PAGE_SIZE]
+            int(pages.sum())
+            del pages
+    return size
+# ==================== VECTOR ACCESS ====================
+def reconstruct_ids(index, ids):
+    """
+    Stored vectors for external IDs (decoded, so approximate for SQ/PQ).
+    IVF indexes get a temporary ID hash table, dropped again afterwards so
+    the index is written without it.
+    """
+    ids = np.asarray(ids, dtype="int64")
+    if len(ids) == 0:
+        return np.zeros((0, index.d), dtype="float32")
+    if not isinstance(index, (faiss.IndexIVF, faiss.IndexIDMap)):
+        index = faiss.downcast_index(index)
+    if not isinstance(index, faiss.IndexIVF):
+        return index.reconstruct_batch(ids)
+    if index.direct_map.type != faiss.DirectMap.NoMap:
+        return index.reconstruct_batch(ids)
+    index.set_direct_map_type(faiss.DirectMap.Hashtable)
+    try:
+        return index.reconstruct_batch(ids)
+    finally:
+        index.set_direct_map_type(faiss.DirectMap.NoMap)
+# ==================== FILTERED SEARCH ====================
+# Per-ID-map cache of (ntotal, external ids, argsort of external ids)
+_id_map_cache = weakref.WeakKeyDictionary()
+def _external_ids(id_map_index):
+    """Internal position → external ID array of an IndexIDMap, with a sort order."""
+    cached = _id_map_cache.get(id_map_index)
+    if cached is not None and cached[0] == id_map_index.ntotal:
+        return cached[1], cached[2]
+    external = faiss.vector_to_array(id_map_index.id_map).astype("int64")
+    order = np.argsort(external, kind="stable")
+    _id_map_cache[id_map_index] = (id_map_index.ntotal, external, order)
+    return external, order
+def _selector_params(index, selector):
+    """Search parameters carrying a selector for one index layer (None if unsupported)."""
+    if isinstance(index, faiss.IndexRefine):
+        base = _selector_params(faiss.downcast_index(index.base_index), selector)
+        if base is None:
+            return None
+        params = faiss.IndexRefineSearchParameters(k_factor=index.k_factor, base_index_params=base)
+        params.sel = selector
+        return params
+    if isinstance(index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=index.nprobe)
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    if isinstance(index, faiss.IndexPQ):
+        # IndexPQ's scanner does not accept selectors
+        return None
+    return faiss.SearchParameters(sel=selector)
+def _first_kept(D, I, keep, k):
+    """First k kept results per row, padded with -inf / -1."""
+    scores = np.full((len(D), k), -np.inf, dtype="float32")
+    labels = np.full((len(D), k), -1, dtype="int64")
+    for q in range(len(D)):
+        hit_scores, hit_ids = D[q][keep[q]][:k], I[q][keep[q]][:k]
+        scores[q, :len(hit_ids)] = hit_scores
+        labels[q, :len(hit_ids)] = hit_ids
+    return scores, labels
+def _post_filtered(index, x, k, ids):
+    """Fallback: widen k until enough allowed IDs come back, then filter."""
+    allowed = np.asarray(ids, dtype="int64")
+    fetch = min(index.ntotal, max(k * 4, 64))
+    while True:
+        D, I = index.search(x, fetch)
+        keep = np.isin(I, allowed)
+        if fetch >= index.ntotal or keep.sum(axis=1).min() >= k:
+            break
+        fetch = min(index.ntotal, fetch * 4)
+    return _first_kept(D, I, keep, k)
+def search_filtered(index, x, k, ids):
+    """
+    Search only among the given external IDs. The selector is applied by
+    FAISS during the scan (IVF lists, flat/SQ codes, HNSW graph), so k does
+    not have to grow with the number of excluded vectors.
+    Args:
+        index: Index from build_index (ID-mapped or IVF)
+        x: float32 query matrix
+        k: Results per query
+        ids: Allowed chunk IDs
+    Returns:
+        (scores, ids) like index.search
+    """
+    ids = np.unique(np.asarray(ids, dtype="int64"))
+    if not isinstance(index, (faiss.IndexIVF, faiss.IndexIDMap)):
+        # Keep the caller's proxy when possible: it keys the ID map cache
+        index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIVF):
+        # IVF stores external IDs; a hash-set selector matches them directly
+        selector = faiss.IDSelectorBatch(ids)
+        return index.search(x, k, params=faiss.SearchParametersIVF(sel=selector, nprobe=index.nprobe))
+    if not isinstance(index, faiss.IndexIDMap):
+        return _post_filtered(index, x, k, ids)
+    return _search_positions(index, x, k, _position_mask(index, ids), lambda: ids)
+def _position_mask(id_map_index, ids):
+    """Bitmap over an IndexIDMap's internal positions holding the given external IDs."""
+    external, order = _external_ids(id_map_index)
+    # Translate IDs to internal positions and mark them
+    pos = np.searchsorted(external, ids, sorter=order)
+    pos = np.minimum(pos, len(external) - 1) if len(external) else pos
+    found = external[order[pos]] == ids if len(external) else np.zeros(len(ids), dtype=bool)
+    mask = np.zeros(id_map_index.ntotal, dtype=bool)
+    mask[order[pos[found]]] = True
+    return mask
+def _search_positions(id_map_index, x, k, mask, allowed_ids):
+    """Search an IndexIDMap among the internal positions set in mask."""
+    inner = faiss.downcast_index(id_map_index.index)
+    external, _ = _external_ids(id_map_index)
+    bitmap = np.packbits(mask, bitorder="little")
+    selector = faiss.IDSelectorBitmap(id_map_index.ntotal, faiss.swig_ptr(bitmap))
+    params = _selector_params(inner, selector)
+    if params is None:
+        return _post_filtered(id_map_index, x, k, allowed_ids())
+    D, I = inner.search(x, k, params=params)
+    labels = np.where(I >= 0, external[np.maximum(I, 0)], -1)
+    return D, labels
+# Per-ID-map cache of (ntotal, excluded count, live-position mask)
+_live_mask_cache = weakref.WeakKeyDictionary()
+def search_excluding(index, x, k, excluded_ids):
+    """
+    Search everything except the given external IDs (tombstoned vectors of
+    indexes that cannot remove in place). The live-position bitmap is
+    cached per index, so repeated queries only pay for the scan.
+    Args:
+        index: Index from build_index
+        x: float32 query matrix
+        k: Results per query
+        excluded_ids: Sorted int64 chunk IDs to skip
+    Returns:
+        (scores, ids) like index.search
+    """
+    excluded_ids = np.asarray(excluded_ids, dtype="int64")
+    if len(excluded_ids) == 0:
+        return index.search(x, k)
+    if not isinstance(index, (faiss.IndexIVF, faiss.IndexIDMap)):
+        index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIVF):
+        # Keep the wrapped selector referenced for the duration of the search
+        batch = faiss.IDSelectorBatch(excluded_ids)
+        selector = faiss.IDSelectorNot(batch)
+        return index.search(x, k, params=faiss.SearchParametersIVF(sel=selector, nprobe=index.nprobe))
+    if not isinstance(index, faiss.IndexIDMap):
+        D, I = index.search(x, k + len(excluded_ids))
+        keep = ~np.isin(I, excluded_ids)
+        return _first_kept(D, I, keep, k)
+    cached = _live_mask_cache.get(index)
+    if cached is None or cached[:2] != (index.ntotal, len(excluded_ids)):
+        cached = (index.ntotal, len(excluded_ids), ~_position_mask(index, excluded_ids))
+        _live_mask_cache[index] = cached
+    mask = cached[2]
+    external, _ = _external_ids(index)
+    return _search_positions(index, x, k, mask, lambda: external[mask])
+__all__ = [
+    'INDEX_TYPES',
+    'PRECISIONS',
+    'choose_index_type',
+    'resolve_precision',
+    'index_label',
+    'index_memory_bytes',
+    'build_index',
+    'read_index',
+    'prefault',
+    'search_filtered',
+    'search_excluding',
+    'reconstruct_ids',
+    'configure_search',
+    'describe_index',
+    'supports_remove'
+]
@@ -0,0 +1,142 @@
+# src/index_status.py
+"""
+Background index build with a readiness/progress object.
+
+The app starts document loading, OCR and embedding on a worker thread and
+renders immediately. IndexBuildStatus is updated by the loader (files) and
+the embedder (chunks) and exposes progress, an ETA and the build result
+once ready.
+"""
+import logging
+import threading
+import time
+logger = logging.getLogger(__name__)
+class IndexBuildStatus:
+    """Thread-safe progress of one index build."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self.state = "pending"
+        self.files_total = 0
+        self.files_done = 0
+        self.current_file = None
+        self.chunks_total = 0
+        self.chunks_embedded = 0
+        self.started_at = None
+        self.phase_started_at = None
+        self.finished_at = None
+        self.error = None
+        self.result = None
+    # Progress callbacks (called from the build thread)
+    def start_loading(self, files_total: int):
+        with self._lock:
+            self.state = "loading"
+            self.files_total = files_total
+            self.files_done = 0
+            self.phase_started_at = time.time()
+    def file_done(self, file_name: str, n_chunks: int):
+        with self._lock:
+            self.files_done += 1
+            self.current_file = file_name
+    def start_embedding(self, chunks_total: int):
+        with self._lock:
+            self.state = "embedding"
+            self.chunks_total = chunks_total
+            self.chunks_embedded = 0
+            self.phase_started_at = time.time()
+    def add_embedded(self, n: int):
+        with self._lock:
+            self.chunks_embedded = min(self.chunks_total, self.chunks_embedded + n)
+    def complete_embedding(self):
+        with self._lock:
+            self.chunks_embedded = self.chunks_total
+    # Lifecycle
+    def _finish(self, state, result=None, error=None):
+        with self._lock:
+            self.state = state
+            self.result = result
+            self.error = error
+            self.finished_at = time.time()
+        self._done.set()
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+    @property
+    def failed(self) -> bool:
+        return self.state == "failed"
+    def wait(self, timeout: float = None) -> bool:
+        """Block until the build finished (ready or failed). Returns True if ready."""
+        self._done.wait(timeout)
+        return self.ready
+    def eta_seconds(self):
+        """Seconds left in the current phase at its observed rate (None if unknown)."""
+        with self._lock:
+            if self.state == "loading":
+                done, total = self.files_done, self.files_total
+            elif self.state == "embedding":
+                done, total = self.chunks_embedded, self.chunks_total
+            else:
+                return None
+            if not done or not self.phase_started_at:
+                return None
+            rate = done / max(time.time() - self.phase_started_at, 1e-9)
+            return max(0.0, (total - done) / rate)
+    def snapshot(self):
+        """Progress as a plain dict (for the UI)."""
+        eta = self.eta_seconds()
+        with self._lock:
+            return {
+                "state": self.state,
+                "files_done": self.files_done,
+                "files_total": self.files_total,
+                "current_file": self.current_file,
+                "chunks_embedded": self.chunks_embedded,
+                "chunks_total": self.chunks_total,
+                "eta_seconds": eta,
+                "elapsed_seconds": (self.finished_at or time.time()) - self.started_at if self.started_at else 0.0,
+                "error": str(self.error) if self.error else None,
+            }
+    def describe(self) -> str:
+        """One-line human readable progress."""
+        s = self.snapshot()
+        if s["state"] == "ready":
+            return f"✅ Index ready ({s['elapsed_seconds']:.0f}s)"
+        if s["state"] == "failed":
+            return f"❌ Index build failed: {s['error']}"
+        if s["state"] == "embedding":
+            text = f"🧠 Embedding chunks: {s['chunks_embedded']}/{s['chunks_total']}"
+        elif s["state"] == "loading":
+            text = f"📄 Reading documents: {s['files_done']}/{s['files_total']} files"
+        else:
+            return "⏳ Index build starting..."
+        if s["eta_seconds"] is not None:
+            text += f" (about {s['eta_seconds']:.0f}s left)"
+        return text
+    def waiting_message(self) -> str:
+        """Answer given to queries that arrive before the index is ready."""
+        if self.failed:
+            return f"⚠️ The document index could not be built ({self.error}). Please contact the administrator."
+        return f"⏳ I'm still indexing the documents, please ask again in a moment.\n\n{self.describe()}"
+def start_background_build(build_fn) -> IndexBuildStatus:
+    """
+    Run build_fn(status) on a daemon thread.
+    Args:
+        build_fn: Callable taking the status object and returning the build
+            result (stored as status.result once ready)
+    Returns:
+        IndexBuildStatus updated as the build progresses
+    """
+    status = IndexBuildStatus()
+    status.started_at = time.time()
+    def _run():
+        try:
+            result = build_fn(status)
+        except Exception as e:
+            logger.exception("Background index build failed")
+            status._finish("failed", error=e)
+            return
+        status._finish("ready", result=result)
+        print(f"✅ Background index build finished in {time.time() - status.started_at:.1f}s")
+    threading.Thread(target=_run, name="index-build", daemon=True).start()
+    return status
+__all__ = ['IndexBuildStatus', 'start_background_build']
@@ -0,0 +1,210 @@
+# src/lexical_index.py
+"""
+In-process BM25 inverted index over chunk text, for hybrid retrieval.
+
+Dense vectors are weak on exact identifiers (tender numbers, acronyms like
+"e-GP", form names). The inverted index keeps every chunk's term
+frequencies in flat numpy postings (term, document, tf) sorted by term,
+so a query only touches the postings of its own terms. Compound tokens
+such as "e-gp" or "gfr-2017/12" are indexed whole and split into their
+parts.
+
+It is written per snapshot as bm25.npz next to the chunk store; a new
+snapshot drops the postings of deleted chunks and tokenizes only the
+added ones. Rankings from BM25 and the vector index are combined with
+reciprocal rank fusion (reciprocal_rank_fusion).
+"""
+import logging
+import os
+import re
+import time
+from collections import Counter
+from pathlib import Path
+import numpy as np
+from src.utils import ConfigManager
+logger = logging.getLogger(__name__)
+BM25_K1 = ConfigManager.get("BM25_K1", 1.2, config_type=float)
+BM25_B = ConfigManager.get("BM25_B", 0.75, config_type=float)
+# Rank constant of reciprocal rank fusion (larger = flatter)
+RRF_K = ConfigManager.get("RRF_K", 60, config_type=int)
+BM25_FILE = "bm25.npz"
+# Term frequencies are stored as uint16
+MAX_TF = 65535
+# ==================== TOKENIZING ====================
+# Words, optionally joined by -, /, . or _ (identifiers, form numbers)
+_TOKEN = re.compile(r"[^\W_]+(?:[-/._][^\W_]+)*")
+_SPLIT = re.compile(r"[-/._]")
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have how i if in into is it its of on or
+that the their then there these they this to was were what when where which who why
+will with you your can do does should would
+""".split())
+def tokenize(text: str):
+    """Lowercased terms of a text; compound tokens are kept whole and also split."""
+    terms = []
+    for match in _TOKEN.finditer(text.lower()):
+        token = match.group()
+        if token in STOPWORDS:
+            continue
+        terms.append(token)
+        if not token.isalnum():
+            terms.extend(part for part in _SPLIT.split(token) if part and part not in STOPWORDS)
+    return terms
+# ==================== INDEX ====================
+class BM25Index:
+    """Okapi BM25 over chunk texts, keyed by chunk ID."""
+    def __init__(self, terms, doc_ids, doc_len, post_term, post_doc, post_tf):
+        """
+        Args:
+            terms: Vocabulary (term number → term)
+            doc_ids: Chunk ID of each document number
+            doc_len: Token count of each document
+            post_term, post_doc, post_tf: Postings (term number, document number, tf)
+        """
+        self.terms = list(terms)
+        self.vocab = {t: i for i, t in enumerate(self.terms)}
+        self.doc_ids = np.asarray(doc_ids, dtype="int64")
+        self.doc_len = np.asarray(doc_len, dtype="int32")
+        order = np.lexsort((post_doc, post_term))
+        self.post_term = np.asarray(post_term, dtype="int32")[order]
+        self.post_doc = np.asarray(post_doc, dtype="int32")[order]
+        self.post_tf = np.asarray(post_tf, dtype="uint16")[order]
+        df = np.bincount(self.post_term, minlength=len(self.terms))
+        self.offsets = np.concatenate([[0], np.cumsum(df)]).astype("int64")
+        n = len(self.doc_ids)
+        self.idf = np.log1p((n - df + 0.5) / (df + 0.5)).astype("float32")
+        avgdl = float(self.doc_len.mean()) if n else 1.0
+        # Per-document part of the BM25 denominator
+        self._norm = (BM25_K1 * (1 - BM25_B + BM25_B * self.doc_len / max(avgdl, 1e-9))).astype("float32")
+    def __len__(self):
+        return len(self.doc_ids)
+    @classmethod
+    def from_texts(cls, ids, texts, terms=()):
+        """Index new texts (chunk IDs aligned with texts), extending a vocabulary."""
+        terms = list(terms)
+        vocab = {t: i for i, t in enumerate(terms)}
+        doc_len, post_term, post_doc, post_tf = [], [], [], []
+        for d, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_len.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                t = vocab.get(term)
+                if t is None:
+                    t = vocab[term] = len(terms)
+                    terms.append(term)
+                post_term.append(t)
+                post_doc.append(d)
+                post_tf.append(min(tf, MAX_TF))
+        return cls(terms, ids, doc_len, post_term, post_doc, post_tf)
+    @classmethod
+    def build(cls, store, previous=None):
+        """
+        Index of a chunk store.
+        Args:
+            store: ChunkStore of the snapshot
+            previous: Index of the previous snapshot; only chunks it lacks are tokenized
+        """
+        start = time.time()
+        if previous is None:
+            ids, texts = [], []
+            for chunk in store:
+                ids.append(chunk["chunk_id"])
+                texts.append(chunk["text"])
+            index, added = cls.from_texts(ids, texts), len(ids)
+        else:
+            index, added = previous.updated(store)
+        print(f"🔤 BM25 index: {len(index)} chunks, {len(index.terms)} terms "
+              f"({added} tokenized) in {time.time() - start:.1f}s")
+        return index
+    def updated(self, store):
+        """
+        Copy in line with a chunk store: postings of deleted chunks are
+        dropped and only new chunks are tokenized.
+        Returns:
+            (index, number of chunks tokenized)
+        """
+        keep = np.isin(self.doc_ids, store.ids)
+        added_ids = np.setdiff1d(store.ids, self.doc_ids)
+        added = store.get_many(added_ids)
+        new = BM25Index.from_texts([c["chunk_id"] for c in added], [c["text"] for c in added], self.terms)
+        # Renumber kept documents, then append the new ones after them
+        renumber = np.cumsum(keep) - 1
+        kept = keep[self.post_doc]
+        post_term = np.concatenate([self.post_term[kept], new.post_term])
+        post_doc = np.concatenate([renumber[self.post_doc[kept]], new.post_doc + int(keep.sum())])
+        post_tf = np.concatenate([self.post_tf[kept], new.post_tf])
+        # Drop terms no document uses any more
+        used = np.bincount(post_term, minlength=len(new.terms)) > 0
+        term_map = np.cumsum(used) - 1
+        terms = [t for t, u in zip(new.terms, used) if u]
+        index = BM25Index(terms, np.concatenate([self.doc_ids[keep], new.doc_ids]),
+                          np.concatenate([self.doc_len[keep], new.doc_len]),
+                          term_map[post_term], post_doc, post_tf)
+        return index, len(added)
+    def search(self, query: str, k: int, allowed_ids=None, excluded_ids=None):
+        """
+        Top-k chunks by BM25 score.
+        Args:
+            query: Query text (tokenized like the chunks)
+            k: Results
+            allowed_ids: Optional chunk IDs to restrict to (metadata filters)
+            excluded_ids: Optional chunk IDs to skip (tombstoned chunks)
+        Returns:
+            (scores, chunk_ids) as 1-D arrays, best first; only chunks
+            containing at least one query term
+        """
+        term_ids = sorted({self.vocab[t] for t in tokenize(query) if t in self.vocab})
+        scores = np.zeros(len(self.doc_ids), dtype="float32")
+        for t in term_ids:
+            start, end = self.offsets[t], self.offsets[t + 1]
+            docs = self.post_doc[start:end]
+            tf = self.post_tf[start:end].astype("float32")
+            scores[docs] += self.idf[t] * tf * (BM25_K1 + 1) / (tf + self._norm[docs])
+        if allowed_ids is not None:
+            scores[~np.isin(self.doc_ids, allowed_ids)] = 0.0
+        if excluded_ids is not None and len(excluded_ids):
+            scores[np.isin(self.doc_ids, excluded_ids)] = 0.0
+        hits = np.flatnonzero(scores > 0)
+        if len(hits) > k:
+            hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        hits = hits[np.argsort(-scores[hits], kind="stable")]
+        return scores[hits], self.doc_ids[hits]
+    # ---------- persistence ----------
+    def save(self, path):
+        # Replace, never rewrite: a published snapshot may share the file
+        path = Path(path)
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            np.savez(f, terms=np.frombuffer("\n".join(self.terms).encode("utf-8"), dtype=np.uint8),
+                     doc_ids=self.doc_ids, doc_len=self.doc_len, post_term=self.post_term,
+                     post_doc=self.post_doc, post_tf=self.post_tf)
+        os.replace(tmp, path)
+    @classmethod
+    def load(cls, path):
+        """Index saved next to a chunk store, or None if the snapshot has none."""
+        path = Path(path)
+        if not path.exists():
+            return None
+        with np.load(path) as data:
+            joined = data["terms"].tobytes().decode("utf-8")
+            return cls(joined.split("\n") if joined else [], data["doc_ids"], data["doc_len"],
+                       data["post_term"], data["post_doc"], data["post_tf"])
+# ==================== FUSION ====================
+def reciprocal_rank_fusion(rankings, k: int = None, limit: int = None):
+    """
+    Combine rankings with reciprocal rank fusion: score(d) = Σ 1 / (k + rank).
+    Args:
+        rankings: Lists of chunk IDs, best first
+        k: Rank constant (defaults to RRF_K)
+        limit: Results to return (all if None)
+    Returns:
+        List of (chunk_id, fused score), best first
+    """
+    k = RRF_K if k is None else k
+    fused = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (k + rank + 1)
+    ordered = sorted(fused.items(), key=lambda item: item[1], reverse=True)
+    return ordered[:limit] if limit is not None else ordered
+__all__ = ['BM25Index', 'tokenize', 'reciprocal_rank_fusion', 'BM25_FILE']
@@ -0,0 +1,93 @@
+# src/metadata_filter.py
+"""
+Metadata → chunk ID bitmap index for filtered vector search.
+
+Built once per chunk store from its in-memory columns: for every value of
+source_file, file_type and slide_number it keeps the sorted positions of
+the matching chunks. A filter is resolved to a bitmap over store positions
+(OR within a field, AND across fields) and then to the chunk IDs that FAISS
+is allowed to visit (see index_factory.search_filtered).
+
+Filters look like:
+    {"source_file": "Manual.pdf"}
+    {"file_type": ["pptx", "ppt"], "slide_number": [3, 4]}
+"""
+from pathlib import Path
+import numpy as np
+FILTER_FIELDS = ("source_file", "file_type", "slide_number")
+def file_type_of(source_file: str) -> str:
+    """Lower-case extension without the dot ('' if none)."""
+    return Path(source_file or "").suffix.lower().lstrip(".")
+def _postings(codes, n_values):
+    """Sorted positions per code value, via one stable argsort."""
+    order = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[order], np.arange(n_values + 1))
+    return [order[bounds[v]:bounds[v + 1]] for v in range(n_values)]
+def _as_list(value):
+    return list(value) if isinstance(value, (list, tuple, set, frozenset)) else [value]
+class MetadataFilterIndex:
+    """Per-value position lists over a ChunkStore's columns."""
+    def __init__(self, ids, source_names, source_codes, slide_numbers):
+        self.ids = ids
+        self.source_names = list(source_names)
+        n_sources = len(self.source_names)
+        valid = source_codes >= 0
+        by_source = _postings(np.where(valid, source_codes, n_sources), n_sources + 1)[:n_sources]
+        self._fields = {"source_file": dict(zip(self.source_names, by_source))}
+        file_types = {}
+        for name, positions in self._fields["source_file"].items():
+            file_types.setdefault(file_type_of(name), []).append(positions)
+        self._fields["file_type"] = {t: np.sort(np.concatenate(p)) for t, p in file_types.items()}
+        slides = np.unique(slide_numbers[slide_numbers >= 0])
+        slide_codes = np.searchsorted(slides, np.where(slide_numbers >= 0, slide_numbers, -1))
+        slide_codes = np.where(slide_numbers >= 0, slide_codes, len(slides))
+        self._fields["slide_number"] = dict(zip(slides.tolist(), _postings(slide_codes, len(slides) + 1)))
+    @classmethod
+    def from_store(cls, store):
+        return cls(store.ids, store.source_names, store.source_codes, store.slide_numbers)
+    def _normalize(self, field, value):
+        if field == "file_type":
+            return str(value).lower().lstrip(".")
+        if field == "slide_number":
+            return int(value)
+        return value
+    def mask(self, filters):
+        """Bitmap over store positions of the chunks matching all filters."""
+        mask = np.ones(len(self.ids), dtype=bool)
+        for field, value in (filters or {}).items():
+            if field not in self._fields:
+                raise ValueError(f"Unsupported filter field '{field}' (use one of {FILTER_FIELDS})")
+            field_mask = np.zeros(len(self.ids), dtype=bool)
+            for v in _as_list(value):
+                positions = self._fields[field].get(self._normalize(field, v))
+                if positions is not None:
+                    field_mask[positions] = True
+            mask &= field_mask
+        return mask
+    def ids_for(self, filters):
+        """Chunk IDs matching the filters."""
+        return self.ids[self.mask(filters)]
+    def sources_for(self, filters):
+        """Source files that can contain matches (used to pick index shards)."""
+        if not filters:
+            return None
+        allowed = self.mask(filters)
+        return [name for name in self.source_names if allowed[self._fields["source_file"][name]].any()]
+def matches(chunk, filters) -> bool:
+    """Check one chunk dict against filters (for plain lists of chunks)."""
+    meta = chunk.get("metadata", {})
+    for field, value in (filters or {}).items():
+        if field == "file_type":
+            actual = file_type_of(meta.get("source_file"))
+            wanted = {str(v).lower().lstrip(".") for v in _as_list(value)}
+        elif field == "slide_number":
+            actual = meta.get("slide_number")
+            actual = int(actual) if actual is not None else None
+            wanted = {int(v) for v in _as_list(value)}
+        else:
+            actual = meta.get(field)
+            wanted = set(_as_list(value))
+        if actual not in wanted:
+            return False
+    return True
+__all__ = ['MetadataFilterIndex', 'FILTER_FIELDS', 'file_type_of', 'matches']
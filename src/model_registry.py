@@ -0,0 +1,134 @@
+# src/model_registry.py
+"""
+Process-wide model registry.
+
+Heavy models (sentence embedder, cross-encoder reranker, OCR engine) are
+registered by name with a loader and created lazily on first use, exactly
+once per process, no matter how many modules ask for them.
+"""
+import gc
+import logging
+import os
+import threading
+import time
+logger = logging.getLogger(__name__)
+_loaders = {}
+_models = {}
+_stats = {}
+_lock = threading.RLock()
+def register_model(name: str, loader):
+    """
+    Register a zero-argument loader for a model name.
+    Re-registering an already loaded model keeps the loaded instance.
+    """
+    with _lock:
+        _loaders[name] = loader
+def get_model(name: str):
+    """Return the shared instance of a registered model, loading it if needed."""
+    model = _models.get(name)
+    if model is not None:
+        return model
+    with _lock:
+        if name in _models:
+            return _models[name]
+        if name not in _loaders:
+            raise KeyError(f"No model registered under '{name}'")
+        rss_before = _current_rss()
+        start = time.time()
+        model = _loaders[name]()
+        elapsed = time.time() - start
+        rss_after = _current_rss()
+        _models[name] = model
+        _stats[name] = {
+            "load_seconds": elapsed,
+            "rss_delta_bytes": (rss_after - rss_before) if rss_before is not None and rss_after is not None else None,
+        }
+        print(f"🧠 Loaded model '{name}' in {elapsed:.1f}s")
+        return model
+def is_loaded(name: str) -> bool:
+    return name in _models
+def unload_model(name: str) -> bool:
+    """Drop a loaded model so its memory can be reclaimed. Returns True if it was loaded."""
+    with _lock:
+        model = _models.pop(name, None)
+        _stats.pop(name, None)
+    if model is None:
+        return False
+    del model
+    gc.collect()
+    try:
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    except ImportError:
+        pass
+    logger.info(f"Unloaded model '{name}'")
+    return True
+def _param_bytes(model):
+    """Bytes held by torch parameters/buffers (None for non-torch models)."""
+    modules = getattr(model, "model", model)
+    if not hasattr(modules, "parameters"):
+        return None
+    try:
+        total = sum(p.numel() * p.element_size() for p in modules.parameters())
+        total += sum(b.numel() * b.element_size() for b in modules.buffers())
+        return int(total)
+    except Exception:
+        return None
+def _current_rss():
+    """Resident set size of this process in bytes (Linux only, else None)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+def process_memory():
+    """
+    Unique vs shared resident memory of this process from
+    /proc/self/smaps_rollup (Linux only, else None). Memory-mapped index
+    pages that other app processes also map show up as shared, and PSS
+    splits them evenly between those processes.
+    Returns:
+        {"rss_bytes", "pss_bytes", "unique_bytes", "shared_bytes"}
+    """
+    try:
+        fields = {}
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[1].isdigit():
+                    fields[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    except OSError:
+        return None
+    return {
+        "rss_bytes": fields.get("Rss", 0),
+        "pss_bytes": fields.get("Pss", 0),
+        "unique_bytes": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+        "shared_bytes": fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+    }
+def memory_report():
+    """
+    Memory per registered model.
+    Returns:
+        {name: {"loaded", "param_bytes", "rss_delta_bytes", "load_seconds"}}
+    """
+    with _lock:
+        report = {}
+        for name in _loaders:
+            model = _models.get(name)
+            stats = _stats.get(name, {})
+            report[name] = {
+                "loaded": model is not None,
+                "param_bytes": _param_bytes(model) if model is not None else None,
+                "rss_delta_bytes": stats.get("rss_delta_bytes"),
+                "load_seconds": stats.get("load_seconds"),
+            }
+        return report
+__all__ = [
+    'register_model',
+    'get_model',
+    'is_loaded',
+    'unload_model',
+    'memory_report',
+    'process_memory'
+]
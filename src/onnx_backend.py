@@ -0,0 +1,336 @@
+# src/onnx_backend.py
+"""
+ONNX Runtime backend for the sentence embedding encoder and the
+cross-encoder reranker.
+
+The transformer inside a SentenceTransformer is exported to ONNX once
+(optionally with dynamic int8 weight quantization) and served through
+onnxruntime on CPU; pooling and normalization are done in numpy to match
+the PyTorch pipeline. Before the ONNX encoder is used, its vectors are
+compared with the PyTorch ones and it is rejected if cosine agreement is
+below a threshold. Cross-encoders export their classification logits and
+are checked the same way on score correlation.
+
+Optional dependencies: onnxruntime (serving), torch + transformers (export).
+"""
+import inspect
+import json
+import logging
+from pathlib import Path
+import numpy as np
+from src.utils import ConfigManager
+logger = logging.getLogger(__name__)
+ONNX_MODEL_DIR = ConfigManager.get("ONNX_MODEL_DIR", "./data/onnx_models")
+ONNX_NUM_THREADS = ConfigManager.get("ONNX_NUM_THREADS", 0, config_type=int)
+ONNX_MIN_COSINE = ConfigManager.get("ONNX_MIN_COSINE", 0.99, config_type=float)
+# Minimum correlation of ONNX and PyTorch cross-encoder scores
+ONNX_RERANK_MIN_CORR = ConfigManager.get("ONNX_RERANK_MIN_CORR", 0.98, config_type=float)
+AGREEMENT_SAMPLES = [
+    "How do I register on the e-GP system?",
+    "Tender opening committee responsibilities",
+    "Bid evaluation criteria and scoring procedure",
+    "Steps to submit a procurement plan for approval",
+    "Jinsi ya kujisajili kwenye mfumo",
+]
+def model_dir(model_name: str, quantize: bool) -> Path:
+    """Directory holding the exported model for a name/quantization combination."""
+    safe = model_name.replace("/", "__")
+    return Path(ONNX_MODEL_DIR) / (f"{safe}-int8" if quantize else safe)
+# ==================== EXPORT ====================
+def _pooling_config(st_model):
+    """Read pooling mode, normalization and max length from a SentenceTransformer."""
+    modules = list(st_model)
+    pooling = next((m for m in modules if type(m).__name__ == "Pooling"), None)
+    mode = "mean"
+    if pooling is not None:
+        if getattr(pooling, "pooling_mode_cls_token", False):
+            mode = "cls"
+        elif getattr(pooling, "pooling_mode_max_tokens", False):
+            mode = "max"
+    return {
+        "pooling": mode,
+        "normalize": any(type(m).__name__ == "Normalize" for m in modules),
+        "max_seq_length": int(getattr(st_model, "max_seq_length", None) or 512),
+        "dim": int(st_model.get_sentence_embedding_dimension()),
+    }
+def export_encoder(st_model, out_dir, quantize: bool = False):
+    """
+    Export the transformer of a SentenceTransformer to ONNX.
+    Args:
+        st_model: Loaded SentenceTransformer
+        out_dir: Target directory (model.onnx, tokenizer, pooling.json)
+        quantize: Also write dynamic int8 weights (model.int8.onnx)
+    Returns:
+        Path of the ONNX file to serve
+    """
+    import torch
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    transformer = st_model[0]
+    tokenizer = transformer.tokenizer
+    class _LastHidden(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+        def forward(self, input_ids, attention_mask):
+            return self.model(input_ids=input_ids, attention_mask=attention_mask)[0]
+    wrapper = _LastHidden(transformer.auto_model).eval()
+    sample = tokenizer(["export sample sentence"], return_tensors="pt", padding=True)
+    onnx_path = out_dir / "model.onnx"
+    print(f"📦 Exporting encoder to {onnx_path}...")
+    _torch_export(wrapper, sample, ["input_ids", "attention_mask"], "last_hidden_state",
+                  {0: "batch", 1: "seq"}, onnx_path)
+    tokenizer.save_pretrained(str(out_dir))
+    (out_dir / "pooling.json").write_text(json.dumps(_pooling_config(st_model), indent=2), encoding="utf-8")
+    return _quantize(onnx_path) if quantize else onnx_path
+def _torch_export(module, sample, input_names, output_name, output_axes, onnx_path):
+    """Export a module taking tokenizer tensors, with dynamic batch/sequence axes."""
+    import torch
+    # Newer torch defaults to the dynamo exporter; keep the TorchScript one,
+    # which is what torch 2.0 uses and what dynamic_axes is written for
+    extra = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+    axes = {name: {0: "batch", 1: "seq"} for name in input_names}
+    axes[output_name] = output_axes
+    with torch.no_grad():
+        torch.onnx.export(
+            module.eval(),
+            tuple(sample[name] for name in input_names),
+            str(onnx_path),
+            input_names=list(input_names),
+            output_names=[output_name],
+            dynamic_axes=axes,
+            opset_version=14,
+            **extra,
+        )
+def _quantize(onnx_path):
+    """Write dynamic int8 weights next to an exported model (model.int8.onnx)."""
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    int8_path = Path(onnx_path).with_name("model.int8.onnx")
+    print(f"📦 Quantizing weights to int8 ({int8_path})...")
+    quantize_dynamic(str(onnx_path), str(int8_path), weight_type=QuantType.QInt8)
+    return int8_path
+# ==================== INFERENCE ====================
+def _session(model_file):
+    import onnxruntime as ort
+    options = ort.SessionOptions()
+    if ONNX_NUM_THREADS:
+        options.intra_op_num_threads = ONNX_NUM_THREADS
+    return ort.InferenceSession(str(model_file), options, providers=["CPUExecutionProvider"])
+class OnnxEncoder:
+    """Drop-in for SentenceTransformer.encode backed by onnxruntime."""
+    def __init__(self, onnx_dir, quantized: bool = False):
+        from transformers import AutoTokenizer
+        onnx_dir = Path(onnx_dir)
+        self.config = json.loads((onnx_dir / "pooling.json").read_text(encoding="utf-8"))
+        self.tokenizer = AutoTokenizer.from_pretrained(str(onnx_dir))
+        self.max_seq_length = self.config["max_seq_length"]
+        self.session = _session(onnx_dir / ("model.int8.onnx" if quantized else "model.onnx"))
+        self.quantized = quantized
+    def eval(self):
+        return self
+    def get_sentence_embedding_dimension(self):
+        return self.config["dim"]
+    def _pool(self, hidden, mask):
+        mode = self.config["pooling"]
+        if mode == "cls":
+            return hidden[:, 0]
+        mask = mask[..., None].astype(hidden.dtype)
+        if mode == "max":
+            return np.where(mask > 0, hidden, -1e9).max(axis=1)
+        return (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+    def encode(self, sentences, batch_size: int = 32, convert_to_numpy: bool = True,
+               normalize_embeddings: bool = False, show_progress_bar: bool = False, **kwargs):
+        """Encode sentences; mirrors the SentenceTransformer.encode arguments used in this repo."""
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        outputs = []
+        for start in range(0, len(sentences), batch_size):
+            batch = sentences[start:start + batch_size]
+            tokens = self.tokenizer(
+                batch, padding=True, truncation=True,
+                max_length=self.max_seq_length, return_tensors="np",
+            )
+            feeds = {
+                "input_ids": tokens["input_ids"].astype("int64"),
+                "attention_mask": tokens["attention_mask"].astype("int64"),
+            }
+            hidden = self.session.run(None, feeds)[0]
+            outputs.append(self._pool(hidden, feeds["attention_mask"]))
+        vectors = (
+            np.concatenate(outputs).astype("float32") if outputs
+            else np.zeros((0, self.config["dim"]), dtype="float32")
+        )
+        if self.config["normalize"] or normalize_embeddings:
+            vectors /= np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+        return vectors[0] if single else vectors
+def cosine_agreement(reference, candidate):
+    """Row-wise cosine similarity between two embedding matrices."""
+    reference = np.asarray(reference, dtype="float32")
+    candidate = np.asarray(candidate, dtype="float32")
+    num = (reference * candidate).sum(axis=1)
+    den = np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1)
+    return num / np.clip(den, 1e-12, None)
+def check_agreement(torch_model, onnx_model, texts=None):
+    """
+    Compare ONNX vectors with PyTorch vectors.
+    Returns:
+        {"mean_cosine", "min_cosine"}
+    """
+    texts = texts or AGREEMENT_SAMPLES
+    cos = cosine_agreement(
+        torch_model.encode(texts, convert_to_numpy=True),
+        onnx_model.encode(texts, convert_to_numpy=True),
+    )
+    return {"mean_cosine": float(cos.mean()), "min_cosine": float(cos.min())}
+def load_onnx_encoder(model_name: str, quantize: bool, torch_loader):
+    """
+    Load (exporting on first use) the ONNX encoder for a model, verified
+    against PyTorch. Returns None if the agreement check fails.
+    Args:
+        model_name: Sentence-transformers model name
+        quantize: Use dynamic int8 weights
+        torch_loader: Zero-argument callable returning the PyTorch model
+    """
+    out_dir = model_dir(model_name, quantize)
+    onnx_file = out_dir / ("model.int8.onnx" if quantize else "model.onnx")
+    agreement_file = out_dir / "agreement.json"
+    if onnx_file.exists() and agreement_file.exists():
+        # Verified on export; skip loading PyTorch again
+        agreement = json.loads(agreement_file.read_text(encoding="utf-8"))
+        encoder = OnnxEncoder(out_dir, quantized=quantize)
+    else:
+        torch_model = torch_loader()
+        if not onnx_file.exists():
+            export_encoder(torch_model, out_dir, quantize=quantize)
+        encoder = OnnxEncoder(out_dir, quantized=quantize)
+        agreement = check_agreement(torch_model, encoder)
+        agreement_file.write_text(json.dumps(agreement, indent=2), encoding="utf-8")
+        del torch_model
+    print(f"🔎 ONNX{' int8' if quantize else ''} vs PyTorch cosine: "
+          f"mean={agreement['mean_cosine']:.4f} min={agreement['min_cosine']:.4f}")
+    if agreement["min_cosine"] < ONNX_MIN_COSINE:
+        logger.warning(f"ONNX encoder rejected: min cosine {agreement['min_cosine']:.4f} < {ONNX_MIN_COSINE}")
+        return None
+    return encoder
+# ==================== CROSS-ENCODER ====================
+def _activation(cross_encoder) -> str:
+    """Activation CrossEncoder.predict applies to the logits (sigmoid for 1-label models)."""
+    fn = getattr(cross_encoder, "default_activation_function", None) or getattr(cross_encoder, "activation_fn", None)
+    return "sigmoid" if type(fn).__name__ == "Sigmoid" else "identity"
+def export_cross_encoder(cross_encoder, out_dir, quantize: bool = False):
+    """
+    Export a sentence-transformers CrossEncoder's classifier to ONNX.
+    Args:
+        cross_encoder: Loaded CrossEncoder
+        out_dir: Target directory (model.onnx, tokenizer, cross_encoder.json)
+        quantize: Also write dynamic int8 weights (model.int8.onnx)
+    Returns:
+        Path of the ONNX file to serve
+    """
+    import torch
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    tokenizer = cross_encoder.tokenizer
+    input_names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in tokenizer.model_input_names]
+    class _Logits(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+        def forward(self, *inputs):
+            return self.model(**dict(zip(input_names, inputs))).logits
+    sample = tokenizer(["export sample query"], ["export sample passage"], return_tensors="pt", padding=True)
+    onnx_path = out_dir / "model.onnx"
+    print(f"📦 Exporting cross-encoder to {onnx_path}...")
+    _torch_export(_Logits(cross_encoder.model), sample, input_names, "logits", {0: "batch"}, onnx_path)
+    tokenizer.save_pretrained(str(out_dir))
+    config = {
+        "inputs": input_names,
+        "activation": _activation(cross_encoder),
+        "num_labels": int(cross_encoder.model.config.num_labels),
+        "max_length": int(getattr(cross_encoder, "max_length", None) or min(tokenizer.model_max_length, 512)),
+    }
+    (out_dir / "cross_encoder.json").write_text(json.dumps(config, indent=2), encoding="utf-8")
+    return _quantize(onnx_path) if quantize else onnx_path
+class OnnxCrossEncoder:
+    """Drop-in for CrossEncoder.predict backed by onnxruntime."""
+    def __init__(self, onnx_dir, quantized: bool = False, max_length: int = None):
+        from transformers import AutoTokenizer
+        onnx_dir = Path(onnx_dir)
+        self.config = json.loads((onnx_dir / "cross_encoder.json").read_text(encoding="utf-8"))
+        self.tokenizer = AutoTokenizer.from_pretrained(str(onnx_dir))
+        self.max_length = max_length or self.config["max_length"]
+        self.session = _session(onnx_dir / ("model.int8.onnx" if quantized else "model.onnx"))
+        self.quantized = quantized
+    def predict(self, sentences, batch_size: int = 32, show_progress_bar: bool = False, **kwargs):
+        """Score [query, passage] pairs; mirrors CrossEncoder.predict."""
+        scores = []
+        for start in range(0, len(sentences), batch_size):
+            batch = sentences[start:start + batch_size]
+            tokens = self.tokenizer(
+                [q for q, _ in batch], [p for _, p in batch], padding=True,
+                truncation="longest_first", max_length=self.max_length, return_tensors="np",
+            )
+            logits = self.session.run(None, {n: tokens[n].astype("int64") for n in self.config["inputs"]})[0]
+            scores.append(logits[:, 0] if self.config["num_labels"] == 1 else logits)
+        if not scores:
+            return np.zeros(0, dtype="float32")
+        scores = np.concatenate(scores).astype("float32")
+        if self.config["activation"] == "sigmoid":
+            scores = 1.0 / (1.0 + np.exp(-scores))
+        return scores
+def check_rerank_agreement(torch_model, onnx_model, texts=None):
+    """
+    Compare ONNX cross-encoder scores with PyTorch on all pairs of sample texts.
+    Returns:
+        {"score_corr", "max_abs_diff"}
+    """
+    texts = texts or AGREEMENT_SAMPLES
+    pairs = [[q, p] for q in texts for p in texts]
+    reference = np.asarray(torch_model.predict(pairs), dtype="float32").ravel()
+    candidate = np.asarray(onnx_model.predict(pairs), dtype="float32").ravel()
+    diff = float(np.abs(reference - candidate).max())
+    corr = float(np.corrcoef(reference, candidate)[0, 1]) if reference.std() > 0 and candidate.std() > 0 else float(diff < 1e-3)
+    return {"score_corr": corr, "max_abs_diff": diff}
+def load_onnx_cross_encoder(model_name: str, quantize: bool, torch_loader, max_length: int = None):
+    """
+    Load (exporting on first use) the ONNX cross-encoder for a model,
+    verified against PyTorch. Returns None if the agreement check fails.
+    Args:
+        model_name: Sentence-transformers cross-encoder name
+        quantize: Use dynamic int8 weights
+        torch_loader: Zero-argument callable returning the PyTorch CrossEncoder
+        max_length: Token limit of query + passage (defaults to the exported one)
+    """
+    out_dir = model_dir(model_name, quantize)
+    onnx_file = out_dir / ("model.int8.onnx" if quantize else "model.onnx")
+    agreement_file = out_dir / "agreement.json"
+    if onnx_file.exists() and agreement_file.exists():
+        agreement = json.loads(agreement_file.read_text(encoding="utf-8"))
+        reranker = OnnxCrossEncoder(out_dir, quantized=quantize, max_length=max_length)
+    else:
+        torch_model = torch_loader()
+        if not onnx_file.exists():
+            export_cross_encoder(torch_model, out_dir, quantize=quantize)
+        reranker = OnnxCrossEncoder(out_dir, quantized=quantize, max_length=max_length)
+        agreement = check_rerank_agreement(torch_model, reranker)
+        agreement_file.write_text(json.dumps(agreement, indent=2), encoding="utf-8")
+        del torch_model
+    print(f"🔎 ONNX{' int8' if quantize else ''} vs PyTorch rerank scores: "
+          f"corr={agreement['score_corr']:.4f} max diff={agreement['max_abs_diff']:.4f}")
+    if agreement["score_corr"] < ONNX_RERANK_MIN_CORR:
+        logger.warning(f"ONNX cross-encoder rejected: score correlation {agreement['score_corr']:.4f} "
+                       f"< {ONNX_RERANK_MIN_CORR}")
+        return None
+    return reranker
+__all__ = [
+    'OnnxEncoder',
+    'export_encoder',
+    'check_agreement',
+    'cosine_agreement',
+    'load_onnx_encoder',
+    'OnnxCrossEncoder',
+    'export_cross_encoder',
+    'check_rerank_agreement',
+    'load_onnx_cross_encoder'
+]
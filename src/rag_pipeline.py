@@ -10,12 +10,21 @@ import re
 import hashlib
 import json
 import shutil
-from sentence_transformers import SentenceTransformer, CrossEncoder
 from src.translator import detect_language, translate_text
 import google.generativeai as genai
 from src.data_loader import read_ppt_text
 from src.system_prompt import SystemPrompts, PromptValidator
 from src.utils import get_env_var
+from src.embedder import embed_query, chunk_id
+from src.model_registry import register_model, get_model
+from src.index_factory import search_filtered, search_excluding
+from src.metadata_filter import matches
+from src.doc_router import use_routing, routed_search
+from src.lexical_index import reciprocal_rank_fusion
+from src.rerank_cache import RerankScoreCache, query_key
+from src.reranker import RERANK_MODEL_NAME, load_reranker, reranker_key
+from src.rerank_policy import ADAPTIVE_RERANK, RerankPolicyStats, rerank_adaptive
+from src.answer_cache import SEMANTIC_ANSWER_CACHE, SemanticAnswerCache
 from rapidfuzz import fuzz
 from collections import Counter
 import os
@@ -25,12 +34,15 @@ GEMINI_MODEL = get_env_var("GEMINI_MODEL_NAME", "gemini-2.5-flash")
 RAG_TOP_K = int(get_env_var("RAG_TOP_K", "10"))
 RAG_THRESHOLD = float(get_env_var("RAG_SIMILARITY_THRESHOLD", "0.0"))
 MAX_TOKENS = int(get_env_var("MAX_RESPONSE_TOKENS", "4096"))
-# Initialize embedding model
-# EMBED_MODEL_NAME = get_env_var("EMBED_MODEL", "sentence-transformers/all-mpnet-base-v2")
-# embed_model = SentenceTransformer(EMBED_MODEL_NAME)
+# Retrieval: "dense" (vectors only) or "hybrid" (BM25 + vectors, fused by rank)
+RETRIEVAL_MODE = get_env_var("RETRIEVAL_MODE", "dense").lower()
+# Hybrid: results taken from each retriever before fusion, and the fused
+# pool handed to the reranker (as a multiple of top_k; dense mode uses 2x)
+HYBRID_DEPTH = int(get_env_var("HYBRID_DEPTH", "50"))
+HYBRID_POOL_FACTOR = float(get_env_var("HYBRID_POOL_FACTOR", "1.5"))
+# Embedding model is shared with src.embedder through the model registry
 # ---- RERANKER (Cross-Encoder) ----
-embed_model = SentenceTransformer("sentence-transformers/all-mpnet-base-v2")
-RERANK_MODEL_NAME = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+# Model, backend (torch / onnx / onnx-int8), max length and passage windows: see src.reranker
 custom_cache = os.environ["TRANSFORMERS_CACHE"]
 # Clear corrupted cache dirs for this model (both default and custom) to fix Windows lock issue
 default_cache_root = os.path.expanduser("~/.cache/huggingface/hub")
@@ -40,20 +52,22 @@ for cache_root in [default_cache_root, custom_cache_root]:
     if os.path.exists(model_cache_dir):
         print(f"Clearing cache for {RERANK_MODEL_NAME} in {cache_root} to resolve lock issue...")
         shutil.rmtree(model_cache_dir)
-# Load with env vars handling custom cache
-cross_encoder = CrossEncoder(RERANK_MODEL_NAME)
+# Loaded lazily (once per process) by the model registry, with env vars handling custom cache
+register_model("cross_encoder", load_reranker)
 # Initialize prompt handler
 prompts = SystemPrompts()
 validator = PromptValidator()
 # ==================== ANSWER CACHE FOR CONSISTENCY ====================
 ANSWER_CACHE = {}
-CACHE_MAX_SIZE = 1000
-def get_query_hash(query: str, lang: str) -> str:
-    """Generate unique hash for query to cache answers."""
+CACHE_MAX_SIZE = int(get_env_var("ANSWER_CACHE_MAX_SIZE", "1000"))
+def get_query_hash(query: str, lang: str, filters=None) -> str:
+    """Generate unique hash for query (and metadata filter) to cache answers."""
     normalized = query.lower().strip()
     normalized = re.sub(r'\s+', ' ', normalized)
     normalized = re.sub(r'[?!.,;:]', '', normalized)
     cache_key = f"{lang}:{normalized}"
+    if filters:
+        cache_key += ":" + json.dumps(filters, sort_keys=True, default=str)
     return hashlib.md5(cache_key.encode()).hexdigest()
 def cache_answer(query_hash: str, answer: str):
     """Store answer in cache."""
@@ -70,59 +84,178 @@ def get_cached_answer(query_hash: str):
     if answer:
         print(f"✓ Using cached answer for query hash: {query_hash[:8]}...")
     return answer
+# Paraphrases of answered queries (see src.answer_cache); embed_text is
+# defined below and only called at lookup time
+_semantic_cache = SemanticAnswerCache(lambda text: embed_text(text), max_size=CACHE_MAX_SIZE)
+def answer_agreement(answer_a: str, answer_b: str) -> float:
+    """Cosine similarity of two answers under the embedding model (0..1)."""
+    v = get_model("embedder").encode([answer_a, answer_b], convert_to_numpy=True,
+                                     normalize_embeddings=True)
+    return max(0.0, float(v[0] @ v[1]))
+def get_answer_cache_audit():
+    """Recent semantic answer cache hits and false-hit audit verdicts."""
+    return _semantic_cache.audit_log()
 # ==================== EMBEDDING & SEARCH ====================
-def embed_text(text: str) -> np.ndarray:
-    """Generate embedding for given text."""
-    return embed_model.encode([text.lower()])[0]
+def embed_text(text: str, metas=None) -> np.ndarray:
+    """
+    Generate embedding for given text (shared model + query cache, L2-normalized).
+    Pass the chunk store of the snapshot being searched to project the
+    vector like its index (EMBED_REDUCTION); without it the full model
+    vector is returned.
+    """
+    reducer = metas.reducer() if hasattr(metas, "reducer") else None
+    return embed_query(text, reducer)[0]
 from rapidfuzz import fuzz
 from numpy import dot
 from numpy.linalg import norm
+# Cross-encoder scores of recent (query, chunk) pairs
+_rerank_cache = RerankScoreCache()
 def safe_rerank_chunks(query, chunks, top_k=5):
     """
     Heavy reranker using cross-encoder for better accuracy.
+    Scores of (query, chunk ID) pairs seen recently come from the rerank
+    cache; only the rest go to the model. Returns new chunk dicts carrying
+    'rerank_score' (the input chunks are not modified).
     """
     if not chunks:
-        return chunks
-    scored_chunks = []
-  
-    # Prepare query-passage pairs
-    pairs = [[query, c['text']] for c in chunks]
-  
-    # Score with cross-encoder
-    scores = cross_encoder.predict(pairs)
-  
-    for c, score in zip(chunks, scores):
-        c['rerank_score'] = float(score)
-        scored_chunks.append(c)
-  
+        return []
+    qkey = query_key(query, reranker_key())
+    keys = [c.get("chunk_id") or chunk_id(c) for c in chunks]
+    scores = _rerank_cache.get_many(qkey, keys)
+    missing = [i for i, score in enumerate(scores) if score is None]
+    if missing:
+        # Prepare query-passage pairs and score them with the cross-encoder
+        pairs = [[query, chunks[i]['text']] for i in missing]
+        predicted = get_model("cross_encoder").predict(pairs)
+        for i, score in zip(missing, predicted):
+            scores[i] = float(score)
+        _rerank_cache.put_many(qkey, [keys[i] for i in missing], [scores[i] for i in missing])
+    scored_chunks = [{**c, 'rerank_score': score} for c, score in zip(chunks, scores)]
     # Sort chunks descending by score
-    scored_chunks = sorted(scored_chunks, key=lambda x: x['rerank_score'], reverse=True)
-  
+    scored_chunks.sort(key=lambda x: x['rerank_score'], reverse=True)
     return scored_chunks[:top_k]
-def search_index(query, index, metas, top_k=None):
-    """Search FAISS index and return top-k chunks."""
+def get_rerank_cache_stats():
+    """Hit/miss counters of the cross-encoder score cache."""
+    return _rerank_cache.stats()
+# Decisions of the adaptive rerank policy
+_rerank_policy_stats = RerankPolicyStats()
+def adaptive_rerank_chunks(query, chunks, top_k=5):
+    """
+    Rerank only as deep as the dense scores require: skip the cross-encoder
+    when the ranking is decisive, rerank a prefix when it is fairly
+    confident, the whole pool otherwise (see src.rerank_policy).
+    """
+    if not chunks:
+        return []
+    ranked, decision = rerank_adaptive(
+        chunks, top_k, lambda pool, k: safe_rerank_chunks(query, pool, k), _rerank_policy_stats
+    )
+    print(f"⚖️ Rerank {decision['action']} ({decision['depth']}/{len(chunks)} passages, "
+          f"margin {decision['margin']:.3f}, entropy {decision['entropy']:.2f})")
+    return ranked
+def get_rerank_policy_stats():
+    """Per-decision counters of the adaptive rerank policy (pairs and ms saved)."""
+    return _rerank_policy_stats.stats()
+def search_index(query, index, metas, top_k=None, filters=None):
+    """
+    Search FAISS index and return top-k chunks.
+    Args:
+        filters: Optional metadata filter, e.g. {"source_file": "Manual.pdf"},
+            {"file_type": "pptx", "slide_number": [3, 4]}. Resolved to chunk
+            IDs through the chunk store's bitmap index and applied by FAISS
+            during the scan; with a sharded index only matching shards are
+            loaded and searched.
+    With DOC_ROUTING enabled, unfiltered queries first pick the nearest
+    documents by centroid and only search their chunks. Tombstoned chunks
+    (deleted, not yet compacted) are skipped during the scan.
+    """
     if index is None or metas is None:
         return []
     if top_k is None:
         top_k = RAG_TOP_K
     query = query.lower().strip()
-    q_embed = np.array([embed_text(query)]).astype("float32")
+    q_embed = np.array([embed_text(query, metas)]).astype("float32")
   
     import faiss
     faiss.normalize_L2(q_embed)
   
-    scores, idxs = index.search(q_embed, top_k)
+    if filters and hasattr(metas, "filter_index"):
+        filter_index = metas.filter_index()
+        allowed = filter_index.ids_for(filters)
+        if len(allowed) == 0:
+            return []
+        if hasattr(index, "select"):
+            scores, idxs = index.search(q_embed, top_k, sources=filter_index.sources_for(filters), ids=allowed)
+        else:
+            scores, idxs = search_filtered(index, q_embed, top_k, allowed)
+    elif hasattr(metas, "doc_router") and use_routing(metas.doc_router()):
+        # Two-stage: nearest documents by centroid, then only their chunks
+        scores, idxs = routed_search(index, metas, metas.doc_router(), q_embed, top_k)
+    elif hasattr(metas, "tombstones") and len(metas.tombstones()) and not hasattr(index, "select"):
+        # Deleted chunks still in the index until compaction (a sharded
+        # index drops their shards)
+        scores, idxs = search_excluding(index, q_embed, top_k, metas.tombstones())
+    else:
+        scores, idxs = index.search(q_embed, top_k)
+    hits = [(float(score), int(idx)) for score, idx in zip(scores[0], idxs[0]) if idx != -1]
+    # ID-mapped indexes return content-hash IDs; the chunk store fetches
+    # only these chunks' text from disk
+    if hasattr(metas, "get_many"):
+        found = {m["chunk_id"]: m for m in metas.get_many([idx for _, idx in hits])}
+        hits = [(score, found[idx]) for score, idx in hits if idx in found]
+    else:
+        hits = [(score, metas[idx]) for score, idx in hits]
+        # Plain chunk lists have no bitmap index; filter after the search
+        if filters:
+            hits = [(score, meta) for score, meta in hits if matches(meta, filters)]
     results = []
-    for score, idx in zip(scores[0], idxs[0]):
-        if idx == -1:
-            continue
-        meta = metas[idx]
+    for score, meta in hits:
         results.append({
             "text": meta.get("text", ""),
             "metadata": meta.get("metadata", meta),
-            "score": float(score)
+            "score": float(score),
+            "chunk_id": meta.get("chunk_id")
         })
     return results
+def hybrid_search(query, index, metas, top_k=None, filters=None, dense_query=None):
+    """
+    Fuse BM25 and vector rankings with reciprocal rank fusion, so chunks
+    containing exact identifiers, acronyms or form names rank next to
+    semantic matches.
+    Args:
+        query: Text matched lexically
+        dense_query: Text embedded for the vector search (defaults to
+            query; rag_answer passes the synonym-expanded query)
+        filters: Metadata filter applied to both retrievers
+    Returns:
+        Chunks like search_index; "score" is the vector similarity (0.0 for
+        BM25-only hits), plus "bm25_score" and "rrf_score"
+    """
+    if top_k is None:
+        top_k = RAG_TOP_K
+    dense_query = dense_query or query
+    lexical = metas.lexical_index() if hasattr(metas, "lexical_index") else None
+    if lexical is None:
+        return search_index(dense_query, index, metas, top_k=top_k, filters=filters)
+    allowed = None
+    if filters:
+        allowed = metas.filter_index().ids_for(filters)
+        if len(allowed) == 0:
+            return []
+    dense = search_index(dense_query, index, metas, top_k=max(HYBRID_DEPTH, top_k), filters=filters)
+    bm25_scores, bm25_ids = lexical.search(query, max(HYBRID_DEPTH, top_k), allowed, metas.tombstones())
+    fused = reciprocal_rank_fusion([[c["chunk_id"] for c in dense], bm25_ids.tolist()], limit=top_k)
+    by_id = {c["chunk_id"]: c for c in dense}
+    # BM25-only hits are read from the chunk store
+    for meta in metas.get_many([cid for cid, _ in fused if cid not in by_id]):
+        by_id[meta["chunk_id"]] = {"text": meta.get("text", ""), "metadata": meta.get("metadata", meta),
+                                   "score": 0.0, "chunk_id": meta["chunk_id"]}
+    bm25 = dict(zip(bm25_ids.tolist(), bm25_scores.tolist()))
+    results = []
+    for cid, rrf in fused:
+        if cid in by_id:
+            results.append({**by_id[cid], "bm25_score": float(bm25.get(cid, 0.0)), "rrf_score": float(rrf)})
+    return results
 # ==================== GEMINI API CALL ====================
 def call_gemini(prompt, api_key, model_name=None, temperature=0.3):
     """Call Gemini API with consistent settings."""
@@ -232,8 +365,27 @@ def expand_query_with_synonyms(query: str) -> str:
   
     return ' '.join(expanded_terms)
 # ==================== MAIN RAG FUNCTION ====================
+class _ChunksWithExtra:
+    """
+    Fallback view of the chunk store followed by in-memory chunks (PPT
+    slides), so a slice only reads the chunks it returns from the store.
+    """
+    def __init__(self, store, extra):
+        self.store = store
+        self.extra = list(extra)
+    def __len__(self):
+        return len(self.store) + len(self.extra)
+    def __bool__(self):
+        return len(self) > 0
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            return self[item:item + 1 or None][0]
+        start, stop, _ = item.indices(len(self))
+        n = len(self.store)
+        head = list(self.store[start:min(stop, n)]) if start < n else []
+        return head + self.extra[max(start - n, 0):max(stop - n, 0)]
 def rag_answer(query, index, metas, api_key, model_name=None, threshold=None,
-               top_k=None, ppt_path=None, use_cache=True):
+               top_k=None, ppt_path=None, use_cache=True, filters=None):
     """
     RAG pipeline with proper formatting preservation.
   
@@ -247,6 +399,8 @@ def rag_answer(query, index, metas, api_key, model_name=None, threshold=None,
         top_k: Number of chunks to retrieve
         ppt_path: Optional PPT file path for OCR extraction
         use_cache: Whether to use answer caching (default: True)
+        filters: Optional metadata filter for retrieval, e.g.
+            {"source_file": "Manual.pdf"} (see search_index)
     """
     # Use configured values if not provided
     if model_name is None:
@@ -264,14 +418,24 @@ def rag_answer(query, index, metas, api_key, model_name=None, threshold=None,
     print(f"🔍 Query: {query}")
     print(f"🌐 Detected language: {user_lang}")
     # Check cache FIRST for consistency
-    query_hash = get_query_hash(query, user_lang)
+    query_hash = get_query_hash(query, user_lang, filters)
+    semantic_hit = None
     if use_cache:
         cached = get_cached_answer(query_hash)
         if cached:
             return cached
+        if SEMANTIC_ANSWER_CACHE:
+            semantic_hit = _semantic_cache.lookup(query, user_lang, filters)
+            if semantic_hit and not semantic_hit["audit"]:
+                return semantic_hit["answer"]
+            if semantic_hit:
+                print("🔎 Auditing semantic cache hit: answering again")
     # Translate query → English for retrieval if needed
     query_en = query if user_lang == "en" else translate_text(query, target_lang="en").lower().strip()
     # If PPT path provided, extract text using OCR and append to metas
+    # (index_metas keeps ID lookup working; PPT chunks are not in the index
+    # and only serve the fallbacks, which read the store lazily)
+    index_metas = metas
     if ppt_path:
         ppt_text_dict = read_ppt_text(ppt_path)
         ppt_chunks = [
@@ -281,17 +445,26 @@ def rag_answer(query, index, metas, api_key, model_name=None, threshold=None,
         if metas is None:
             metas = ppt_chunks
         else:
-            metas = list(metas) + ppt_chunks
+            metas = _ChunksWithExtra(metas, ppt_chunks)
     # ========== RETRIEVAL ==========
     expanded_query = expand_query_with_synonyms(query_en)
-    retrieved_chunks = search_index(expanded_query, index, metas, top_k=top_k * 2)
+    if RETRIEVAL_MODE == "hybrid":
+        # Exact-term matches make a smaller candidate pool sufficient
+        pool = max(top_k, int(round(top_k * HYBRID_POOL_FACTOR)))
+        retrieved_chunks = hybrid_search(query_en, index, index_metas, top_k=pool, filters=filters,
+                                         dense_query=expanded_query)
+    else:
+        retrieved_chunks = search_index(expanded_query, index, index_metas, top_k=top_k * 2, filters=filters)
     # ====== APPLY RERANKER ======
     if retrieved_chunks:
         print("🔍 Applying Reranker for better relevance...")
-        retrieved_chunks = safe_rerank_chunks(query_en, retrieved_chunks, top_k=top_k)
+        if ADAPTIVE_RERANK:
+            retrieved_chunks = adaptive_rerank_chunks(query_en, retrieved_chunks, top_k=top_k)
+        else:
+            retrieved_chunks = safe_rerank_chunks(query_en, retrieved_chunks, top_k=top_k)
   
     if not retrieved_chunks:
-        retrieved_chunks = search_index(query_en, index, metas, top_k=top_k * 2)
+        retrieved_chunks = search_index(query_en, index, index_metas, top_k=top_k * 2, filters=filters)
   
     if not retrieved_chunks and metas:
         print("⚠️ No semantic matches found, using fallback chunks")
@@ -303,7 +476,9 @@ def rag_answer(query, index, metas, api_key, model_name=None, threshold=None,
         ]
     # Apply threshold
     if threshold > 0:
-        filtered_chunks = [item for item in retrieved_chunks if item.get("score", 0) >= threshold]
+        # BM25 hits matched query terms exactly; keep them regardless of similarity
+        filtered_chunks = [item for item in retrieved_chunks
+                           if item.get("score", 0) >= threshold or item.get("bm25_score", 0) > 0]
     else:
         filtered_chunks = retrieved_chunks
     # Fallback if no chunks
@@ -349,6 +524,12 @@ def rag_answer(query, index, metas, api_key, model_name=None, threshold=None,
     # Cache the answer
     if use_cache:
         cache_answer(query_hash, answer)
+        if SEMANTIC_ANSWER_CACHE:
+            # A false hit evicts the entry that served it and caches this answer
+            false_hit = semantic_hit is not None and _semantic_cache.audit(
+                semantic_hit, query, answer, answer_agreement(semantic_hit["answer"], answer))
+            if not false_hit:
+                _semantic_cache.put(query, user_lang, filters, answer)
     return answer
 # ==================== BATCH PROCESSING ====================
 def batch_rag_answer(queries: list, index, metas, api_key, model_name=None,
@@ -364,23 +545,29 @@ def clear_answer_cache():
     """Clear the answer cache."""
     global ANSWER_CACHE
     ANSWER_CACHE = {}
+    _semantic_cache.clear()
     print("✓ Answer cache cleared")
 def get_cache_stats():
     """Get cache statistics."""
     return {
         "size": len(ANSWER_CACHE),
         "max_size": CACHE_MAX_SIZE,
-        "usage_percent": (len(ANSWER_CACHE) / CACHE_MAX_SIZE) * 100
+        "usage_percent": (len(ANSWER_CACHE) / CACHE_MAX_SIZE) * 100,
+        "semantic": _semantic_cache.stats()
     }
 # ==================== EXPORT ====================
 __all__ = [
     'rag_answer',
     'batch_rag_answer',
     'search_index',
+    'hybrid_search',
     'call_gemini',
     'embed_text',
     'clean_answer_sources',
     'clear_answer_cache',
+    'get_rerank_cache_stats',
+    'get_rerank_policy_stats',
     'get_cache_stats',
+    'get_answer_cache_audit',
     'expand_query_with_synonyms'
 ]
@@ -0,0 +1,63 @@
+# src/rerank_cache.py
+"""
+Bounded cache of cross-encoder scores keyed by (query, chunk).
+
+The same question tends to come back within minutes and retrieve the same
+chunks; their cross-encoder scores do not change. Keys are a hash of the
+normalized query (plus the reranker identity, so a different model or
+configuration never reuses scores) and the chunk's stable content-hash ID,
+so only pairs not seen before go to the model.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from src.embedding_cache import normalize_query
+from src.utils import ConfigManager
+# Query-chunk pairs kept (0 disables the cache)
+RERANK_CACHE_SIZE = ConfigManager.get("RERANK_CACHE_SIZE", 20000, config_type=int)
+def query_key(query: str, model_key: str = "") -> str:
+    """Hash of the normalized query, namespaced by the reranker that scores it."""
+    return hashlib.sha1(f"{model_key}\n{normalize_query(query)}".encode("utf-8")).hexdigest()
+class RerankScoreCache:
+    """Thread-safe LRU of (query key, chunk ID) → cross-encoder score."""
+    def __init__(self, max_size: int = None):
+        self.max_size = RERANK_CACHE_SIZE if max_size is None else max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    def get_many(self, qkey: str, chunk_ids):
+        """Cached scores aligned with chunk_ids (None where not cached)."""
+        scores = []
+        with self._lock:
+            for cid in chunk_ids:
+                score = self._entries.get((qkey, cid))
+                if score is None:
+                    self.misses += 1
+                else:
+                    self._entries.move_to_end((qkey, cid))
+                    self.hits += 1
+                scores.append(score)
+        return scores
+    def put_many(self, qkey: str, chunk_ids, scores):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            for cid, score in zip(chunk_ids, scores):
+                self._entries[(qkey, cid)] = float(score)
+                self._entries.move_to_end((qkey, cid))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+        }
+__all__ = ['RerankScoreCache', 'query_key', 'RERANK_CACHE_SIZE']
@@ -0,0 +1,150 @@
+# src/rerank_policy.py
+"""
+Adaptive rerank depth.
+
+The cross-encoder is the most expensive step of a query on CPU, yet for
+many questions the dense ranking is already decisive. The policy looks at
+the retrieved pool before reranking:
+
+    margin      top-1 minus top-2 dense similarity
+    entropy     normalized entropy of softmax(scores / temperature);
+                near 0 when one passage stands out, near 1 when flat
+    bm25 agree  whether the dense top-1 is also the best BM25 match
+                (hybrid retrieval only)
+
+and picks one of
+    skip    no cross-encoder call; the pool is returned by dense score,
+            the order the signals judged decisive (in hybrid mode the
+            pool arrives in fused order)
+    prefix  rerank only the first RERANK_PREFIX_DEPTH passages
+    full    rerank the whole pool
+
+Decisions are counted with the pairs scored and the time spent, which
+gives an estimate of the latency saved; retrieval_eval's "rerank" suite
+measures the accuracy impact against full reranking.
+"""
+import math
+import threading
+import time
+import numpy as np
+from src.utils import ConfigManager
+ADAPTIVE_RERANK = ConfigManager.get("ADAPTIVE_RERANK", "false", config_type=bool)
+# Skip the cross-encoder when the top-1 margin is at least this and the
+# score entropy at most RERANK_SKIP_ENTROPY
+RERANK_SKIP_MARGIN = ConfigManager.get("RERANK_SKIP_MARGIN", 0.10, config_type=float)
+RERANK_SKIP_ENTROPY = ConfigManager.get("RERANK_SKIP_ENTROPY", 0.5, config_type=float)
+# Rerank a prefix only when either signal passes these looser limits
+RERANK_PREFIX_MARGIN = ConfigManager.get("RERANK_PREFIX_MARGIN", 0.03, config_type=float)
+RERANK_PREFIX_ENTROPY = ConfigManager.get("RERANK_PREFIX_ENTROPY", 0.8, config_type=float)
+RERANK_PREFIX_DEPTH = ConfigManager.get("RERANK_PREFIX_DEPTH", 8, config_type=int)
+# Softmax temperature for the entropy of cosine similarities
+RERANK_SCORE_TEMPERATURE = ConfigManager.get("RERANK_SCORE_TEMPERATURE", 0.05, config_type=float)
+ACTIONS = ("skip", "prefix", "full")
+# ==================== SIGNALS ====================
+def score_signals(chunks):
+    """
+    Confidence signals of a retrieved pool (in retrieval order).
+    Returns:
+        dict with margin, entropy and bm25_agree (None without BM25 scores)
+    """
+    scores = np.sort(np.array([c.get("score", 0.0) for c in chunks], dtype="float64"))[::-1]
+    margin = float(scores[0] - scores[1]) if len(scores) > 1 else math.inf
+    if len(scores) > 1:
+        z = (scores - scores[0]) / max(RERANK_SCORE_TEMPERATURE, 1e-6)
+        p = np.exp(z) / np.exp(z).sum()
+        entropy = float(-(p * np.log(np.maximum(p, 1e-12))).sum() / math.log(len(p)))
+    else:
+        entropy = 0.0
+    bm25 = [c.get("bm25_score") for c in chunks]
+    bm25_agree = None
+    if any(b for b in bm25):
+        dense_top = max(range(len(chunks)), key=lambda i: chunks[i].get("score", 0.0))
+        bm25_agree = bm25[dense_top] == max(b or 0.0 for b in bm25)
+    return {"margin": margin, "entropy": entropy, "bm25_agree": bm25_agree}
+def decide(chunks, top_k: int):
+    """
+    Rerank action for a retrieved pool.
+    Returns:
+        dict with action (skip/prefix/full), depth (passages to rerank) and the signals
+    """
+    signals = score_signals(chunks)
+    decisive = signals["margin"] >= RERANK_SKIP_MARGIN and signals["entropy"] <= RERANK_SKIP_ENTROPY
+    confident = signals["margin"] >= RERANK_PREFIX_MARGIN or signals["entropy"] <= RERANK_PREFIX_ENTROPY
+    agree = signals["bm25_agree"]
+    if len(chunks) <= 1 or (decisive and agree is not False) or (confident and agree):
+        action, depth = "skip", 0
+    elif confident:
+        action, depth = "prefix", min(len(chunks), max(RERANK_PREFIX_DEPTH, 2))
+    else:
+        action, depth = "full", len(chunks)
+    if action == "prefix" and depth >= len(chunks):
+        action = "full"
+    return {"action": action, "depth": depth, **signals}
+# ==================== COUNTERS ====================
+class RerankPolicyStats:
+    """Per-action counters: decisions, pairs scored and saved, time spent."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+    def reset(self):
+        self.counts = {a: 0 for a in ACTIONS}
+        self.pairs_scored = {a: 0 for a in ACTIONS}
+        self.pairs_saved = {a: 0 for a in ACTIONS}
+        self.seconds = {a: 0.0 for a in ACTIONS}
+    def record(self, action: str, pool: int, scored: int, seconds: float):
+        with self._lock:
+            self.counts[action] += 1
+            self.pairs_scored[action] += scored
+            self.pairs_saved[action] += pool - scored
+            self.seconds[action] += seconds
+    def stats(self):
+        """
+        Counters per action plus an estimate of the rerank time saved
+        (pairs not scored × observed seconds per scored pair).
+        """
+        with self._lock:
+            scored = sum(self.pairs_scored.values())
+            per_pair = sum(self.seconds.values()) / scored if scored else 0.0
+            total = sum(self.counts.values())
+            return {
+                "decisions": dict(self.counts),
+                "share": {a: (n / total if total else 0.0) for a, n in self.counts.items()},
+                "mean_ms": {a: (1000 * self.seconds[a] / n if n else 0.0) for a, n in self.counts.items()},
+                "pairs_scored": scored,
+                "pairs_saved": sum(self.pairs_saved.values()),
+                "est_ms_saved": 1000 * per_pair * sum(self.pairs_saved.values()),
+            }
+# ==================== APPLYING ====================
+def rerank_adaptive(chunks, top_k: int, rerank_fn, stats: RerankPolicyStats = None):
+    """
+    Rerank as much of the pool as the policy asks for.
+    Args:
+        chunks: Retrieved pool in retrieval order
+        top_k: Chunks to return
+        rerank_fn: Callable(chunks, k) -> top-k new chunk dicts by cross-encoder score
+        stats: Optional counters to record the decision in
+    Returns:
+        (top-k chunks as new dicts, decision)
+    """
+    decision = decide(chunks, top_k)
+    start = time.perf_counter()
+    if decision["action"] == "skip":
+        # Same order the decision was made on (stable, so ties keep retrieval order)
+        by_score = sorted(chunks, key=lambda c: c.get("score", 0.0), reverse=True)
+        ranked = [dict(c) for c in by_score[:top_k]]
+    elif decision["action"] == "prefix":
+        depth = decision["depth"]
+        # Reranked head, then the rest of the pool in retrieval order
+        ranked = (rerank_fn(chunks[:depth], depth) + [dict(c) for c in chunks[depth:]])[:top_k]
+    else:
+        ranked = rerank_fn(chunks, top_k)
+    if stats is not None:
+        stats.record(decision["action"], len(chunks), decision["depth"], time.perf_counter() - start)
+    return ranked, decision
+__all__ = [
+    'decide',
+    'score_signals',
+    'rerank_adaptive',
+    'RerankPolicyStats',
+    'ADAPTIVE_RERANK'
+]
@@ -0,0 +1,133 @@
+# src/reranker.py
+"""
+Cross-encoder reranker: backend selection and passage windows.
+
+    RERANK_BACKEND=torch       sentence-transformers CrossEncoder (fp32 PyTorch)
+    RERANK_BACKEND=onnx        ONNX Runtime on CPU
+    RERANK_BACKEND=onnx-int8   ONNX Runtime with dynamic int8 weights
+
+Query + passage are capped at RERANK_MAX_LENGTH tokens (by default the
+model's own limit). With RERANK_WINDOWS on, a passage longer than that
+(e.g. an 800-word PPT chunk) is cut into overlapping windows that fit, and
+scored on its best window instead of only its beginning:
+
+    RERANK_WINDOWS=best   pick the window sharing the most query terms,
+                          score only that one (one model call per passage)
+    RERANK_WINDOWS=max    score every window, keep the highest score
+    RERANK_WINDOWS=off    plain truncation (default)
+
+Both change scores relative to the plain CrossEncoder; measure them with
+`python -m src.retrieval_eval reranker` before enabling.
+"""
+import logging
+import numpy as np
+from src.utils import ConfigManager
+from src.lexical_index import tokenize
+logger = logging.getLogger(__name__)
+RERANK_MODEL_NAME = ConfigManager.get("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_BACKEND = ConfigManager.get("RERANK_BACKEND", "torch").lower()
+# Tokens of query + passage per model call (0 = the model's own limit)
+RERANK_MAX_LENGTH = ConfigManager.get("RERANK_MAX_LENGTH", 0, config_type=int)
+RERANK_WINDOWS = ConfigManager.get("RERANK_WINDOWS", "off").lower()
+# Overlap between consecutive windows, as a share of the window
+RERANK_WINDOW_OVERLAP = ConfigManager.get("RERANK_WINDOW_OVERLAP", 0.5, config_type=float)
+WINDOW_MODES = ("best", "max", "off")
+# Tokens per word when the tokenizer cannot map tokens to words
+TOKENS_PER_WORD = 1.4
+def reranker_key(backend: str = None, max_length: int = None, windows: str = None) -> str:
+    """Identity of a reranker configuration (namespaces cached scores)."""
+    backend = backend or RERANK_BACKEND
+    max_length = RERANK_MAX_LENGTH if max_length is None else max_length
+    return f"{RERANK_MODEL_NAME}|{backend}|{max_length}|{windows or RERANK_WINDOWS}"
+# ==================== LOADING ====================
+def _load_torch_cross_encoder(max_length: int = None):
+    from sentence_transformers import CrossEncoder
+    return CrossEncoder(RERANK_MODEL_NAME, max_length=max_length or None)
+def load_cross_encoder(backend: str = None, max_length: int = None):
+    """Load the cross-encoder for a backend, falling back to PyTorch."""
+    backend = (backend or RERANK_BACKEND).lower()
+    max_length = RERANK_MAX_LENGTH if max_length is None else max_length
+    if backend in ("onnx", "onnx-int8"):
+        try:
+            from src.onnx_backend import load_onnx_cross_encoder
+            model = load_onnx_cross_encoder(RERANK_MODEL_NAME, backend == "onnx-int8",
+                                            lambda: _load_torch_cross_encoder(), max_length or None)
+            if model is not None:
+                return model
+        except ImportError as e:
+            print(f"⚠️ ONNX reranker unavailable ({e}), using PyTorch")
+    return _load_torch_cross_encoder(max_length)
+# ==================== PASSAGE WINDOWS ====================
+class WindowedReranker:
+    """
+    CrossEncoder.predict front end that scores long passages on their
+    best-matching window.
+    """
+    def __init__(self, model, windows: str = None, overlap: float = None):
+        self.model = model
+        self.windows_mode = (windows or RERANK_WINDOWS).lower()
+        if self.windows_mode not in WINDOW_MODES:
+            raise ValueError(f"Unknown RERANK_WINDOWS '{self.windows_mode}' (expected one of {WINDOW_MODES})")
+        self.overlap = RERANK_WINDOW_OVERLAP if overlap is None else overlap
+        self.tokenizer = getattr(model, "tokenizer", None)
+        # CrossEncoder(max_length=None) truncates at the tokenizer's limit
+        self.max_length = getattr(model, "max_length", None) or min(getattr(self.tokenizer, "model_max_length", 512), 512)
+    def _token_counts(self, words):
+        """Tokens per word (estimated without a fast tokenizer)."""
+        if self.tokenizer is not None and getattr(self.tokenizer, "is_fast", False):
+            enc = self.tokenizer(words, is_split_into_words=True, add_special_tokens=False)
+            word_ids = [w for w in enc.word_ids() if w is not None]
+            return np.bincount(word_ids, minlength=len(words))
+        return np.full(len(words), TOKENS_PER_WORD)
+    def windows(self, query: str, passage: str):
+        """Overlapping word windows of a passage that fit next to the query."""
+        words = passage.split()
+        query_tokens = self._token_counts(query.split()).sum() if query.split() else 0
+        # [CLS] query [SEP] passage [SEP]
+        budget = self.max_length - query_tokens - 3
+        counts = self._token_counts(words) if words else np.zeros(0)
+        if budget <= 0 or counts.sum() <= budget:
+            return [passage]
+        ends = np.cumsum(counts)
+        windows, start = [], 0
+        while start < len(words):
+            offset = ends[start - 1] if start else 0
+            end = max(start + 1, int(np.searchsorted(ends, offset + budget, side="right")))
+            windows.append(" ".join(words[start:end]))
+            if end >= len(words):
+                break
+            start = max(start + 1, end - int((end - start) * self.overlap))
+        return windows
+    @staticmethod
+    def best_window(query: str, windows):
+        """Window sharing the most distinct query terms (then most occurrences)."""
+        terms = set(tokenize(query))
+        def overlap(window):
+            tokens = tokenize(window)
+            return len(terms.intersection(tokens)), sum(t in terms for t in tokens)
+        return max(windows, key=overlap)
+    def predict(self, sentences, batch_size: int = 32, show_progress_bar: bool = False, **kwargs):
+        """Score [query, passage] pairs like CrossEncoder.predict."""
+        if self.windows_mode == "off" or not sentences:
+            return np.asarray(self.model.predict(sentences, batch_size=batch_size), dtype="float32")
+        expanded, owner = [], []
+        for i, (query, passage) in enumerate(sentences):
+            windows = self.windows(query, passage)
+            if self.windows_mode == "best" and len(windows) > 1:
+                windows = [self.best_window(query, windows)]
+            expanded.extend([query, w] for w in windows)
+            owner.extend([i] * len(windows))
+        scores = np.asarray(self.model.predict(expanded, batch_size=batch_size), dtype="float32")
+        best = np.full(len(sentences), -np.inf, dtype="float32")
+        np.maximum.at(best, np.array(owner), scores)
+        return best
+def load_reranker(backend: str = None, max_length: int = None, windows: str = None):
+    """Cross-encoder for the configured backend, wrapped for passage windows."""
+    return WindowedReranker(load_cross_encoder(backend, max_length), windows)
+__all__ = [
+    'WindowedReranker',
+    'load_reranker',
+    'load_cross_encoder',
+    'reranker_key',
+    'RERANK_MODEL_NAME'
+]
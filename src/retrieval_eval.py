@@ -0,0 +1,531 @@
+# src/retrieval_eval.py
+"""
+Offline retrieval benchmarks against the exact IndexFlatIP baseline.
+
+Run on the current corpus with:
+    python -m src.retrieval_eval storage
+    python -m src.retrieval_eval storage --synthetic 300000
+    python -m src.retrieval_eval encoder
+    python -m src.retrieval_eval routing
+    python -m src.retrieval_eval dims
+    python -m src.retrieval_eval hybrid
+    python -m src.retrieval_eval rerank
+    python -m src.retrieval_eval reranker
+"""
+import argparse
+import time
+import faiss
+import numpy as np
+from src.index_factory import build_index, index_memory_bytes, index_label, search_filtered
+# ==================== METRICS ====================
+def exact_neighbors(embeddings, queries, k):
+    """Ground-truth top-k positions from brute-force inner product."""
+    flat = faiss.IndexFlatIP(embeddings.shape[1])
+    flat.add(embeddings)
+    _, idxs = flat.search(queries, k)
+    return idxs
+def recall_at_k(found, truth, k):
+    """Mean fraction of the true top-k found in the returned top-k."""
+    hits = [len(set(f[:k]) & set(t[:k])) / k for f, t in zip(found, truth)]
+    return float(np.mean(hits)) if hits else 0.0
+def time_search(search_fn, queries, k):
+    """
+    Run one query at a time (as the app does) and return
+    (results, mean latency in ms).
+    """
+    results = []
+    start = time.perf_counter()
+    for q in queries:
+        _, idxs = search_fn(q.reshape(1, -1), k)
+        results.append(idxs[0])
+    elapsed = time.perf_counter() - start
+    return np.array(results), 1000 * elapsed / max(len(queries), 1)
+def sample_queries(embeddings, n_queries, seed=42):
+    """Use a random sample of corpus vectors as probe queries."""
+    rng = np.random.RandomState(seed)
+    pick = rng.choice(len(embeddings), min(n_queries, len(embeddings)), replace=False)
+    return np.ascontiguousarray(embeddings[pick])
+def synthetic_corpus(n, dim=384, n_clusters=1000, noise=0.5, seed=42):
+    """
+    Clustered, normalized random vectors for benchmarking at corpus sizes
+    the current index does not reach (e.g. above the training sample cap).
+    """
+    rng = np.random.RandomState(seed)
+    centers = rng.standard_normal((n_clusters, dim)).astype("float32")
+    x = centers[rng.randint(n_clusters, size=n)]
+    x += noise * rng.standard_normal((n, dim)).astype("float32")
+    x /= np.linalg.norm(x, axis=1, keepdims=True)
+    return x
+def print_report(title, rows):
+    """Print benchmark rows as an aligned table."""
+    print(f"\n📊 {title}")
+    if not rows:
+        print("  (no results)")
+        return
+    cols = list(rows[0].keys())
+    widths = {c: max(len(c), *(len(_fmt(r[c])) for r in rows)) for c in cols}
+    print("  " + "  ".join(c.ljust(widths[c]) for c in cols))
+    for r in rows:
+        print("  " + "  ".join(_fmt(r[c]).ljust(widths[c]) for c in cols))
+def _fmt(value):
+    return f"{value:.3f}" if isinstance(value, float) else str(value)
+# ==================== STORAGE PRECISION ====================
+STORAGE_MODES = [
+    ("flat", "float32", "none"),
+    ("flat", "float16", "none"),
+    ("flat", "sq8", "none"),
+    ("flat", "pq", "none"),
+    ("flat", "pq", "float16"),
+    ("flat", "pq", "float32"),
+]
+def benchmark_storage_modes(embeddings, queries, k=10, modes=None):
+    """
+    Compare storage precisions with the exact IndexFlatIP baseline.
+    Args:
+        embeddings: Normalized float32 corpus vectors (n, d)
+        queries: Normalized float32 query vectors (q, d)
+        k: Recall cutoff
+        modes: List of (index_type, precision, rescore) tuples
+    Returns:
+        List of dicts with memory, compression, recall@k and latency
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+    queries = np.ascontiguousarray(queries, dtype="float32")
+    ids = np.arange(len(embeddings), dtype="int64")
+    truth = exact_neighbors(embeddings, queries, k)
+    baseline = faiss.IndexFlatIP(embeddings.shape[1])
+    baseline.add(embeddings)
+    baseline_bytes = index_memory_bytes(baseline)
+    _, baseline_ms = time_search(baseline.search, queries, k)
+    rows = []
+    for index_type, precision, rescore in modes or STORAGE_MODES:
+        index, _ = build_index(embeddings, ids, index_type, precision, rescore)
+        found, ms = time_search(index.search, queries, k)
+        size = index_memory_bytes(index)
+        rows.append({
+            "mode": index_label(len(embeddings), index_type, precision, rescore),
+            "MB": size / 1e6,
+            "compression": baseline_bytes / size,
+            f"recall@{k}": recall_at_k(found, truth, k),
+            "ms/query": ms,
+            "vs_flat": ms / baseline_ms if baseline_ms else 0.0,
+        })
+    return rows
+# ==================== DOCUMENT ROUTING ====================
+def benchmark_doc_routing(embeddings, doc_of, queries, k=10, top_docs_list=(5, 10, 20, 50)):
+    """
+    Compare two-stage (document centroids → chunks) retrieval with the
+    exact IndexFlatIP baseline.
+    Args:
+        embeddings: Normalized float32 corpus vectors (n, d)
+        doc_of: Source file of each corpus vector
+        queries: Normalized float32 query vectors (q, d)
+        k: Recall cutoff
+        top_docs_list: Numbers of documents searched in the second stage
+    Returns:
+        List of dicts with recall@k, share of chunks scanned and latency
+    """
+    from src.doc_router import DocRouter
+    embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+    queries = np.ascontiguousarray(queries, dtype="float32")
+    doc_of = np.asarray(doc_of)
+    ids = np.arange(len(embeddings), dtype="int64")
+    truth = exact_neighbors(embeddings, queries, k)
+    baseline = faiss.IndexIDMap2(faiss.IndexFlatIP(embeddings.shape[1]))
+    baseline.add_with_ids(embeddings, ids)
+    _, baseline_ms = time_search(baseline.search, queries, k)
+    router = DocRouter.from_vectors(embeddings, doc_of)
+    positions = {name: ids[doc_of == name] for name in router.doc_names}
+    rows = [{"mode": "flat", "docs": len(router), "centroids": 0, f"recall@{k}": 1.0,
+             "scanned": 1.0, "ms/query": baseline_ms, "vs_flat": 1.0}]
+    for top_docs in top_docs_list:
+        if top_docs >= len(router):
+            continue
+        scanned = []
+        def routed(q, k):
+            allowed = np.concatenate([positions[name] for name in router.route(q, top_docs)])
+            scanned.append(len(allowed) / len(embeddings))
+            return search_filtered(baseline, q, k, allowed)
+        found, ms = time_search(routed, queries, k)
+        rows.append({
+            "mode": f"top-{top_docs} docs",
+            "docs": top_docs,
+            "centroids": len(router.centroids),
+            f"recall@{k}": recall_at_k(found, truth, k),
+            "scanned": float(np.mean(scanned)),
+            "ms/query": ms,
+            "vs_flat": ms / baseline_ms if baseline_ms else 0.0,
+        })
+    return rows
+# ==================== DIMENSIONALITY REDUCTION ====================
+def benchmark_dimensions(embeddings, queries, k=10, dims=(128, 256, 384, 768), methods=("pca", "truncate")):
+    """
+    Recall and latency of PCA / prefix-truncated vectors against exact
+    search on the full model vectors.
+    Args:
+        embeddings: Normalized float32 corpus vectors (n, d)
+        queries: Normalized float32 query vectors (q, d)
+        k: Recall cutoff
+        dims: Output dimensions (values >= d mean the full vectors)
+        methods: Reductions from dim_reduction.REDUCTION_METHODS
+    Returns:
+        List of dicts with memory, recall@k and latency per (method, dim)
+    """
+    from src.dim_reduction import Reducer, reduction_settings
+    embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+    queries = np.ascontiguousarray(queries, dtype="float32")
+    d = embeddings.shape[1]
+    truth = exact_neighbors(embeddings, queries, k)
+    baseline = faiss.IndexFlatIP(d)
+    baseline.add(embeddings)
+    _, baseline_ms = time_search(baseline.search, queries, k)
+    rows = [{"mode": f"full-{d}", "dim": d, "MB": index_memory_bytes(baseline) / 1e6,
+             f"recall@{k}": 1.0, "ms/query": baseline_ms, "vs_flat": 1.0}]
+    for method in methods:
+        for dim in dims:
+            settings = reduction_settings(d, method, dim)
+            if settings is None:
+                continue
+            reducer = Reducer.fit(settings, d, embeddings)
+            index = faiss.IndexFlatIP(dim)
+            index.add(reducer.apply(embeddings))
+            found, ms = time_search(index.search, reducer.apply(queries), k)
+            rows.append({
+                "mode": f"{method}-{dim}",
+                "dim": dim,
+                "MB": index_memory_bytes(index) / 1e6,
+                f"recall@{k}": recall_at_k(found, truth, k),
+                "ms/query": ms,
+                "vs_flat": ms / baseline_ms if baseline_ms else 0.0,
+            })
+    return rows
+# ==================== HYBRID RETRIEVAL ====================
+def identifier_probes(bm25, texts, n_queries, terms_per_query=2, seed=42):
+    """
+    Known-item probes like "tender 2024/117" or "e-GP": the rarest terms
+    of sampled chunks, each chunk being the one expected result.
+    Returns:
+        (query texts, target positions)
+    """
+    from src.lexical_index import tokenize
+    rng = np.random.RandomState(seed)
+    queries, targets = [], []
+    for pos in rng.permutation(len(texts)):
+        terms = {bm25.vocab[t] for t in tokenize(texts[pos]) if t in bm25.vocab}
+        if len(terms) < terms_per_query:
+            continue
+        rarest = sorted(terms, key=lambda t: -bm25.idf[t])[:terms_per_query]
+        queries.append(" ".join(bm25.terms[t] for t in rarest))
+        targets.append(int(pos))
+        if len(queries) == n_queries:
+            break
+    return queries, np.array(targets)
+def benchmark_hybrid(texts, embeddings, encode_fn, n_queries=200, pools=(5, 10, 20, 50), depth=50):
+    """
+    Recall of the expected chunk within candidate pools of dense, BM25 and
+    fused (RRF) retrieval on identifier probes.
+    Args:
+        texts: Corpus chunk texts
+        embeddings: Normalized float32 corpus vectors aligned with texts
+        encode_fn: Callable(list of query strings) -> normalized float32 vectors
+        pools: Candidate pool sizes (what the reranker would see)
+        depth: Results taken from each retriever before fusion
+    Returns:
+        List of dicts with hit rate per pool size and latency
+    """
+    from src.lexical_index import BM25Index, reciprocal_rank_fusion
+    embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+    positions = np.arange(len(texts), dtype="int64")
+    bm25 = BM25Index.from_texts(positions, texts)
+    queries, targets = identifier_probes(bm25, texts, n_queries)
+    flat = faiss.IndexFlatIP(embeddings.shape[1])
+    flat.add(embeddings)
+    vectors = np.ascontiguousarray(encode_fn(queries), dtype="float32")
+    depth = max(depth, max(pools))
+    def dense(i):
+        return flat.search(vectors[i:i + 1], depth)[1][0].tolist()
+    def lexical(i):
+        return bm25.search(queries[i], depth)[1].tolist()
+    def hybrid(i):
+        return [cid for cid, _ in reciprocal_rank_fusion([dense(i), lexical(i)], limit=depth)]
+    rows = []
+    for mode, rank_fn in (("dense", dense), ("bm25", lexical), ("hybrid", hybrid)):
+        start = time.perf_counter()
+        rankings = [rank_fn(i) for i in range(len(queries))]
+        ms = 1000 * (time.perf_counter() - start) / max(len(queries), 1)
+        row = {"mode": mode}
+        for pool in pools:
+            row[f"hit@{pool}"] = float(np.mean([t in r[:pool] for r, t in zip(rankings, targets)]))
+        row["ms/query"] = ms
+        rows.append(row)
+    return rows
+# ==================== ADAPTIVE RERANKING ====================
+def passage_probes(texts, n_queries, words=12, min_words=20, seed=7):
+    """
+    Paraphrase-free probes: a random window of words from sampled chunks.
+    Returns:
+        (query texts, target positions)
+    """
+    rng = np.random.RandomState(seed)
+    queries, targets = [], []
+    for pos in rng.permutation(len(texts)):
+        tokens = texts[pos].split()
+        if len(tokens) < min_words:
+            continue
+        start = rng.randint(0, len(tokens) - words + 1)
+        queries.append(" ".join(tokens[start:start + words]))
+        targets.append(int(pos))
+        if len(queries) == n_queries:
+            break
+    return queries, np.array(targets)
+def benchmark_adaptive_rerank(texts, embeddings, encode_fn, score_fn, n_queries=200, k=10, pool=20):
+    """
+    Accuracy and latency of no reranking, full reranking and the adaptive
+    rerank policy on identifier and passage probes.
+    Args:
+        texts: Corpus chunk texts
+        embeddings: Normalized float32 corpus vectors aligned with texts
+        encode_fn: Callable(list of query strings) -> normalized float32 vectors
+        score_fn: Callable(query, list of passages) -> cross-encoder scores
+        k: Chunks kept after reranking (RAG_TOP_K)
+        pool: Retrieved candidates (2 * RAG_TOP_K in rag_answer)
+    Returns:
+        List of dicts with hit@1 / hit@k of the expected chunk, overlap@k
+        with full reranking, latency and the adaptive decision mix
+    """
+    from src.lexical_index import BM25Index
+    from src.rerank_policy import rerank_adaptive, RerankPolicyStats
+    embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+    bm25 = BM25Index.from_texts(np.arange(len(texts), dtype="int64"), texts)
+    id_queries, id_targets = identifier_probes(bm25, texts, n_queries // 2)
+    text_queries, text_targets = passage_probes(texts, n_queries - len(id_queries))
+    queries, targets = id_queries + text_queries, np.concatenate([id_targets, text_targets]).astype(int)
+    flat = faiss.IndexFlatIP(embeddings.shape[1])
+    flat.add(embeddings)
+    scores, positions = flat.search(np.ascontiguousarray(encode_fn(queries), dtype="float32"), pool)
+    pools = []
+    for q, query in enumerate(queries):
+        bm25_scores, bm25_ids = bm25.search(query, pool * 4)
+        lexical = dict(zip(bm25_ids.tolist(), bm25_scores.tolist()))
+        pools.append([{"text": texts[p], "score": float(s), "chunk_id": int(p), "bm25_score": lexical.get(int(p), 0.0)}
+                      for s, p in zip(scores[q], positions[q]) if p >= 0])
+    def reranker(query):
+        def rerank(chunks, top):
+            ce = score_fn(query, [c["text"] for c in chunks])
+            ranked = [{**c, "rerank_score": float(s)} for c, s in zip(chunks, ce)]
+            return sorted(ranked, key=lambda c: c["rerank_score"], reverse=True)[:top]
+        return rerank
+    stats = RerankPolicyStats()
+    modes = {
+        "dense": lambda q: [dict(c) for c in pools[q][:k]],
+        "full": lambda q: reranker(queries[q])(pools[q], k),
+        "adaptive": lambda q: rerank_adaptive(pools[q], k, reranker(queries[q]), stats)[0],
+    }
+    results, rows = {}, []
+    for mode, run in modes.items():
+        start = time.perf_counter()
+        results[mode] = [[c["chunk_id"] for c in run(q)] for q in range(len(queries))]
+        ms = 1000 * (time.perf_counter() - start) / max(len(queries), 1)
+        share = stats.stats()["share"] if mode == "adaptive" else None
+        rows.append({
+            "mode": mode,
+            "hit@1": float(np.mean([r[:1] == [t] for r, t in zip(results[mode], targets)])),
+            f"hit@{k}": float(np.mean([t in r for r, t in zip(results[mode], targets)])),
+            f"overlap@{k}": 0.0,
+            "ms/query": ms,
+            "skip/prefix/full": "/".join(f"{share[a]:.0%}" for a in ("skip", "prefix", "full")) if share else "-",
+        })
+    # Agreement of each mode's top-k with full reranking
+    for row in rows:
+        row[f"overlap@{k}"] = float(np.mean([len(set(r) & set(f)) / max(len(f), 1)
+                                             for r, f in zip(results[row["mode"]], results["full"])]))
+    return rows
+# ==================== RERANKER BACKENDS ====================
+# (label, backend, max length, windows); the first row is the reference:
+# full-length fp32 PyTorch with plain truncation
+RERANKER_CONFIGS = [
+    # Reference: the model's own token limit with plain truncation (the defaults)
+    ("torch", "torch", 0, "off"),
+    ("torch-best", "torch", 0, "best"),
+    ("torch-256", "torch", 256, "off"),
+    ("torch-256-best", "torch", 256, "best"),
+    ("onnx-256-best", "onnx", 256, "best"),
+    ("int8-256-best", "onnx-int8", 256, "best"),
+    ("int8-256-max", "onnx-int8", 256, "max"),
+]
+def benchmark_rerankers(texts, n_queries=100, pool=20, k=5, configs=None):
+    """
+    Compare reranker backends, max lengths and passage windows on BM25
+    candidate pools of identifier and passage probes.
+    Args:
+        texts: Corpus chunk texts
+        pool: Candidates reranked per query
+        k: Cutoff for overlap with the reference ranking
+        configs: Rows of RERANKER_CONFIGS (the first one is the reference)
+    Returns:
+        List of dicts with pairs/s, speedup, score correlation and top-1 /
+        overlap@k agreement with the reference, and hit@1 of the expected chunk
+    """
+    from src.lexical_index import BM25Index
+    from src.reranker import load_reranker
+    configs = configs or RERANKER_CONFIGS
+    bm25 = BM25Index.from_texts(np.arange(len(texts), dtype="int64"), texts)
+    id_queries, id_targets = identifier_probes(bm25, texts, n_queries // 2)
+    text_queries, text_targets = passage_probes(texts, n_queries - len(id_queries))
+    queries, targets = id_queries + text_queries, np.concatenate([id_targets, text_targets]).astype(int)
+    pools = [bm25.search(q, pool)[1].tolist() for q in queries]
+    n_pairs = sum(len(p) for p in pools)
+    reference, rows = None, []
+    for label, backend, max_length, windows in configs:
+        reranker = load_reranker(backend, max_length, windows)
+        start = time.perf_counter()
+        scores = [reranker.predict([[q, texts[p]] for p in candidates]) for q, candidates in zip(queries, pools)]
+        elapsed = time.perf_counter() - start
+        rankings = [[candidates[i] for i in np.argsort(-s, kind="stable")] for s, candidates in zip(scores, pools)]
+        if reference is None:
+            reference = (elapsed, scores, rankings)
+        corr = [np.corrcoef(s, r)[0, 1] for s, r in zip(scores, reference[1]) if len(s) > 1 and s.std() > 0 and r.std() > 0]
+        rows.append({
+            "reranker": label,
+            "pairs/s": n_pairs / elapsed,
+            "speedup": reference[0] / elapsed,
+            "score_corr": float(np.mean(corr)) if corr else 1.0,
+            "top1_agree": float(np.mean([r[:1] == f[:1] for r, f in zip(rankings, reference[2])])),
+            f"overlap@{k}": float(np.mean([len(set(r[:k]) & set(f[:k])) / max(min(k, len(f)), 1)
+                                           for r, f in zip(rankings, reference[2])])),
+            "hit@1": float(np.mean([r[:1] == [t] for r, t in zip(rankings, targets)])),
+        })
+    return rows
+# ==================== ENCODER BACKENDS ====================
+def benchmark_encoders(texts, model_name=None, batch_size=32):
+    """
+    Compare PyTorch, ONNX and ONNX-int8 encoders on the same texts.
+    Returns:
+        List of dicts with throughput, speedup and cosine agreement vs PyTorch
+    """
+    from src import embedder
+    from src.onnx_backend import load_onnx_encoder, cosine_agreement
+    model_name = model_name or embedder.MODEL_NAME
+    torch_model = embedder._load_torch_embedder()
+    start = time.perf_counter()
+    reference = torch_model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+    torch_s = time.perf_counter() - start
+    rows = [{"backend": "torch", "texts/s": len(texts) / torch_s, "speedup": 1.0,
+             "mean_cos": 1.0, "min_cos": 1.0}]
+    for quantize in (False, True):
+        encoder = load_onnx_encoder(model_name, quantize, lambda: torch_model)
+        if encoder is None:
+            continue
+        start = time.perf_counter()
+        vectors = encoder.encode(texts, batch_size=batch_size)
+        elapsed = time.perf_counter() - start
+        cos = cosine_agreement(reference, vectors)
+        rows.append({
+            "backend": "onnx-int8" if quantize else "onnx",
+            "texts/s": len(texts) / elapsed,
+            "speedup": torch_s / elapsed,
+            "mean_cos": float(cos.mean()),
+            "min_cos": float(cos.min()),
+        })
+    return rows
+# ==================== CORPUS LOADING ====================
+def load_corpus_vectors():
+    """
+    Vectors of the chunks in the current index, served from the embedding
+    cache (only uncached chunks hit the encoder).
+    Returns:
+        (embeddings, metas)
+    """
+    from src import embedder
+    index, metas = embedder.create_or_load_index(None)
+    embeddings = embedder._encode_texts([m["text"] for m in metas])
+    return embeddings, metas
+def query_encoder(reducer=None):
+    """
+    Encode probe queries like served queries: embed_query, projected by the
+    snapshot's reducer. Probes never enter the shared document cache.
+    """
+    from src import embedder
+    return lambda queries: np.vstack([embedder.embed_query(q, reducer) for q in queries])
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Retrieval benchmarks on the current corpus")
+    parser.add_argument("suite", choices=["storage", "encoder", "routing", "dims", "hybrid", "rerank", "reranker"])
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--synthetic", type=int, default=0,
+                        help="storage only: benchmark N clustered random vectors instead of the corpus")
+    parser.add_argument("--dim", type=int, default=384, help="dimension of --synthetic vectors")
+    args = parser.parse_args(argv)
+    if args.suite == "storage" and args.synthetic:
+        embeddings = synthetic_corpus(args.synthetic, args.dim)
+        rows = benchmark_storage_modes(embeddings, sample_queries(embeddings, args.queries), k=args.k)
+        print_report(f"Storage precision vs IndexFlatIP ({len(embeddings)} synthetic {args.dim}-d vectors, "
+                     f"k={args.k})", rows)
+        return
+    if args.suite == "encoder":
+        from src import embedder
+        _, metas = embedder.create_or_load_index(None)
+        texts = [m["text"] for m in metas[:args.queries * 5]]
+        print_report(f"Encoder backends ({len(texts)} chunks)", benchmark_encoders(texts))
+        return
+    if args.suite == "reranker":
+        from src import embedder
+        _, metas = embedder.create_or_load_index(None)
+        texts = [m["text"] for m in metas]
+        rows = benchmark_rerankers(texts, n_queries=min(args.queries, 100), k=args.k)
+        print_report(f"Reranker backends vs full-length PyTorch ({len(texts)} chunks)", rows)
+        return
+    embeddings, metas = load_corpus_vectors()
+    if args.suite in ("hybrid", "rerank"):
+        # Probe queries are searched like the served index: reduced vectors
+        reducer = metas.reducer()
+        if reducer is not None:
+            embeddings = reducer.apply(embeddings)
+        encode_queries = query_encoder(reducer)
+    if args.suite == "hybrid":
+        texts = [m["text"] for m in metas]
+        rows = benchmark_hybrid(texts, embeddings, encode_queries, n_queries=args.queries)
+        print_report(f"Hybrid vs dense retrieval on identifier probes ({len(texts)} chunks)", rows)
+        return
+    if args.suite == "rerank":
+        from src.reranker import load_reranker
+        # Same reranker configuration as rag_pipeline
+        reranker = load_reranker()
+        score_fn = lambda query, passages: reranker.predict([[query, p] for p in passages])
+        texts = [m["text"] for m in metas]
+        rows = benchmark_adaptive_rerank(texts, embeddings, encode_queries, score_fn,
+                                         n_queries=args.queries, k=args.k, pool=2 * args.k)
+        print_report(f"Adaptive rerank depth vs full reranking ({len(texts)} chunks, k={args.k})", rows)
+        return
+    queries = sample_queries(embeddings, args.queries)
+    if args.suite == "storage":
+        rows = benchmark_storage_modes(embeddings, queries, k=args.k)
+        print_report(f"Storage precision vs IndexFlatIP ({len(embeddings)} vectors, k={args.k})", rows)
+    elif args.suite == "routing":
+        doc_of = [metas.source_names[c] if c >= 0 else "Unknown" for c in metas.source_codes]
+        rows = benchmark_doc_routing(embeddings, doc_of, queries, k=args.k)
+        print_report(f"Document routing vs IndexFlatIP ({len(embeddings)} vectors, k={args.k})", rows)
+    elif args.suite == "dims":
+        rows = benchmark_dimensions(embeddings, queries, k=args.k)
+        print_report(f"Reduced dimensions vs full vectors ({len(embeddings)} vectors, k={args.k})", rows)
+__all__ = [
+    'exact_neighbors',
+    'recall_at_k',
+    'time_search',
+    'sample_queries',
+    'query_encoder',
+    'synthetic_corpus',
+    'print_report',
+    'benchmark_storage_modes',
+    'benchmark_doc_routing',
+    'benchmark_dimensions',
+    'benchmark_hybrid',
+    'benchmark_adaptive_rerank',
+    'passage_probes',
+    'benchmark_rerankers',
+    'identifier_probes',
+    'benchmark_encoders',
+    'load_corpus_vectors'
+]
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+# src/sharded_index.py
+"""
+Per-source sharded FAISS index with parallel scatter-gather search.
+
+Each source file (or collection) gets its own small index under
+INDEX_DIR/shards/<key>/. Shards are rebuilt independently when their chunk
+set changes, loaded lazily the first time a search selects them, searched
+in parallel on a thread pool (FAISS releases the GIL) and merged with a
+heap. ShardedIndex exposes d, ntotal and search(x, k) like a FAISS index,
+so search_index works with either.
+"""
+import hashlib
+import heapq
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import faiss
+import numpy as np
+from src.index_factory import build_index, configure_search, index_label, read_index, reconstruct_ids, search_filtered
+from src.utils import ConfigManager
+logger = logging.getLogger(__name__)
+SHARD_SEARCH_THREADS = ConfigManager.get("SHARD_SEARCH_THREADS", 8, config_type=int)
+def collection_of(chunk) -> str:
+    """Shard a chunk belongs to: its source file."""
+    return chunk.get("metadata", {}).get("source_file") or "Unknown"
+def shard_key(collection: str) -> str:
+    """Filesystem-safe, collision-free directory name for a collection."""
+    slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", collection)[:60]
+    return f"{slug}-{hashlib.sha1(collection.encode('utf-8')).hexdigest()[:8]}"
+def _id_set_hash(ids) -> str:
+    return hashlib.sha256(np.sort(np.asarray(ids, dtype="int64")).tobytes()).hexdigest()
+class ShardedIndex:
+    """A set of per-collection FAISS indexes searched as one."""
+    def __init__(self, root, max_workers: int = None, use_mmap: bool = False):
+        self.root = Path(root)
+        self.use_mmap = use_mmap
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.manifest_file = self.root / "shards.json"
+        self.manifest = (
+            json.loads(self.manifest_file.read_text(encoding="utf-8"))
+            if self.manifest_file.exists() else {"settings": None, "shards": {}}
+        )
+        self._loaded = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers or SHARD_SEARCH_THREADS,
+                                        thread_name_prefix="shard-search")
+    # ---------- FAISS-like surface ----------
+    @property
+    def shards(self):
+        return self.manifest["shards"]
+    @property
+    def d(self):
+        settings = self.manifest.get("settings") or {}
+        # Vectors are stored reduced when the settings carry a reduction
+        return (settings.get("reduction") or {}).get("dim", settings.get("dim", 0))
+    @property
+    def ntotal(self):
+        return sum(info["ntotal"] for info in self.shards.values())
+    def search(self, x, k, sources=None, ids=None):
+        """
+        Scatter a query batch to the selected shards and gather the top-k.
+        Args:
+            x: float32 query matrix (nq, d)
+            k: Results per query
+            sources: Optional iterable of collections to restrict to
+            ids: Optional allowed chunk IDs (applied inside each shard's scan)
+        Returns:
+            (scores, ids) arrays of shape (nq, k), padded with -inf / -1
+        """
+        x = np.ascontiguousarray(x, dtype="float32")
+        keys = self.select(sources)
+        futures = [self._pool.submit(self._search_shard, key, x, k, ids) for key in keys]
+        partials = [f.result() for f in futures]
+        nq = x.shape[0]
+        scores = np.full((nq, k), -np.inf, dtype="float32")
+        ids = np.full((nq, k), -1, dtype="int64")
+        for q in range(nq):
+            candidates = (
+                (float(s), int(i))
+                for part_scores, part_ids in partials
+                for s, i in zip(part_scores[q], part_ids[q]) if i != -1
+            )
+            for rank, (s, i) in enumerate(heapq.nlargest(k, candidates)):
+                scores[q, rank] = s
+                ids[q, rank] = i
+        return scores, ids
+    def _search_shard(self, key, x, k, ids=None):
+        if ids is not None:
+            return search_filtered(self._load(key), x, k, ids)
+        return self._load(key).search(x, k)
+    # ---------- shard selection / loading ----------
+    def select(self, sources=None):
+        """Shard keys for the given collections (all shards if None)."""
+        if sources is None:
+            return list(self.shards)
+        wanted = {shard_key(s) for s in sources}
+        return [key for key in self.shards if key in wanted]
+    def _load(self, key):
+        index = self._loaded.get(key)
+        if index is not None:
+            return index
+        with self._lock:
+            if key not in self._loaded:
+                index = read_index(self.root / key / "faiss.index", self.use_mmap)
+                self._loaded[key] = configure_search(index)
+            return self._loaded[key]
+    def loaded_shards(self):
+        return list(self._loaded)
+    def reconstruct(self, collection, ids):
+        """Stored vectors of chunk IDs in one collection's shard."""
+        return reconstruct_ids(self._load(shard_key(collection)), ids)
+    # ---------- building ----------
+    def sync(self, chunks, encode_fn, settings, index_type=None, force=False):
+        """
+        Rebuild only the shards whose chunk set changed and drop shards whose
+        collection disappeared.
+        Args:
+            chunks: Current chunks (carrying chunk_id)
+            encode_fn: Callable mapping texts to normalized float32 vectors
+            settings: Model settings dict (model/dim/normalize); a change forces a full rebuild
+            index_type: Passed to index_factory (per shard, so "auto" sizes each shard)
+            force: Rebuild every shard
+        Returns:
+            (rebuilt, removed) shard counts
+        """
+        if settings != self.manifest.get("settings"):
+            force = True
+        groups = {}
+        for c in chunks:
+            groups.setdefault(collection_of(c), []).append(c)
+        wanted = {shard_key(name): (name, group) for name, group in groups.items()}
+        rebuilt = 0
+        for key, (name, group) in wanted.items():
+            info = self.shards.get(key)
+            ids = [c["chunk_id"] for c in group]
+            label = index_label(len(group), index_type)
+            if force or not info or info["id_hash"] != _id_set_hash(ids) or info["index_type"] != label:
+                self.rebuild_shard(name, group, encode_fn, index_type, save_manifest=False)
+                rebuilt += 1
+        removed = [key for key in self.shards if key not in wanted]
+        for key in removed:
+            self._drop(key)
+        self.manifest["settings"] = settings
+        self._save_manifest()
+        return rebuilt, len(removed)
+    def rebuild_shard(self, collection, chunks, encode_fn, index_type=None, save_manifest=True):
+        """Re-embed (from cache) and rewrite a single shard."""
+        key = shard_key(collection)
+        embeddings = encode_fn([c["text"] for c in chunks])
+        ids = np.array([c["chunk_id"] for c in chunks], dtype="int64")
+        index, _ = build_index(embeddings, ids, index_type)
+        shard_dir = self.root / key
+        shard_dir.mkdir(parents=True, exist_ok=True)
+        # Write + rename: the old file may be hard-linked into a published snapshot
+        tmp = shard_dir / "faiss.index.tmp"
+        faiss.write_index(index, str(tmp))
+        os.replace(tmp, shard_dir / "faiss.index")
+        with self._lock:
+            self.shards[key] = {
+                "collection": collection,
+                "ntotal": int(index.ntotal),
+                "id_hash": _id_set_hash(ids),
+                "index_type": index_label(len(chunks), index_type),
+            }
+            # Swap in the new shard only if it was already resident
+            if key in self._loaded:
+                self._loaded[key] = index
+        if save_manifest:
+            self._save_manifest()
+        logger.info(f"Rebuilt shard {key} ({len(chunks)} chunks)")
+    def drop_collection(self, collection) -> bool:
+        """Remove one collection's shard in place (no re-embedding). Returns False if absent."""
+        key = shard_key(collection)
+        if key not in self.shards:
+            return False
+        self._drop(key)
+        self._save_manifest()
+        return True
+    def _drop(self, key):
+        with self._lock:
+            self.shards.pop(key, None)
+            self._loaded.pop(key, None)
+        shutil.rmtree(self.root / key, ignore_errors=True)
+    def _save_manifest(self):
+        tmp = self.manifest_file.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps(self.manifest, indent=2), encoding="utf-8")
+        os.replace(tmp, self.manifest_file)
+    def close(self):
+        """Stop the search pool and drop loaded shards."""
+        self._pool.shutdown(wait=False)
+        with self._lock:
+            self._loaded.clear()
+__all__ = ['ShardedIndex', 'collection_of', 'shard_key']
@@ -0,0 +1,306 @@
+# src/snapshots.py
+"""
+Versioned index snapshots published by atomic rename.
+
+    VECTOR_DB_PATH/
+        CURRENT                  name of the live snapshot
+        snapshots/<version>/     faiss.index or shards/, chunks.sqlite, manifest.json
+        embedding_cache/         shared, append-only (not versioned)
+
+A build writes into snapshots/.staging-<version>, records a SHA-256 of
+every file in manifest.json, renames the directory into place and then
+replaces CURRENT (write CURRENT.tmp + os.replace). A crash at any point
+leaves the previous snapshot live and intact. Files in a snapshot are
+never modified after publishing: staging directories copy what they will
+mutate (the chunk store) and hard-link what they only replace. Files a
+snapshot shares with the live one by hard link keep the live manifest's
+checksum and are neither re-read nor re-synced, so publishing a small
+change (e.g. a deletion) costs the size of the change.
+
+SnapshotWatcher lets a running app pick up newly published snapshots in
+the background; readers keep using the snapshot they started with.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+from src.utils import ConfigManager
+logger = logging.getLogger(__name__)
+SNAPSHOT_KEEP = ConfigManager.get("SNAPSHOT_KEEP", 3, config_type=int)
+SNAPSHOT_POLL_SECONDS = ConfigManager.get("SNAPSHOT_POLL_SECONDS", 10.0, config_type=float)
+# Retired snapshots stay open this long for queries that are still running
+SNAPSHOT_GRACE_SECONDS = ConfigManager.get("SNAPSHOT_GRACE_SECONDS", 60.0, config_type=float)
+SNAPSHOT_VERIFY = ConfigManager.get("SNAPSHOT_VERIFY", "true", config_type=bool)
+STAGING_PREFIX = ".staging-"
+# Unpublished staging directories older than this are leftovers of a crashed build
+STALE_STAGING_SECONDS = 6 * 3600
+# ==================== LAYOUT ====================
+def snapshots_dir(root) -> Path:
+    return Path(root) / "snapshots"
+def current_version(root):
+    """Name of the live snapshot, or None if nothing was published yet."""
+    pointer = Path(root) / "CURRENT"
+    if not pointer.exists():
+        return None
+    version = pointer.read_text(encoding="utf-8").strip()
+    return version or None
+def current_dir(root):
+    """Directory of the live snapshot, or None."""
+    version = current_version(root)
+    if version is None:
+        return None
+    path = snapshots_dir(root) / version
+    return path if path.is_dir() else None
+def _new_version() -> str:
+    now = time.time()
+    return f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}-{int(now * 1000) % 1000:03d}-{uuid.uuid4().hex[:6]}"
+# ==================== STAGING ====================
+def _link_tree(src: Path, dst: Path):
+    """Hard-link a file or directory tree (copy where linking is not possible)."""
+    if src.is_dir():
+        dst.mkdir(parents=True, exist_ok=True)
+        for child in src.iterdir():
+            _link_tree(child, dst / child.name)
+        return
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+def stage(root, base=None, link=(), copy=()):
+    """
+    Create a staging directory for the next snapshot.
+    Args:
+        root: VECTOR_DB_PATH
+        base: Snapshot to start from (None = empty)
+        link: Names to hard-link from base (must be replaced, never rewritten in place)
+        copy: Names to copy from base (files the build mutates, e.g. chunks.sqlite)
+    Returns:
+        Path of the staging directory
+    """
+    staging = snapshots_dir(root) / f"{STAGING_PREFIX}{_new_version()}"
+    staging.mkdir(parents=True)
+    if base is not None:
+        base = Path(base)
+        for name in link:
+            if (base / name).exists():
+                _link_tree(base / name, staging / name)
+        for name in copy:
+            if (base / name).exists():
+                shutil.copy2(base / name, staging / name)
+    return staging
+def discard(staging):
+    """Drop an unpublished staging directory."""
+    shutil.rmtree(staging, ignore_errors=True)
+# ==================== PUBLISHING ====================
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+def file_checksums(snapshot, known=None) -> dict:
+    """
+    SHA-256 of every file in a snapshot except manifest.json.
+    Args:
+        known: Checksums to reuse instead of reading files (see _linked_checksums)
+    """
+    snapshot = Path(snapshot)
+    known = known or {}
+    checksums = {}
+    for p in sorted(snapshot.rglob("*")):
+        if p.is_file() and p.name != "manifest.json":
+            rel = str(p.relative_to(snapshot)).replace(os.sep, "/")
+            checksums[rel] = known[rel] if rel in known else _sha256(p)
+    return checksums
+def _linked_checksums(snapshot, base) -> dict:
+    """Checksums base's manifest records for files snapshot shares with it by hard link."""
+    if base is None or not (Path(base) / "manifest.json").exists():
+        return {}
+    recorded = json.loads((Path(base) / "manifest.json").read_text(encoding="utf-8")).get("checksums") or {}
+    shared = {}
+    for rel, digest in recorded.items():
+        try:
+            if os.path.samefile(Path(snapshot) / rel, Path(base) / rel):
+                shared[rel] = digest
+        except OSError:
+            continue
+    return shared
+def _fsync_file(path: Path):
+    with open(path, "rb") as f:
+        os.fsync(f.fileno())
+def _fsync_dir(path: Path):
+    """Persist a rename (no-op where directories cannot be opened, e.g. Windows)."""
+    try:
+        fd = os.open(str(path), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+def publish(root, staging) -> Path:
+    """
+    Checksum, rename into place and point CURRENT at a staged snapshot.
+    Settings already in staging/manifest.json are kept.
+    Returns:
+        Path of the published snapshot
+    """
+    root = Path(root)
+    staging = Path(staging)
+    version = staging.name[len(STAGING_PREFIX):]
+    manifest_file = staging / "manifest.json"
+    manifest = json.loads(manifest_file.read_text(encoding="utf-8")) if manifest_file.exists() else {}
+    # Files hard-linked from the live snapshot are already checksummed and durable
+    linked = _linked_checksums(staging, current_dir(root))
+    manifest.update({
+        "version": version,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "checksums": file_checksums(staging, linked),
+    })
+    manifest_file.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    for p in staging.rglob("*"):
+        if p.is_file() and str(p.relative_to(staging)).replace(os.sep, "/") not in linked:
+            _fsync_file(p)
+    target = snapshots_dir(root) / version
+    os.replace(staging, target)
+    _fsync_dir(snapshots_dir(root))
+    pointer_tmp = root / "CURRENT.tmp"
+    pointer_tmp.write_text(version, encoding="utf-8")
+    _fsync_file(pointer_tmp)
+    os.replace(pointer_tmp, root / "CURRENT")
+    _fsync_dir(root)
+    print(f"📦 Published index snapshot {version}")
+    prune(root)
+    return target
+def verify(snapshot, trusted=None) -> bool:
+    """
+    Check every file against the checksums in the snapshot manifest.
+    Args:
+        trusted: Snapshot already being served; files shared with it by
+            hard link are compared by its recorded checksums, not re-read
+    """
+    snapshot = Path(snapshot)
+    manifest_file = snapshot / "manifest.json"
+    if not manifest_file.exists():
+        return False
+    expected = json.loads(manifest_file.read_text(encoding="utf-8")).get("checksums")
+    return expected is not None and file_checksums(snapshot, _linked_checksums(snapshot, trusted)) == expected
+def prune(root, keep: int = None):
+    """Delete old snapshots (keeping the live one) and stale staging directories."""
+    keep = SNAPSHOT_KEEP if keep is None else keep
+    live = current_version(root)
+    base = snapshots_dir(root)
+    if not base.exists():
+        return
+    # Oldest first by publish time (names can tie within a millisecond)
+    published = sorted(
+        (p for p in base.iterdir() if p.is_dir() and not p.name.startswith(STAGING_PREFIX)),
+        key=lambda p: (p / "manifest.json").stat().st_mtime if (p / "manifest.json").exists() else 0.0,
+    )
+    for p in published[:-keep] if keep > 0 else published:
+        if p.name != live:
+            shutil.rmtree(p, ignore_errors=True)
+    now = time.time()
+    for p in base.glob(f"{STAGING_PREFIX}*"):
+        if now - p.stat().st_mtime > STALE_STAGING_SECONDS:
+            shutil.rmtree(p, ignore_errors=True)
+def adopt_legacy(root, names):
+    """Move pre-snapshot index files from root into a first published snapshot."""
+    root = Path(root)
+    staging = stage(root)
+    for name in names:
+        if (root / name).exists():
+            os.replace(root / name, staging / name)
+    return publish(root, staging)
+# ==================== HOT SWAP ====================
+class SnapshotWatcher:
+    """
+    Serves the live (index, metas) pair and swaps to newly published
+    snapshots on a background thread. Models are untouched; in-flight
+    queries keep the objects they already hold.
+    """
+    def __init__(self, root, loader, initial, poll_seconds: float = None):
+        """
+        Args:
+            root: VECTOR_DB_PATH
+            loader: Callable(snapshot_dir) -> (index, metas)
+            initial: (index, metas) currently served
+            poll_seconds: How often CURRENT is checked
+        """
+        self.root = Path(root)
+        self.loader = loader
+        self.poll_seconds = SNAPSHOT_POLL_SECONDS if poll_seconds is None else poll_seconds
+        self.version = current_version(self.root)
+        self._current = tuple(initial)
+        self._lock = threading.Lock()
+        self._retired = []
+        self._failed = set()
+        self._stop = threading.Event()
+        self._thread = None
+    def current(self):
+        """The (index, metas) pair to use for one query."""
+        with self._lock:
+            return self._current
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="snapshot-watcher", daemon=True)
+            self._thread.start()
+        return self
+    def stop(self):
+        self._stop.set()
+    def _run(self):
+        while not self._stop.wait(self.poll_seconds):
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Snapshot check failed: {e}")
+    def check(self) -> bool:
+        """Swap to the published snapshot if it changed. Returns True on swap."""
+        self._close_retired()
+        version = current_version(self.root)
+        if version is None or version == self.version or version in self._failed:
+            return False
+        path = snapshots_dir(self.root) / version
+        served = snapshots_dir(self.root) / self.version if self.version else None
+        if SNAPSHOT_VERIFY and not verify(path, served):
+            logger.error(f"Snapshot {version} failed checksum verification; keeping {self.version}")
+            self._failed.add(version)
+            return False
+        loaded = tuple(self.loader(path))
+        with self._lock:
+            old = self._current
+            self._current = loaded
+            previous, self.version = self.version, version
+        self._retired.append((time.time(), old))
+        print(f"🔄 Swapped index snapshot {previous} → {version}")
+        return True
+    def _close_retired(self):
+        now = time.time()
+        keep = []
+        for retired_at, objects in self._retired:
+            if now - retired_at < SNAPSHOT_GRACE_SECONDS:
+                keep.append((retired_at, objects))
+                continue
+            for obj in objects:
+                close = getattr(obj, "close", None)
+                if callable(close):
+                    close()
+        self._retired = keep
+__all__ = [
+    'SnapshotWatcher',
+    'current_version',
+    'current_dir',
+    'stage',
+    'discard',
+    'publish',
+    'verify',
+    'prune',
+    'adopt_legacy'
+]
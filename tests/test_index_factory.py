@@ -0,0 +1,24 @@
+# tests/test_index_factory.py
+"""Build checks for trained indexes on corpora above the training sample cap."""
+import numpy as np
+import pytest
+from src.utils import ConfigManager
+from src.index_factory import build_index, PQ_NBITS
+# Training samples are capped at max(nlist, 2^PQ_NBITS) * 256 vectors
+SAMPLE_CAP = (1 << PQ_NBITS) * 256
+def _corpus(n, dim=16, seed=0):
+    x = np.random.RandomState(seed).rand(n, dim).astype("float32") - 0.5
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+@pytest.fixture
+def untyped_seed(monkeypatch):
+    """RANDOM_SEED cached as a string, as embedder's get_env_var read leaves it."""
+    monkeypatch.setitem(ConfigManager._config_cache, "RANDOM_SEED", "42")
+@pytest.mark.parametrize("index_type,precision", [("flat", "sq8"), ("flat", "pq")])
+def test_build_above_sample_cap(untyped_seed, index_type, precision):
+    n = SAMPLE_CAP + 4000
+    x = _corpus(n)
+    index, resolved = build_index(x, np.arange(n), index_type, precision, "none")
+    assert resolved == index_type
+    assert index.ntotal == n
+    _, ids = index.search(x[:5], 1)
+    assert ids.shape == (5, 1) and (ids >= 0).all()